@@ -0,0 +1,199 @@
+"""Background writer for streaming bladeRF captures to disk
+
+At 20 MS/s a bladeRF produces 80 MB/s of SC16 Q11 data, and a single slow
+`write` call on the receive thread is enough to overrun the device FIFOs.
+The classes here decouple the two: the receive thread only fills buffers
+taken from a preallocated pool and hands them over through a bounded queue,
+while a separate writer thread drains the queue to disk and returns the
+buffers to the pool.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+from typing import BinaryIO, Optional
+
+import telemetry
+
+
+class AsyncWriter:
+    """Double-buffered writer backed by a pool of preallocated buffers
+
+    Buffers cycle between two queues. The free pool holds buffers which are
+    ready to be filled by the receive thread, and the filled queue holds
+    buffers waiting to be written to disk. Both are bounded by the size of
+    the pool, so memory use is fixed regardless of capture length.
+
+    Attributes:
+        buffer_bytes: An `int` with the size of each buffer in the pool.
+        num_buffers: An `int` with the number of buffers in the pool.
+        high_water: An `int` with the largest number of filled buffers that
+                    were waiting to be written at any point.
+        stalls: An `int` with the number of times the receive thread had to
+                wait for a free buffer, i.e. the disk could not keep up.
+        buffers_written: An `int` with the number of buffers written.
+        bytes_written: An `int` with the number of bytes written.
+    """
+
+    def __init__(self, out_file: BinaryIO, buffer_bytes: int,
+                 num_buffers: int = 64,
+                 logger: Optional[logging.Logger] = None,
+                 stats: Optional[telemetry.Telemetry] = None):
+        """Allocates the buffer pool and starts the writer thread
+
+        Args:
+            out_file: An open binary file object to write the buffers to.
+            buffer_bytes: An `int` with the size, in bytes, of each buffer.
+            num_buffers: An `int` with the number of buffers in the pool.
+                         Together with `buffer_bytes` this sets how long a
+                         disk stall can be absorbed without losing samples.
+            logger: An optional `logging.Logger` object for diagnostics.
+            stats: An optional `telemetry.Telemetry` object, to which the
+                   duration of every write is recorded as `write`.
+
+        Raises:
+            ValueError: If `buffer_bytes` or `num_buffers` is not positive.
+        """
+
+        if buffer_bytes <= 0 or num_buffers <= 0:
+            raise ValueError("Buffer size and count must be positive")
+
+        self.out_file = out_file
+        self.buffer_bytes = buffer_bytes
+        self.num_buffers = num_buffers
+        self.logger = logger if logger is not None else logging.getLogger()
+        self.stats = stats
+
+        self._free = queue.Queue(maxsize=num_buffers)
+        self._filled = queue.Queue(maxsize=num_buffers)
+        for _ in range(num_buffers):
+            self._free.put_nowait(bytearray(buffer_bytes))
+
+        self.high_water = 0
+        self.stalls = 0
+        self.buffers_written = 0
+        self.bytes_written = 0
+        self.write_time = 0.0
+
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._drain, name="AsyncWriter", daemon=True
+        )
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def depth(self) -> int:
+        """Number of filled buffers currently waiting to be written"""
+        return self._filled.qsize()
+
+    def get_buffer(self) -> bytearray:
+        """Takes a free buffer from the pool, waiting if none is available
+
+        Returns:
+            A `bytearray` of `buffer_bytes` length to be filled by the caller
+            and then handed back with `submit`.
+
+        Raises:
+            RuntimeError: If the writer thread has failed.
+        """
+
+        self._check_error()
+
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            self.stalls += 1
+
+        while True:
+            try:
+                return self._free.get(timeout=0.5)
+            except queue.Empty:
+                self._check_error()
+
+    def submit(self, buffer: bytearray, num_bytes: int) -> None:
+        """Queues a filled buffer for writing
+
+        Args:
+            buffer: A `bytearray` previously obtained from `get_buffer`.
+            num_bytes: An `int` with the number of valid bytes in `buffer`.
+
+        Raises:
+            RuntimeError: If the writer thread has failed.
+        """
+
+        self._check_error()
+        self._filled.put((buffer, num_bytes))
+
+        depth = self._filled.qsize()
+        if depth > self.high_water:
+            self.high_water = depth
+
+    def close(self) -> None:
+        """Flushes all pending buffers and stops the writer thread
+
+        Raises:
+            RuntimeError: If the writer thread has failed.
+        """
+
+        if not self._closed:
+            self._closed = True
+            self._filled.put(None)
+            self._thread.join()
+
+        self._check_error()
+
+    def log_stats(self) -> None:
+        """Writes a summary of the queue usage to the log"""
+
+        self.logger.info(
+            f"Writer: {self.buffers_written} buffers, "
+            f"{self.bytes_written:.3e} bytes written in "
+            f"{self.write_time:.3f} sec"
+        )
+        self.logger.info(
+            f"Writer queue depth: {self.depth}, high-water mark: "
+            f"{self.high_water} of {self.num_buffers} buffers"
+        )
+        if self.stalls:
+            self.logger.warning(
+                f"Receive thread waited for a free buffer {self.stalls} "
+                f"times - disk is not keeping up"
+            )
+
+    def _check_error(self) -> None:
+        if self._error is not None:
+            raise RuntimeError("Capture writer thread failed") from self._error
+
+    def _drain(self) -> None:
+        while True:
+            item = self._filled.get()
+            if item is None:
+                break
+
+            buffer, num_bytes = item
+
+            if self._error is None:
+                start = time.perf_counter()
+                try:
+                    self.out_file.write(memoryview(buffer)[:num_bytes])
+                except BaseException as error:
+                    self.logger.critical(f"Capture write failed: {error}")
+                    self._error = error
+                else:
+                    duration = time.perf_counter() - start
+                    self.write_time += duration
+                    if self.stats is not None:
+                        self.stats.record("write", duration)
+                    self.buffers_written += 1
+                    self.bytes_written += num_bytes
+
+            self._free.put_nowait(buffer)
@@ -0,0 +1,358 @@
+"""Batch offline analysis of many capture files
+
+Runs the same analysis over every capture of a measurement campaign and
+collects the results in one summary table, instead of opening each capture
+by hand in a notebook. Every capture is split into chunks of samples, and
+the chunks of all captures are spread over a pool of worker processes.
+Each worker opens the capture itself, memory-mapped or, for chunked
+captures, decompressing only what it needs, and goes through its chunk in
+fixed-size blocks, so the memory used per worker does not depend on the
+size of the captures. The workers return small partial results - summed
+PSDs and power statistics - which are merged per capture.
+
+Run this module as a script, e.g.::
+
+    python batch_analysis.py captures/*.iqbin --summary summary.csv
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import glob
+import logging
+import os
+
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+import chunkfile
+import dsp
+
+
+SUMMARY_COLUMNS = (
+    "filename", "num_samples", "duration", "sample_rate", "freq_centre",
+    "mean_power_dbfs", "peak_power_dbfs", "papr_db", "dc_i", "dc_q",
+    "clipped", "tone_frequency", "tone_power_dbfs", "tone_snr_db",
+)
+
+# * Largest magnitude of an SC16 Q11 value
+FULL_SCALE = 2047
+
+
+def _empty_stats(fft_size: int) -> dict:
+    return {
+        "num_samples": 0,
+        "energy": 0.0,
+        "peak": 0,
+        "sum_i": 0,
+        "sum_q": 0,
+        "clipped": 0,
+        "power_sum": np.zeros(fft_size, dtype=np.float64),
+        "num_frames": 0,
+    }
+
+
+def analyse_chunk(filename: str, offset: int, count: int, settings: dict):
+    """Analyses one chunk of a capture file
+
+    Runs in a worker process, so it only takes and returns picklable,
+    compact values.
+
+    Args:
+        filename: A `str` with the path to the capture file.
+        offset: An `int` with the index of the first sample of the chunk.
+        count: An `int` with the number of samples in the chunk.
+        settings: A `dict` with `fft_size`, `window`, `overlap` and
+                  `block_samples`.
+
+    Returns:
+        A `tuple` of `filename`, `offset` and a `dict` of partial results
+        which can be combined with `merge_stats`.
+    """
+
+    block_samples = settings["block_samples"]
+    psd = dsp.StreamingPSD(
+        settings["fft_size"], settings["window"], settings["overlap"]
+    )
+    processor = dsp.StreamProcessor(block_samples, [psd])
+    stats = _empty_stats(settings["fft_size"])
+
+    with chunkfile.open_capture(filename) as reader:
+        for start in range(offset, offset + count, block_samples):
+            block = np.ascontiguousarray(reader.read_raw(
+                start, min(block_samples, offset + count - start)
+            ))
+            num = block.shape[0]
+            if num == 0:
+                break
+
+            power = np.einsum("ij,ij->i", block, block, dtype=np.int64)
+            sums = block.sum(axis=0, dtype=np.int64)
+
+            stats["num_samples"] += num
+            stats["energy"] += float(power.sum())
+            stats["peak"] = max(stats["peak"], int(power.max()))
+            stats["sum_i"] += int(sums[0])
+            stats["sum_q"] += int(sums[1])
+            stats["clipped"] += int(
+                np.count_nonzero(np.abs(block).max(axis=1) >= FULL_SCALE)
+            )
+
+            processor.process(block, num)
+
+    stats["power_sum"], stats["num_frames"] = psd.partial()
+
+    return filename, offset, stats
+
+
+def merge_stats(total: dict, partial: dict) -> None:
+    """Adds the partial results of one chunk to the totals of a capture"""
+
+    for key in ("num_samples", "energy", "sum_i", "sum_q", "clipped",
+                "power_sum", "num_frames"):
+        total[key] += partial[key]
+    total["peak"] = max(total["peak"], partial["peak"])
+
+
+def _db(value: float) -> float:
+    return float(10 * np.log10(max(value, 1e-30)))
+
+
+def summarise(filename: str, stats: dict, metadata: dict,
+              settings: dict) -> dict:
+    """Turns the merged results of a capture into a row of the summary
+
+    Args:
+        filename: A `str` with the path to the capture file.
+        stats: A `dict` of merged results, see `analyse_chunk`.
+        metadata: A `dict` with the sidecar contents of the capture.
+        settings: A `dict` with the analysis settings, including the
+                  `sample_rate` to use if the sidecar has none, and the
+                  optional `psd_dir` to save the averaged PSD to.
+
+    Returns:
+        A `dict` with the keys in `SUMMARY_COLUMNS`.
+    """
+
+    sample_rate = metadata.get("sample_rate", settings["sample_rate"])
+    freq_centre = metadata.get("freq_centre", 0.0)
+    num_samples = stats["num_samples"]
+    scale = float(1 << 22)  # * 2048 ** 2, full scale power in counts
+
+    row = dict.fromkeys(SUMMARY_COLUMNS)
+    row.update(
+        filename=filename,
+        num_samples=num_samples,
+        duration=num_samples / sample_rate,
+        sample_rate=sample_rate,
+        freq_centre=freq_centre,
+        clipped=stats["clipped"],
+    )
+
+    if num_samples:
+        mean_power = stats["energy"] / num_samples / scale
+        peak_power = stats["peak"] / scale
+        row.update(
+            mean_power_dbfs=_db(mean_power),
+            peak_power_dbfs=_db(peak_power),
+            papr_db=_db(peak_power) - _db(mean_power),
+            dc_i=stats["sum_i"] / num_samples / 2048,
+            dc_q=stats["sum_q"] / num_samples / 2048,
+        )
+
+    if stats["num_frames"]:
+        psd = dsp.StreamingPSD(
+            settings["fft_size"], settings["window"], settings["overlap"],
+            batch_frames=1
+        )
+        psd.merge(stats["power_sum"], stats["num_frames"])
+
+        tone = psd.tone(sample_rate)
+        row.update(
+            tone_frequency=tone["frequency"],
+            tone_power_dbfs=tone["power_dbfs"],
+            tone_snr_db=tone["snr_db"],
+        )
+
+        if settings.get("psd_dir"):
+            name = os.path.splitext(os.path.basename(filename))[0]
+            psd.save(
+                os.path.join(settings["psd_dir"], f"{name}_psd.npz"),
+                sample_rate, freq_centre
+            )
+
+    return row
+
+
+def analyse_captures(filenames: Sequence[str], settings: dict,
+                     num_workers: Optional[int],
+                     logger: logging.Logger) -> List[dict]:
+    """Analyses a set of capture files on a pool of worker processes
+
+    Args:
+        filenames: A sequence of `str` with the paths to the captures.
+        settings: A `dict` with the analysis settings: `chunk_samples`,
+                  `block_samples`, `fft_size`, `window`, `overlap`,
+                  `sample_rate` and, optionally, `psd_dir`.
+        num_workers: An optional `int` with the number of worker processes,
+                     by default the number of CPUs.
+        logger: The `logging.Logger` object to write progress to.
+
+    Returns:
+        A `list` of `dict`, one summary row per capture, in the order of
+        `filenames`.
+    """
+
+    chunk_samples = settings["chunk_samples"]
+    totals = {}
+    metadata = {}
+    jobs = []
+
+    for filename in filenames:
+        with chunkfile.open_capture(filename) as reader:
+            num_samples = len(reader)
+            metadata[filename] = reader.metadata
+
+        totals[filename] = _empty_stats(settings["fft_size"])
+        jobs.extend(
+            (filename, offset, min(chunk_samples, num_samples - offset))
+            for offset in range(0, num_samples, chunk_samples)
+        )
+
+    logger.info(f"Analysing {len(filenames)} captures in {len(jobs)} chunks")
+
+    with concurrent.futures.ProcessPoolExecutor(num_workers) as pool:
+        futures = [
+            pool.submit(analyse_chunk, filename, offset, count, settings)
+            for filename, offset, count in jobs
+        ]
+
+        for done, future in enumerate(
+            concurrent.futures.as_completed(futures), 1
+        ):
+            filename, _, partial = future.result()
+            merge_stats(totals[filename], partial)
+
+            if done % 100 == 0:
+                logger.info(f"{done} of {len(jobs)} chunks done")
+
+    return [
+        summarise(filename, totals[filename], metadata[filename], settings)
+        for filename in filenames
+    ]
+
+
+def write_summary(rows: List[dict], filename: str) -> None:
+    """Writes the summary rows to a CSV file
+
+    Args:
+        rows: A `list` of `dict` as returned by `analyse_captures`.
+        filename: A `str` with the path to the output file.
+    """
+
+    with open(filename, "w", newline="") as out_file:
+        writer = csv.DictWriter(out_file, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def log_summary(rows: List[dict], logger: logging.Logger) -> None:
+    """Writes a compact version of the summary table to the log"""
+
+    logger.info(
+        f"{'capture':<32} {'samples':>12} {'power':>8} {'tone Hz':>14} "
+        f"{'tone dBFS':>10} {'SNR dB':>8}"
+    )
+
+    for row in rows:
+        values = [
+            f"{row[key]:>{width}.{digits}f}" if row[key] is not None
+            else f"{'-':>{width}}"
+            for key, width, digits in (
+                ("mean_power_dbfs", 8, 2), ("tone_frequency", 14, 3),
+                ("tone_power_dbfs", 10, 2), ("tone_snr_db", 8, 2),
+            )
+        ]
+        logger.info(
+            f"{os.path.basename(row['filename']):<32} "
+            f"{row['num_samples']:>12} {' '.join(values)}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Analyse a batch of IQ captures and summarise the "
+                    "results in one table"
+    )
+    parser.add_argument(
+        "captures", nargs="+",
+        help="Capture files, or glob patterns matching them"
+    )
+    parser.add_argument(
+        "--summary", default="summary.csv",
+        help="Output CSV file [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Number of worker processes [default: number of CPUs]"
+    )
+    parser.add_argument(
+        "--chunk-samples", type=int, default=1 << 22,
+        help="Samples per chunk handed to a worker [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--block-samples", type=int, default=1 << 16,
+        help="Samples processed at once by a worker [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--fft-size", type=int, default=4096,
+        help="PSD FFT size [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--window", choices=sorted(dsp.WINDOWS), default="hann",
+        help="PSD window [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--overlap", type=float, default=0.5,
+        help="PSD frame overlap [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--sample-rate", type=float, default=20e6,
+        help="Sample rate of captures without a sidecar "
+             "[default=%(default)r]"
+    )
+    parser.add_argument(
+        "--psd-dir", default=None,
+        help="Directory to save the averaged PSD of each capture to"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    batch_logger = logging.getLogger("BatchAnalysis")
+
+    capture_files = []
+    for pattern in args.captures:
+        capture_files.extend(sorted(glob.glob(pattern)) or [pattern])
+
+    if args.psd_dir:
+        os.makedirs(args.psd_dir, exist_ok=True)
+
+    summary = analyse_captures(
+        capture_files,
+        {
+            "chunk_samples": args.chunk_samples,
+            "block_samples": args.block_samples,
+            "fft_size": args.fft_size,
+            "window": args.window,
+            "overlap": args.overlap,
+            "sample_rate": args.sample_rate,
+            "psd_dir": args.psd_dir,
+        },
+        args.workers,
+        batch_logger,
+    )
+
+    write_summary(summary, args.summary)
+    log_summary(summary, batch_logger)
+    batch_logger.info(f"Summary written to {args.summary}")
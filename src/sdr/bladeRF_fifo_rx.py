@@ -7,58 +7,179 @@
 # GNU Radio Python Flow Graph
 # Title: bladeRF FIFO RX
 # Author: Jon Szymaniak <jon.szymaniak@nuand.com>
-# Description: RX bladeRF SC16 Q11 samples from a FIFO, convert them to GR Complex values, and write them to a GUI sink.
+# Description: RX bladeRF SC16 Q11 samples from a FIFO, convert them to GR Complex values, and write them to a GUI sink, or to a file, null or rate probe sink with --no-gui.
 # GNU Radio version: 3.10.10.0
+#
+# Generated from bladeRF_fifo_rx.grc, and maintained by hand since: the
+# headless mode, source options, display front end, performance counters and
+# segment playback have no equivalent in the .grc, so regenerating the file
+# from it would drop them.
+
+# To view a live capture, point bladerf_cw_tone_rx at a named pipe, e.g.
+#
+#   mkfifo /tmp/rx.fifo
+#   python bladeRF_fifo_rx.py --source /tmp/rx.fifo --perf-file perf.csv
+#
+# with "output_file": "/tmp/rx.fifo" in the Rx params. The flowgraph blocks
+# until the Rx side opens the pipe and ends when it closes it. The per-block
+# counters in perf.csv show which block holds the chain back.
+#
+# To review a campaign recorded as many capture files, play them back as one
+# recording, with a slider to seek to any time:
+#
+#   python bladeRF_fifo_rx.py --segments "captures/*.iqbin"
 
-from PyQt5 import Qt
-from gnuradio import qtgui
-from PyQt5 import QtCore
 from gnuradio import blocks
+import numpy as np
 import pmt
 from gnuradio import gr
 from gnuradio.filter import firdes
-from gnuradio.fft import window
+import csv
+import glob
+import json
+import os
+import stat
 import sys
 import signal
-from PyQt5 import Qt
+import tempfile
+import threading
+import time
 from argparse import ArgumentParser
 from gnuradio.eng_arg import eng_float, intx
 from gnuradio import eng_notation
-import sip
 
+import playback
+
+
+# Sinks available without the GUI. The Qt modules are only imported, by
+# gui_top_block_cls, when the GUI is requested, so headless servers need no
+# display and skip their import time.
+HEADLESS_SINKS = ("null", "file", "probe")
+
+# Named pipe the Rx script writes to by default, see the example above
+SOURCE_FILE = '/tmp/rx.fifo'
+
+# Full scale of the SC16 Q11 samples, divided out by the conversion block
+SC16_SCALE = 2048.0
+
+
+# GUI displays: an averaged spectrum computed by a decimating front end, or
+# the full qtgui.sink_c fed with every sample
+DISPLAYS = ("spectrum", "full")
+
+
+def display_decimation(sample_rate, fft_size, average, display_rate):
+    """Keeps one FFT frame in this many for the display
+
+    Only `average` frames are needed per display update, so at most
+    `display_rate * average` frames per second have to be transformed, out
+    of the `sample_rate / fft_size` available. The others are dropped
+    before the FFT to bound its CPU cost, so each displayed spectrum is the
+    average of a sample of the frames, and a burst that falls between them
+    is not shown. `frames_per_update` is used instead when every frame has
+    to be averaged.
+    """
+
+    frames_per_sec = sample_rate / fft_size
+    return max(1, int(frames_per_sec // (display_rate * average)))
+
+
+def frames_per_update(sample_rate, fft_size, display_rate):
+    """Number of FFT frames averaged per display update, with none dropped"""
+
+    return max(1, int(sample_rate / fft_size // display_rate))
+
+
+def is_realtime_source(path):
+    """Whether `path` delivers samples at their own pace, e.g. a FIFO
+
+    Regular files are read as fast as the flowgraph allows, so they need a
+    throttle to replay at the sample rate. FIFOs and character devices fed
+    by the radio are paced by the radio already.
+
+    Raises:
+        FileNotFoundError: If `path` does not exist, e.g. the pipe has not
+                           been created yet.
+    """
+
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Source does not exist: {path} - create a pipe with mkfifo, or give a capture file") from None
+
+    return stat.S_ISFIFO(mode) or stat.S_ISCHR(mode)
+
+
+class segment_source(gr.sync_block):
+    """Plays the segments of a `playback.PlaybackIndex` one after the other
+
+    Produces SC16 pairs, like a `file_source` of `gr.sizeof_short*2` items,
+    straight from the memory-mapped segments. A `file_source` ends the
+    flowgraph at the end of its file, so it cannot chain segments. Seeking
+    only moves the read position, so nothing before it is read.
+    """
+
+    def __init__(self, index, repeat=True, start_time=0.0):
+        gr.sync_block.__init__(self, name="segment_source", in_sig=None, out_sig=[(np.int16, 2)])
+        self.index = index
+        self.repeat = repeat
+        self._lock = threading.Lock()
+        self._maps = {}
+        self._segment, self._offset = index.locate(start_time)
+
+    def seek_time(self, seconds):
+        """Moves playback to a time, in seconds from the recording start"""
 
+        with self._lock:
+            self._segment, self._offset = self.index.locate(seconds)
 
-class bladeRF_fifo_rx(gr.top_block, Qt.QWidget):
+    def position(self):
+        """Returns the segment index and sample offset being played"""
 
-    def __init__(self, frequency=1e9, sample_rate=20e6):
+        with self._lock:
+            return self._segment, self._offset
+
+    def _samples(self, segment):
+        if segment not in self._maps:
+            self._maps[segment] = self.index.open_segment(segment)
+        return self._maps[segment]
+
+    def work(self, input_items, output_items):
+        out = output_items[0]
+        produced = 0
+
+        with self._lock:
+            while produced < len(out):
+                samples = self._samples(self._segment)
+                count = min(len(out) - produced, len(samples) - self._offset)
+                out[produced:produced + count] = samples[self._offset:self._offset + count]
+                produced += count
+                self._offset += count
+
+                if self._offset >= len(samples):
+                    self._segment += 1
+                    self._offset = 0
+                    if self._segment == len(self.index):
+                        if not self.repeat:
+                            self._segment -= 1
+                            self._offset = len(samples)
+                            break
+                        self._segment = 0
+
+        return produced if produced else -1
+
+
+class bladeRF_fifo_rx_chain(gr.top_block):
+    """Source chain of the flowgraph, ending in a headless sink
+
+    The GUI flowgraph is built on top of this class, with the sink left out
+    and a `qtgui.sink_c` connected in its place.
+    """
+
+    def __init__(self, frequency=1e9, sample_rate=20e6, sink="null",
+                 output_file=None, source_file=SOURCE_FILE, throttle=None,
+                 num_samples=None, repeat=None, segments=None, start_time=0.0):
         gr.top_block.__init__(self, "bladeRF FIFO RX", catch_exceptions=True)
-        Qt.QWidget.__init__(self)
-        self.setWindowTitle("bladeRF FIFO RX")
-        qtgui.util.check_set_qss()
-        try:
-            self.setWindowIcon(Qt.QIcon.fromTheme('gnuradio-grc'))
-        except BaseException as exc:
-            print(f"Qt GUI: Could not set Icon: {str(exc)}", file=sys.stderr)
-        self.top_scroll_layout = Qt.QVBoxLayout()
-        self.setLayout(self.top_scroll_layout)
-        self.top_scroll = Qt.QScrollArea()
-        self.top_scroll.setFrameStyle(Qt.QFrame.NoFrame)
-        self.top_scroll_layout.addWidget(self.top_scroll)
-        self.top_scroll.setWidgetResizable(True)
-        self.top_widget = Qt.QWidget()
-        self.top_scroll.setWidget(self.top_widget)
-        self.top_layout = Qt.QVBoxLayout(self.top_widget)
-        self.top_grid_layout = Qt.QGridLayout()
-        self.top_layout.addLayout(self.top_grid_layout)
-
-        self.settings = Qt.QSettings("GNU Radio", "bladeRF_fifo_rx")
-
-        try:
-            geometry = self.settings.value("geometry")
-            if geometry:
-                self.restoreGeometry(geometry)
-        except BaseException as exc:
-            print(f"Qt GUI: Could not restore geometry: {str(exc)}", file=sys.stderr)
 
         ##################################################
         # Parameters
@@ -75,66 +196,72 @@ class bladeRF_fifo_rx(gr.top_block, Qt.QWidget):
         ##################################################
         # Blocks
         ##################################################
-
-        self._sample_rate_range_range = qtgui.Range(160e3, 40e6, 1e6, sample_rate, 200)
-        self._sample_rate_range_win = qtgui.RangeWidget(self._sample_rate_range_range, self.set_sample_rate_range, "Sample Rate", "counter", float, QtCore.Qt.Horizontal)
-        self.top_grid_layout.addWidget(self._sample_rate_range_win, 0, 0, 1, 1)
-        for r in range(0, 1):
-            self.top_grid_layout.setRowStretch(r, 1)
-        for c in range(0, 1):
-            self.top_grid_layout.setColumnStretch(c, 1)
-        self._frequency_range_range = qtgui.Range(300e6, 3.8e9, 1e6, frequency, 200)
-        self._frequency_range_win = qtgui.RangeWidget(self._frequency_range_range, self.set_frequency_range, "Frequency", "counter", float, QtCore.Qt.Horizontal)
-        self.top_grid_layout.addWidget(self._frequency_range_win, 0, 1, 1, 1)
-        for r in range(0, 1):
-            self.top_grid_layout.setRowStretch(r, 1)
-        for c in range(1, 2):
-            self.top_grid_layout.setColumnStretch(c, 1)
-        self.qtgui_sink_x_0 = qtgui.sink_c(
-            4096, #fftsize
-            window.WIN_RECTANGULAR, #wintype
-            frequency_range, #fc
-            sample_rate_range, #bw
-            "", #name
-            True, #plotfreq
-            True, #plotwaterfall
-            True, #plottime
-            True, #plotconst
-            None # parent
-        )
-        self.qtgui_sink_x_0.set_update_time(1.0/10)
-        self._qtgui_sink_x_0_win = sip.wrapinstance(self.qtgui_sink_x_0.qwidget(), Qt.QWidget)
-
-        self.qtgui_sink_x_0.enable_rf_freq(True)
-
-        self.top_grid_layout.addWidget(self._qtgui_sink_x_0_win, 1, 0, 1, 8)
-        for r in range(1, 2):
-            self.top_grid_layout.setRowStretch(r, 1)
-        for c in range(0, 8):
-            self.top_grid_layout.setColumnStretch(c, 1)
-        self.blocks_throttle2_0 = blocks.throttle( gr.sizeof_gr_complex*1, 20e6, True, 0 if "auto" == "auto" else max( int(float(0.1) * 20e6) if "auto" == "time" else int(0.1), 1) )
-        self.blocks_multiply_const_vxx_0 = blocks.multiply_const_cc((1.0 / 2048.0))
-        self.blocks_interleaved_short_to_complex_0 = blocks.interleaved_short_to_complex(True, False,1.0)
-        self.blocks_file_source_0 = blocks.file_source(gr.sizeof_short*2, '/home/viktor/Documents/rir/src/test.iqbin', True, 0, 0)
-        self.blocks_file_source_0.set_begin_tag(pmt.PMT_NIL)
+        # * A throttle is only needed to replay a regular file in real time,
+        # * and only a regular file can be replayed in a loop
+        realtime = not segments and is_realtime_source(source_file)
+        if throttle is None:
+            throttle = not realtime
+        if repeat is None:
+            repeat = not realtime
+        self.realtime = realtime
+
+        self.blocks_throttle2_0 = None
+        if throttle:
+            # * Throttles SC16 pairs, half the bytes of complex samples
+            self.blocks_throttle2_0 = blocks.throttle(gr.sizeof_short*2, sample_rate, True)
+        # * The conversion divides by its scale factor, so it also scales to
+        # * +/-1.0 and no separate multiply is needed
+        self.blocks_interleaved_short_to_complex_0 = blocks.interleaved_short_to_complex(True, False, SC16_SCALE)
+        self.playback_index = None
+        self.source_fd = None
+        if segments:
+            # * Multi-file playback, indexed so that any time can be sought
+            self.playback_index = playback.PlaybackIndex(segments, sample_rate)
+            self.blocks_file_source_0 = segment_source(self.playback_index, repeat, start_time)
+        elif realtime:
+            # * Blocking reads from the pipe, which also blocks here until the
+            # * writer opens it; the flowgraph ends when the writer closes it
+            self.source_fd = os.open(source_file, os.O_RDONLY)
+            self.blocks_file_source_0 = blocks.file_descriptor_source(gr.sizeof_short*2, self.source_fd, False)
+        else:
+            self.blocks_file_source_0 = blocks.file_source(gr.sizeof_short*2, source_file, repeat, 0, 0)
+            self.blocks_file_source_0.set_begin_tag(pmt.PMT_NIL)
+        self.blocks_head_0 = None
+        if num_samples is not None:
+            self.blocks_head_0 = blocks.head(gr.sizeof_short*2, num_samples)
+
+        self.sink = sink
+        self.output_sink = None
+        if sink == "null":
+            self.output_sink = blocks.null_sink(gr.sizeof_gr_complex*1)
+        elif sink == "file":
+            if not output_file:
+                raise ValueError("The file sink needs an output file")
+            self.output_sink = blocks.file_sink(gr.sizeof_gr_complex*1, output_file, False)
+            self.output_sink.set_unbuffered(False)
+        elif sink == "probe":
+            # * Reports the sample rate actually reaching the end of the chain
+            self.output_sink = blocks.probe_rate(gr.sizeof_gr_complex*1, 1000.0, 0.15)
+        elif sink is not None:
+            raise ValueError(f"Unknown headless sink: {sink}")
 
 
         ##################################################
         # Connections
         ##################################################
-        self.connect((self.blocks_file_source_0, 0), (self.blocks_interleaved_short_to_complex_0, 0))
-        self.connect((self.blocks_interleaved_short_to_complex_0, 0), (self.blocks_throttle2_0, 0))
-        self.connect((self.blocks_multiply_const_vxx_0, 0), (self.qtgui_sink_x_0, 0))
-        self.connect((self.blocks_throttle2_0, 0), (self.blocks_multiply_const_vxx_0, 0))
-
-
-    def closeEvent(self, event):
-        self.settings = Qt.QSettings("GNU Radio", "bladeRF_fifo_rx")
-        self.settings.setValue("geometry", self.saveGeometry())
-        self.stop()
-        self.wait()
-
-        event.accept()
+        chain = [
+            block for block in (
+                self.blocks_file_source_0, self.blocks_head_0,
+                self.blocks_throttle2_0,
+                self.blocks_interleaved_short_to_complex_0, self.output_sink,
+            )
+            if block is not None
+        ]
+        for upstream, downstream in zip(chain, chain[1:]):
+            self.connect((upstream, 0), (downstream, 0))
+
+        # * Blocks whose performance counters are exported, in flow order
+        self.perf_blocks = list(chain)
 
     def get_frequency(self):
         return self.frequency
@@ -148,6 +275,8 @@ class bladeRF_fifo_rx(gr.top_block, Qt.QWidget):
 
     def set_sample_rate(self, sample_rate):
         self.sample_rate = sample_rate
+        if self.blocks_throttle2_0 is not None:
+            self.blocks_throttle2_0.set_sample_rate(self.sample_rate)
         self.set_sample_rate_range(self.sample_rate)
 
     def get_sample_rate_range(self):
@@ -155,19 +284,406 @@ class bladeRF_fifo_rx(gr.top_block, Qt.QWidget):
 
     def set_sample_rate_range(self, sample_rate_range):
         self.sample_rate_range = sample_rate_range
-        self.qtgui_sink_x_0.set_frequency_range(self.frequency_range, self.sample_rate_range)
 
     def get_frequency_range(self):
         return self.frequency_range
 
     def set_frequency_range(self, frequency_range):
         self.frequency_range = frequency_range
-        self.qtgui_sink_x_0.set_frequency_range(self.frequency_range, self.sample_rate_range)
+
+    def seek_time(self, seconds):
+        if self.playback_index is not None:
+            self.blocks_file_source_0.seek_time(seconds)
+
+    def playback_position(self):
+        """Returns the playback time, segment and recording timestamp
+
+        Returns:
+            A `tuple` of the playback time, in seconds, the segment file name
+            and the POSIX time the sample being played was recorded, or
+            `None` without multi-file playback.
+        """
+
+        if self.playback_index is None:
+            return None
+
+        segment, offset = self.blocks_file_source_0.position()
+        return (self.playback_index.time_of(segment, offset),
+                self.playback_index.segments[segment]["filename"],
+                self.playback_index.timestamp_of(segment, offset))
+
+
+PERF_COLUMNS = (
+    "time", "block", "work_time_avg", "work_time_total", "work_time_share",
+    "nproduced_avg", "throughput_avg", "input_buffers_full_avg",
+    "output_buffers_full_avg",
+)
+
+
+def enable_perf_counters():
+    """Turns on the GNU Radio block performance counters
+
+    Must be called before the flowgraph is built, as blocks only keep
+    counters if they are enabled when created.
+    """
+
+    gr.prefs().set_bool("PerfCounters", "on", True)
+
+
+def _mean_fullness(values):
+    # Average buffer fullness over the ports of a block, if it has any
+    values = list(values)
+    return sum(values) / len(values) if values else None
 
 
+def read_perf_counters(perf_blocks):
+    """Reads the performance counters of a list of blocks
+
+    Returns:
+        A `list` of `dict`, one per block, with the keys in `PERF_COLUMNS`.
+        Work times are in CPU clock ticks, as kept by GNU Radio, and the
+        share is the fraction of the work time of all the blocks spent in
+        each one, so the largest share is the bottleneck.
+    """
+
+    now = time.time()
+    rows = []
+    for block in perf_blocks:
+        rows.append({
+            "time": now,
+            "block": block.alias(),
+            "work_time_avg": block.pc_work_time_avg(),
+            "work_time_total": block.pc_work_time_total(),
+            "nproduced_avg": block.pc_nproduced_avg(),
+            "throughput_avg": block.pc_throughput_avg(),
+            "input_buffers_full_avg": _mean_fullness(block.pc_input_buffers_full_avg()),
+            "output_buffers_full_avg": _mean_fullness(block.pc_output_buffers_full_avg()),
+        })
+
+    total = sum(row["work_time_total"] for row in rows)
+    for row in rows:
+        row["work_time_share"] = row["work_time_total"] / total if total else 0.0
+
+    return rows
+
+
+class PerfCounterExporter:
+    """Writes the block performance counters to a file at a fixed interval
+
+    The file is CSV if its name ends in `.csv`, and JSON lines otherwise,
+    one object per block per interval. A final set of counters is written,
+    and the block with the largest share of the work time reported, when
+    the exporter is stopped.
+    """
+
+    def __init__(self, perf_blocks, filename, interval=1.0):
+        self.perf_blocks = perf_blocks
+        self.filename = filename
+        self.interval = interval
+
+        self._file = open(filename, "w", newline="")
+        self._csv = None
+        if filename.endswith(".csv"):
+            self._csv = csv.DictWriter(self._file, fieldnames=PERF_COLUMNS)
+            self._csv.writeheader()
+
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="PerfCounterExporter", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+        rows = self.export()
+        self._file.close()
+
+        if rows:
+            bottleneck = max(rows, key=lambda row: row["work_time_share"])
+            print(f"Busiest block: {bottleneck['block']}, "
+                  f"{100 * bottleneck['work_time_share']:.1f}% of work time",
+                  file=sys.stderr)
+
+    def export(self):
+        rows = read_perf_counters(self.perf_blocks)
+        if self._csv is not None:
+            self._csv.writerows(rows)
+        else:
+            for row in rows:
+                self._file.write(json.dumps(row) + "\n")
+        self._file.flush()
+
+        return rows
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.export()
+
+
+def gui_top_block_cls():
+    """Imports the Qt modules and returns the GUI flowgraph class"""
+
+    from PyQt5 import Qt
+    from PyQt5 import QtCore
+    from gnuradio import fft
+    from gnuradio import qtgui
+    from gnuradio.fft import window
+    import sip
+
+    class bladeRF_fifo_rx(bladeRF_fifo_rx_chain, Qt.QWidget):
+
+        def __init__(self, frequency=1e9, sample_rate=20e6, display="spectrum",
+                     fft_size=4096, average=8, display_rate=10.0, average_all=False, **source):
+            bladeRF_fifo_rx_chain.__init__(self, frequency, sample_rate, sink=None, **source)
+            start_time = source.get("start_time", 0.0)
+            Qt.QWidget.__init__(self)
+            self.display = display
+            self.fft_size = fft_size
+            self.average = average
+            self.display_rate = display_rate
+            self.average_all = average_all
+            self.setWindowTitle("bladeRF FIFO RX")
+            qtgui.util.check_set_qss()
+            try:
+                self.setWindowIcon(Qt.QIcon.fromTheme('gnuradio-grc'))
+            except BaseException as exc:
+                print(f"Qt GUI: Could not set Icon: {str(exc)}", file=sys.stderr)
+            self.top_scroll_layout = Qt.QVBoxLayout()
+            self.setLayout(self.top_scroll_layout)
+            self.top_scroll = Qt.QScrollArea()
+            self.top_scroll.setFrameStyle(Qt.QFrame.NoFrame)
+            self.top_scroll_layout.addWidget(self.top_scroll)
+            self.top_scroll.setWidgetResizable(True)
+            self.top_widget = Qt.QWidget()
+            self.top_scroll.setWidget(self.top_widget)
+            self.top_layout = Qt.QVBoxLayout(self.top_widget)
+            self.top_grid_layout = Qt.QGridLayout()
+            self.top_layout.addLayout(self.top_grid_layout)
+
+            self.settings = Qt.QSettings("GNU Radio", "bladeRF_fifo_rx")
+
+            try:
+                geometry = self.settings.value("geometry")
+                if geometry:
+                    self.restoreGeometry(geometry)
+            except BaseException as exc:
+                print(f"Qt GUI: Could not restore geometry: {str(exc)}", file=sys.stderr)
+
+            ##################################################
+            # Blocks
+            ##################################################
+
+            self._sample_rate_range_range = qtgui.Range(160e3, 40e6, 1e6, sample_rate, 200)
+            self._sample_rate_range_win = qtgui.RangeWidget(self._sample_rate_range_range, self.set_sample_rate_range, "Sample Rate", "counter", float, QtCore.Qt.Horizontal)
+            self.top_grid_layout.addWidget(self._sample_rate_range_win, 0, 0, 1, 1)
+            for r in range(0, 1):
+                self.top_grid_layout.setRowStretch(r, 1)
+            for c in range(0, 1):
+                self.top_grid_layout.setColumnStretch(c, 1)
+            self._frequency_range_range = qtgui.Range(300e6, 3.8e9, 1e6, frequency, 200)
+            self._frequency_range_win = qtgui.RangeWidget(self._frequency_range_range, self.set_frequency_range, "Frequency", "counter", float, QtCore.Qt.Horizontal)
+            self.top_grid_layout.addWidget(self._frequency_range_win, 0, 1, 1, 1)
+            for r in range(0, 1):
+                self.top_grid_layout.setRowStretch(r, 1)
+            for c in range(1, 2):
+                self.top_grid_layout.setColumnStretch(c, 1)
+            self.blocks_keep_one_in_n_0 = None
+            if display == "full":
+                self.qtgui_sink_x_0 = qtgui.sink_c(
+                    fft_size, #fftsize
+                    window.WIN_RECTANGULAR, #wintype
+                    self.frequency_range, #fc
+                    self.sample_rate_range, #bw
+                    "", #name
+                    True, #plotfreq
+                    True, #plotwaterfall
+                    True, #plottime
+                    True, #plotconst
+                    None # parent
+                )
+                self.qtgui_sink_x_0.set_update_time(1.0/display_rate)
+                self.qtgui_sink_x_0.enable_rf_freq(True)
+            else:
+                # * Decimating front end: frames the display would never show
+                # * are dropped before the FFT, to save CPU, and the rest are
+                # * averaged down to display_rate spectra per second. With
+                # * average_all every frame is transformed and averaged
+                window_taps = window.blackmanharris(fft_size)
+                self.blocks_stream_to_vector_0 = blocks.stream_to_vector(gr.sizeof_gr_complex*1, fft_size)
+                if average_all:
+                    num_averaged = frames_per_update(sample_rate, fft_size, display_rate)
+                else:
+                    num_averaged = average
+                    self.blocks_keep_one_in_n_0 = blocks.keep_one_in_n(gr.sizeof_gr_complex*fft_size, display_decimation(sample_rate, fft_size, average, display_rate))
+                self.fft_vxx_0 = fft.fft_vcc(fft_size, True, window_taps, True, 1)
+                self.blocks_complex_to_mag_squared_0 = blocks.complex_to_mag_squared(fft_size)
+                self.blocks_integrate_xx_0 = blocks.integrate_ff(num_averaged, fft_size)
+                # * Mean power in dBFS, a full-scale tone on a bin is 0 dBFS
+                self.blocks_nlog10_ff_0 = blocks.nlog10_ff(10, fft_size, float(-20*np.log10(np.sum(window_taps)) - 10*np.log10(num_averaged)))
+                self.qtgui_sink_x_0 = qtgui.vector_sink_f(
+                    fft_size, #vlen
+                    0, #x_start
+                    1.0, #x_step
+                    "Frequency (Hz)", #x_axis_label
+                    "Power (dBFS)", #y_axis_label
+                    "", #name
+                    1, #nconnections
+                    None # parent
+                )
+                self.qtgui_sink_x_0.set_update_time(1.0/display_rate)
+                self.qtgui_sink_x_0.set_y_axis(-140, 10)
+                self._update_frequency_axis()
+
+            self._qtgui_sink_x_0_win = sip.wrapinstance(self.qtgui_sink_x_0.qwidget(), Qt.QWidget)
+
+            self.top_grid_layout.addWidget(self._qtgui_sink_x_0_win, 1, 0, 1, 8)
+            for r in range(1, 2):
+                self.top_grid_layout.setRowStretch(r, 1)
+            for c in range(0, 8):
+                self.top_grid_layout.setColumnStretch(c, 1)
+
+            if self.playback_index is not None:
+                # * Seek slider over the whole recording, 0.1 s steps
+                self._playback_time_range = qtgui.Range(0, max(self.playback_index.duration, 0.1), 0.1, start_time, 1000)
+                self._playback_time_win = qtgui.RangeWidget(self._playback_time_range, self.seek_time, "Playback time (s)", "slider", float, QtCore.Qt.Horizontal)
+                self.top_grid_layout.addWidget(self._playback_time_win, 2, 0, 1, 8)
+                self._playback_label = Qt.QLabel()
+                self.top_grid_layout.addWidget(self._playback_label, 3, 0, 1, 8)
+
+                self._playback_timer = Qt.QTimer()
+                self._playback_timer.timeout.connect(self._update_playback_label)
+                self._playback_timer.start(500)
+
+
+            ##################################################
+            # Connections
+            ##################################################
+            if display == "full":
+                self.connect((self.blocks_interleaved_short_to_complex_0, 0), (self.qtgui_sink_x_0, 0))
+            else:
+                display_chain = [
+                    block for block in (
+                        self.blocks_interleaved_short_to_complex_0,
+                        self.blocks_stream_to_vector_0, self.blocks_keep_one_in_n_0,
+                        self.fft_vxx_0, self.blocks_complex_to_mag_squared_0,
+                        self.blocks_integrate_xx_0, self.blocks_nlog10_ff_0,
+                        self.qtgui_sink_x_0,
+                    )
+                    if block is not None
+                ]
+                for upstream, downstream in zip(display_chain, display_chain[1:]):
+                    self.connect((upstream, 0), (downstream, 0))
+                self.perf_blocks.extend(display_chain[1:-1])
+            self.perf_blocks.append(self.qtgui_sink_x_0)
+
+
+        def closeEvent(self, event):
+            self.settings = Qt.QSettings("GNU Radio", "bladeRF_fifo_rx")
+            self.settings.setValue("geometry", self.saveGeometry())
+            self.stop()
+            self.wait()
+
+            event.accept()
+
+        def set_sample_rate(self, sample_rate):
+            bladeRF_fifo_rx_chain.set_sample_rate(self, sample_rate)
+            # ! With average_all the averaging length is fixed when built
+            if self.blocks_keep_one_in_n_0 is not None:
+                self.blocks_keep_one_in_n_0.set_n(display_decimation(self.sample_rate, self.fft_size, self.average, self.display_rate))
+
+        def set_sample_rate_range(self, sample_rate_range):
+            self.sample_rate_range = sample_rate_range
+            if self.display == "full":
+                self.qtgui_sink_x_0.set_frequency_range(self.frequency_range, self.sample_rate_range)
+            else:
+                self._update_frequency_axis()
+
+        def set_frequency_range(self, frequency_range):
+            self.frequency_range = frequency_range
+            if self.display == "full":
+                self.qtgui_sink_x_0.set_frequency_range(self.frequency_range, self.sample_rate_range)
+            else:
+                self._update_frequency_axis()
+
+        def _update_playback_label(self):
+            seconds, filename, timestamp = self.playback_position()
+            recorded = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(timestamp))
+            self._playback_label.setText(
+                f"{seconds:.1f} / {self.playback_index.duration:.1f} s, "
+                f"{os.path.basename(filename)}, recorded {recorded} UTC")
+
+        def _update_frequency_axis(self):
+            step = self.sample_rate_range / self.fft_size
+            self.qtgui_sink_x_0.set_x_axis(self.frequency_range - self.sample_rate_range / 2, step)
+
+    return bladeRF_fifo_rx
+
+
+
+def benchmark_chains(num_samples=int(1e8), sample_rate=20e6):
+    """Compares the CPU cost of the original and the fused source chain
+
+    Each chain converts the same `num_samples` samples, read repeatedly from
+    a temporary file of random SC16 values, into a null sink. The original
+    chain is run as it was, convert, throttle at 20e6 and multiply, and the
+    fused one as for a FIFO source, without a throttle, and as for a regular
+    file, throttled at `sample_rate`.
+
+    Returns:
+        A `dict` keyed by chain name, with the wall time and process CPU
+        time, both in seconds, and the CPU time per sample, in ns.
+    """
+
+    with tempfile.NamedTemporaryFile(suffix=".iqbin", delete=False) as source:
+        np.random.default_rng(0).integers(
+            -2048, 2048, size=2 * (1 << 20), dtype=np.int16
+        ).tofile(source)
+
+    def original_chain():
+        tb = gr.top_block("original chain", catch_exceptions=True)
+        file_source = blocks.file_source(gr.sizeof_short*2, source.name, True, 0, 0)
+        head = blocks.head(gr.sizeof_short*2, num_samples)
+        convert = blocks.interleaved_short_to_complex(True, False, 1.0)
+        throttle = blocks.throttle(gr.sizeof_gr_complex*1, 20e6, True)
+        multiply = blocks.multiply_const_cc((1.0 / 2048.0))
+        tb.connect(file_source, head, convert, throttle, multiply, blocks.null_sink(gr.sizeof_gr_complex*1))
+        return tb
+
+    def fused_chain(throttle):
+        return bladeRF_fifo_rx_chain(sample_rate=sample_rate, sink="null", source_file=source.name, throttle=throttle, num_samples=num_samples)
+
+    results = {}
+    try:
+        for name, build in (("original", original_chain),
+                            ("fused, FIFO", lambda: fused_chain(False)),
+                            ("fused, file", lambda: fused_chain(True))):
+            tb = build()
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            tb.run()
+            cpu = time.process_time() - cpu
+            wall = time.perf_counter() - wall
+
+            results[name] = {
+                "wall_time": wall,
+                "cpu_time": cpu,
+                "cpu_ns_per_sample": 1e9 * cpu / num_samples,
+            }
+            print(f"{name}: {num_samples / wall:.3e} samples/sec, "
+                  f"{1e9 * cpu / num_samples:.2f} ns CPU per sample",
+                  file=sys.stderr)
+    finally:
+        os.unlink(source.name)
+
+    return results
+
 
 def argument_parser():
-    description = 'RX bladeRF SC16 Q11 samples from a FIFO, convert them to GR Complex values, and write them to a GUI sink.'
+    description = 'RX bladeRF SC16 Q11 samples from a FIFO or capture files, convert them to GR Complex values, and show them in the GUI, or write them to a file, null or rate probe sink with --no-gui.'
     parser = ArgumentParser(description=description)
     parser.add_argument(
         "--frequency", dest="frequency", type=eng_float, default=eng_notation.num_to_str(float(1e9)),
@@ -175,18 +691,153 @@ def argument_parser():
     parser.add_argument(
         "-s", "--sample-rate", dest="sample_rate", type=eng_float, default=eng_notation.num_to_str(float(20e6)),
         help="Set Sample Rate [default=%(default)r]")
+    parser.add_argument(
+        "--source", dest="source", default=SOURCE_FILE,
+        help="SC16 Q11 source: a named pipe fed live, e.g. by bladerf_cw_tone_rx, or a capture file to replay [default=%(default)r]")
+    parser.add_argument(
+        "--segments", dest="segments", nargs="+", default=None,
+        help="Capture files, or glob patterns matching them, to play back in order as one recording instead of --source, seekable in the GUI")
+    parser.add_argument(
+        "--start-time", dest="start_time", type=eng_float, default=0.0,
+        help="Playback time to start the segments from, in seconds [default=%(default)r]")
+    parser.add_argument(
+        "--no-repeat", dest="no_repeat", action="store_true",
+        help="Replay a capture file once instead of in a loop")
+    parser.add_argument(
+        "--perf-file", dest="perf_file", default=None,
+        help="Export the block performance counters to this file, CSV if it ends in .csv, JSON lines otherwise")
+    parser.add_argument(
+        "--perf-interval", dest="perf_interval", type=eng_float, default=1.0,
+        help="Seconds between performance counter exports [default=%(default)r]")
+    parser.add_argument(
+        "--display", dest="display", choices=DISPLAYS, default="spectrum",
+        help="GUI display: averaged spectrum from a decimating front end, or the full sink with every sample [default=%(default)r]")
+    parser.add_argument(
+        "--fft-size", dest="fft_size", type=intx, default=4096,
+        help="Display FFT size [default=%(default)r]")
+    parser.add_argument(
+        "--average", dest="average", type=intx, default=8,
+        help="FFT frames averaged per displayed spectrum. To save CPU, only these are transformed and the frames between updates are dropped, so short bursts may not show [default=%(default)r]")
+    parser.add_argument(
+        "--average-all", dest="average_all", action="store_true",
+        help="Transform every FFT frame and average all of them between display updates, so no burst is missed, at a higher CPU cost")
+    parser.add_argument(
+        "--display-rate", dest="display_rate", type=eng_float, default=10.0,
+        help="Display updates per second [default=%(default)r]")
+    parser.add_argument(
+        "--no-gui", dest="no_gui", action="store_true",
+        help="Run without the Qt GUI, into a headless sink")
+    parser.add_argument(
+        "--sink", dest="sink", choices=HEADLESS_SINKS, default="null",
+        help="Headless sink: discard, write complex samples to --output, or measure the rate [default=%(default)r]")
+    parser.add_argument(
+        "--output", dest="output", default=None,
+        help="Output file for the file sink")
+    parser.add_argument(
+        "--benchmark", dest="benchmark", action="store_true",
+        help="Compare the CPU cost of the original and the fused chain, and exit")
+    parser.add_argument(
+        "--benchmark-samples", dest="benchmark_samples", type=intx, default=int(1e8),
+        help="Samples per chain in the benchmark [default=%(default)r]")
+    parser.add_argument(
+        "--report-interval", dest="report_interval", type=float, default=1.0,
+        help="Seconds between rate reports of the probe sink [default=%(default)r]")
     return parser
 
 
-def main(top_block_cls=bladeRF_fifo_rx, options=None):
+def start_perf_export(tb, options):
+    if not options.perf_file:
+        return None
+
+    exporter = PerfCounterExporter(tb.perf_blocks, options.perf_file, options.perf_interval)
+    exporter.start()
+    return exporter
+
+
+def chain_options(options):
+    segments = None
+    if options.segments:
+        segments = []
+        for pattern in options.segments:
+            segments.extend(sorted(glob.glob(pattern)) or [pattern])
+
+    return {
+        "frequency": options.frequency,
+        "sample_rate": options.sample_rate,
+        "source_file": options.source,
+        "repeat": False if options.no_repeat else None,
+        "segments": segments,
+        "start_time": options.start_time,
+    }
+
+
+def main_headless(options):
+    tb = bladeRF_fifo_rx_chain(
+        sink=options.sink, output_file=options.output, **chain_options(options)
+    )
+
+    finished = threading.Event()
+
+    def sig_handler(sig=None, frame=None):
+        finished.set()
+
+    signal.signal(signal.SIGINT, sig_handler)
+    signal.signal(signal.SIGTERM, sig_handler)
+
+    tb.start()
+    exporter = start_perf_export(tb, options)
+
+    # * The flowgraph also ends by itself, at the end of a pipe or file
+    def wait_for_flowgraph():
+        tb.wait()
+        finished.set()
+
+    threading.Thread(target=wait_for_flowgraph, daemon=True).start()
+
+    while not finished.wait(options.report_interval):
+        if options.sink == "probe":
+            print(f"Rate: {tb.output_sink.rate():.3e} samples/sec", file=sys.stderr)
+
+    tb.stop()
+    tb.wait()
+
+    if exporter is not None:
+        exporter.stop()
+
+
+def main(top_block_cls=None, options=None):
     if options is None:
         options = argument_parser().parse_args()
 
+    if options.perf_file:
+        enable_perf_counters()
+
+    if options.benchmark:
+        benchmark_chains(options.benchmark_samples, options.sample_rate)
+        return
+
+    if not options.segments and not os.path.exists(options.source):
+        argument_parser().error(f"source {options.source} does not exist, create the pipe with mkfifo or give a capture file with --source")
+
+    if options.no_gui:
+        main_headless(options)
+        return
+
+    if top_block_cls is None:
+        top_block_cls = gui_top_block_cls()
+
+    from PyQt5 import Qt
+
     qapp = Qt.QApplication(sys.argv)
 
-    tb = top_block_cls(frequency=options.frequency, sample_rate=options.sample_rate)
+    tb = top_block_cls(
+        display=options.display, fft_size=options.fft_size,
+        average=options.average, display_rate=options.display_rate,
+        average_all=options.average_all, **chain_options(options)
+    )
 
     tb.start()
+    exporter = start_perf_export(tb, options)
 
     tb.show()
 
@@ -205,5 +856,8 @@ def main(top_block_cls=bladeRF_fifo_rx, options=None):
 
     qapp.exec_()
 
+    if exporter is not None:
+        exporter.stop()
+
 if __name__ == '__main__':
     main()
@@ -5,40 +5,63 @@ unit.
 """
 
 
+import contextlib
 import datetime
 import logging
+import time
 import numpy as np
 
-from bladerf import _bladerf
+from typing import Optional
 
+import async_writer
+import chunkfile
+import dsp
 import helpers
+import iqfile
+import simulator
+import stream_tuning
+import telemetry
+import timestamps
+import trigger
 
 
 NTP_SERVER = "0.uk.pool.ntp.org"
 
+CAPTURE_MODES = ("file", "threaded", "memory", "stream", "triggered", "mimo",
+                 "timestamped")
 
-def bladerf_cw_tone_rx(params: dict, logger: logging.Logger) -> None:
-    """Sets up a BladeRF 2.0 micro xA4 as a CW receiver
+# * Both Rx channels of the xA4, streamed with the RX_X2 layout
+MIMO_CHANNELS = (0, 1)
+MIMO_OUTPUTS = ("separate", "interleaved")
+
+# * Consecutive empty timestamped reads after which receiving stops
+MAX_EMPTY_READS = 16
+
+
+def _configure_rx_channel(sdr: "_bladerf.BladeRF", rx_ch_index: int,
+                          params: dict, logger: logging.Logger):
+    """Applies the Rx settings in `params` to one Rx channel
 
+    Args:
+        sdr: A `BladeRF`, or simulated, device object.
+        rx_ch_index: An `int` with the index of the Rx channel, 0 or 1.
+        params: The `dict` with the Rx settings.
+        logger: The `logging.Logger` object to write diagnostics to.
+
+    Returns:
+        The configured channel object, not yet enabled.
+
+    Raises:
+        RuntimeError: If the channel index is invalid.
     """
-    
-    try:
-        sdr = _bladerf.BladeRF()
-    except Exception as error:
-        logger.critical(f"Could not connect to bladeRF unit")
-        logger.critical(f"Error message returned: {error.args[0]}")
-        raise RuntimeError("Could not connect to bladeRF unit") from error
-        
-    logger.info(f"Device info: {_bladerf.get_device_list()[0]}")
-    logger.info(f"libbladeRF version: {_bladerf.version()}")
-    logger.info(f"Firmware version: {sdr.get_fw_version()}")
-    logger.info(f"FPGA version: {sdr.get_fpga_version()}")
-        
+
+    bladerf_api = simulator.bladerf_constants(sdr)
+
     try:
-        channel = _bladerf.CHANNEL_RX(params["rx_ch"])
+        channel = bladerf_api.CHANNEL_RX(rx_ch_index)
         rx_ch = sdr.Channel(channel)
     except Exception as error:
-        logger.critical(f"Invalid Rx channel value: {channel}")
+        logger.critical(f"Invalid Rx channel value: {rx_ch_index}")
         raise RuntimeError("Error configuring bladeRF unit") from error
 
     logger.info(f"Using Rx channel: {channel}")
@@ -52,39 +75,264 @@ def bladerf_cw_tone_rx(params: dict, logger: logging.Logger) -> None:
     rx_ch.bandwidth = params["bandwidth"]
     logger.info(f"Rx BW set to {rx_ch.bandwidth:.3e} Hz")
     
-    rx_ch.gain_mode = _bladerf.GainMode.Manual
+    rx_ch.gain_mode = bladerf_api.GainMode.Manual
     logger.info("Set gain mode to manual - AGC disabled")
     
     rx_ch.gain = params["rx_gain"]
 
-    sdr.sync_config(
-        layout=_bladerf.ChannelLayout(channel),
-        fmt=_bladerf.Format.SC16_Q11,
-        num_buffers=32,
-        buffer_size=4096,
-        num_transfers=16,
-        stream_timeout=3500
+    return rx_ch
+
+
+def _open_capture_writer(output_file: str, metadata: dict, params: dict):
+    """Creates the writer for a capture file
+
+    Args:
+        output_file: A `str` with the path to the capture file.
+        metadata: A `dict` with the actual Rx settings of the device.
+        params: The `dict` with capture parameters. Setting `compression` to
+                one of `chunkfile.CODECS` selects a chunked, compressed
+                capture, configured by the optional `compression_level`,
+                `compression_filter`, `chunk_samples` and
+                `compression_workers`.
+
+    Returns:
+        A `chunkfile.ChunkedWriter` if compression is requested, otherwise
+        an `iqfile.CaptureWriter`.
+
+    Raises:
+        ValueError: If the compression parameters are invalid.
+    """
+
+    if not params.get("compression"):
+        return iqfile.CaptureWriter(output_file, metadata)
+
+    return chunkfile.ChunkedWriter(
+        output_file, metadata,
+        chunk_samples=params.get("chunk_samples", 1 << 18),
+        codec=params["compression"],
+        level=params.get("compression_level", 1),
+        sample_filter=params.get("compression_filter", "shuffle"),
+        num_workers=params.get("compression_workers"),
     )
 
+
+def _build_stream_processor(
+        params: dict) -> Optional[dsp.StreamProcessor]:
+    """Creates the streaming analysis stages requested in `params`
+
+    Args:
+        params: The `dict` with capture parameters. Setting `psd_fft_size`
+                enables a `dsp.StreamingPSD` stage, configured further by
+                the optional `psd_window` and `psd_overlap`. Setting
+                `tone_fft_size` enables a `dsp.ToneEstimator` stage,
+                configured further by the optional `tone_window`,
+                `tone_alpha`, `tone_freqs` and `tone_record_interval`.
+
+    Returns:
+        A `dsp.StreamProcessor` running the requested stages, or `None` if
+        no stages were requested.
+
+    Raises:
+        ValueError: If any stage parameters are invalid.
+    """
+
+    stages = []
+
+    if params.get("psd_fft_size"):
+        stages.append(dsp.StreamingPSD(
+            fft_size=params["psd_fft_size"],
+            window=params.get("psd_window", "hann"),
+            overlap=params.get("psd_overlap", 0.5),
+        ))
+
+    if params.get("tone_fft_size"):
+        stages.append(dsp.ToneEstimator(
+            sample_rate=params["sample_rate"],
+            fft_size=params["tone_fft_size"],
+            window=params.get("tone_window", "hann"),
+            alpha=params.get("tone_alpha", 0.1),
+            tone_freqs=params.get("tone_freqs", ()),
+            record_interval=params.get("tone_record_interval", 0.1),
+        ))
+
+    if not stages:
+        return None
+
+    return dsp.StreamProcessor(params["buffer_size"], stages)
+
+
+def _save_stream_results(processor: dsp.StreamProcessor, params: dict,
+                         metadata: dict, logger: logging.Logger) -> None:
+    """Logs and saves the results of the streaming analysis stages
+
+    Args:
+        processor: The `dsp.StreamProcessor` used during the capture.
+        params: The `dict` with capture parameters. If `psd_file` is set,
+                the averaged spectrum is saved to it, and if `tone_file` is
+                set, the recorded tone estimates are saved to it.
+        metadata: A `dict` with the actual Rx settings of the device.
+        logger: The `logging.Logger` object to write diagnostics to.
+    """
+
+    processor.log_summary(logger)
+
+    for stage in processor.stages:
+        if isinstance(stage, dsp.StreamingPSD) and params.get("psd_file"):
+            if stage.num_averages > 0:
+                stage.save(
+                    params["psd_file"], metadata["sample_rate"],
+                    metadata["freq_centre"]
+                )
+                logger.info(f"Averaged spectrum saved to {params['psd_file']}")
+        elif isinstance(stage, dsp.ToneEstimator) and params.get("tone_file"):
+            stage.save(params["tone_file"])
+            logger.info(f"Tone estimates saved to {params['tone_file']}")
+
+
+def _rx_to_memory(sdr: "_bladerf.BladeRF", params: dict,
+                  rx_signal: np.ndarray,
+                  processor: Optional[dsp.StreamProcessor],
+                  rx_stats: telemetry.Telemetry,
+                  logger: logging.Logger) -> None:
+    """Receives a fixed number of samples straight into an array
+
+    `sync_rx` is given successive `memoryview` slices of `rx_signal`, so
+    every block lands in its final place without an intermediate buffer or
+    copy, and no file I/O is done while receiving. Any streaming analysis
+    is run over the array once all samples are in, so that it does not
+    slow down receiving.
+
+    Args:
+        sdr: A configured `BladeRF` object with its Rx channel enabled.
+        params: The `dict` with capture parameters. Uses `buffer_size`.
+        rx_signal: A preallocated `np.ndarray` of `int16`, sized to hold the
+                   interleaved I and Q values of all samples to be received.
+        processor: An optional `dsp.StreamProcessor` to pass the received
+                   samples through, block by block, after receiving.
+        rx_stats: The `telemetry.Telemetry` object to record throughput and
+                  `sync_rx` durations to.
+        logger: The `logging.Logger` object to write diagnostics to.
+
+    Returns:
+        Nothing, `rx_signal` is filled in place.
+
+    Raises:
+        Nothing
+    """
+
+    buffer_samples = params["buffer_size"]
+    num_samples = rx_signal.size // 2
+    rx_view = memoryview(rx_signal)
+
+    num_samples_rcvd = 0
+
+    while num_samples_rcvd < num_samples:
+        num = min(buffer_samples, num_samples - num_samples_rcvd)
+
+        start = time.perf_counter()
+        sdr.sync_rx(
+            rx_view[2 * num_samples_rcvd:2 * (num_samples_rcvd + num)], num
+        )
+        rx_stats.record("sync_rx", time.perf_counter() - start)
+        rx_stats.add(num)
+
+        num_samples_rcvd += num
+
+    logger.info(f"Received {num_samples_rcvd} samples into memory")
+
+    if processor is not None:
+        for offset in range(0, num_samples, buffer_samples):
+            num = min(buffer_samples, num_samples - offset)
+            processor.process(rx_view[2 * offset:2 * (offset + num)], num)
+
+
+def _rx_stream(sdr: "_bladerf.BladeRF", params: dict, num_samples: int,
+               processor: dsp.StreamProcessor, rx_stats: telemetry.Telemetry,
+               logger: logging.Logger) -> None:
+    """Receives samples into a single reusable buffer for analysis only
+
+    Nothing is written to disk, only the results of the streaming analysis
+    stages are kept.
+
+    Args:
+        sdr: A configured `BladeRF` object with its Rx channel enabled.
+        params: The `dict` with capture parameters. Uses `buffer_size`.
+        num_samples: An `int` with the number of samples to receive. A value
+                     of zero means receive until interrupted by the user.
+        processor: The `dsp.StreamProcessor` to pass each block through.
+        rx_stats: The `telemetry.Telemetry` object to record throughput and
+                  `sync_rx` durations to.
+        logger: The `logging.Logger` object to write diagnostics to.
+
+    Returns:
+        Nothing
+
+    Raises:
+        Nothing
+    """
+
     bytes_per_sample = 4
-    buffer = bytearray(params["buffer_size"] * bytes_per_sample)
-    
-    num_samples = int(params["sample_rate"] * params["time_duration"])
-    logging.info(f"Calculated number of samples: {num_samples:.2e}")
+    buffer_samples = params["buffer_size"]
+    buffer = bytearray(buffer_samples * bytes_per_sample)
 
-    rx_ch.enable = True
-    logger.info(f"Rx gain set to {rx_ch.gain} dB")
-    logger.info("Rx channel configured and enabled")
+    num_samples_rcvd = 0
+
+    try:
+        while num_samples <= 0 or num_samples_rcvd < num_samples:
+            if num_samples > 0:
+                num = min(buffer_samples, num_samples - num_samples_rcvd)
+            else:
+                num = buffer_samples
+
+            start = time.perf_counter()
+            sdr.sync_rx(buffer, num)
+            rx_stats.record("sync_rx", time.perf_counter() - start)
+            rx_stats.add(num)
+
+            processor.process(buffer, num)
+
+            num_samples_rcvd += num
+    except KeyboardInterrupt:
+        logger.info("User interrupt, stopping receiving")
+
+    logger.info(f"Received and processed {num_samples_rcvd} samples")
+
+
+def _rx_to_file(sdr: "_bladerf.BladeRF", params: dict, num_samples: int,
+                out_file: iqfile.CaptureWriter,
+                processor: Optional[dsp.StreamProcessor],
+                rx_stats: telemetry.Telemetry,
+                logger: logging.Logger) -> None:
+    """Receives samples to a file, writing each buffer as it arrives
 
-    # ! Each sample consists of I and Q values
-    rx_signal = np.zeros(num_samples * 2, dtype=np.int16)
+    Args:
+        sdr: A configured `BladeRF` object with its Rx channel enabled.
+        params: The `dict` with capture parameters. Uses `buffer_size`.
+        num_samples: An `int` with the number of samples to receive. A value
+                     of zero means receive until interrupted by the user.
+        out_file: The `iqfile.CaptureWriter` to write the samples to.
+        processor: An optional `dsp.StreamProcessor` to pass each block
+                   through before it is written.
+        rx_stats: The `telemetry.Telemetry` object to record throughput and
+                  `sync_rx` and `write` durations to.
+        logger: The `logging.Logger` object to write diagnostics to.
+
+    Returns:
+        Nothing
+
+    Raises:
+        Nothing
+    """
+
+    bytes_per_sample = 4
+    buffer = bytearray(params["buffer_size"] * bytes_per_sample)
 
     num_samples_rcvd = 0
 
-    with open("test.iqbin", "wb") as out_file:
+    try:
         while True:
             if num_samples > 0 and num_samples_rcvd == num_samples:
-                logging.info("All samples received")
+                logger.info("All samples received")
                 break
             elif num_samples > 0:
                 num = min(
@@ -92,24 +340,659 @@ def bladerf_cw_tone_rx(params: dict, logger: logging.Logger) -> None:
                 )
             else:
                 num = len(buffer) // bytes_per_sample
-        
-            sdr.sync_rx(buffer, num) 
-        
-            samples = np.frombuffer(buffer, dtype=np.int16)
-        
-#        samples = samples[0::2] + 1j * samples[1::2] # Convert to complex type
-#        samples /= 2048.0 # Scale to -1 to 1 (its using 12 bit ADC)
-            out_file.write(samples.tobytes())
-            
-#            rx_signal[num_samples_rcvd:num_samples_rcvd+2*num] = samples # Store buf in samples array
-        
+
+            start = time.perf_counter()
+            sdr.sync_rx(buffer, num)
+            rx_stats.record("sync_rx", time.perf_counter() - start)
+
+            if processor is not None:
+                processor.process(buffer, num)
+
+            start = time.perf_counter()
+            out_file.write(memoryview(buffer)[:num * bytes_per_sample])
+            rx_stats.record("write", time.perf_counter() - start)
+
+            rx_stats.add(num)
             num_samples_rcvd += num
-            logging.info(f"Received {num_samples_rcvd} out of {num_samples}")
+    except KeyboardInterrupt:
+        logger.info("User interrupt, stopping receiving")
+
+
+def _rx_to_file_threaded(sdr: "_bladerf.BladeRF", params: dict,
+                         num_samples: int, out_file: iqfile.CaptureWriter,
+                         processor: Optional[dsp.StreamProcessor],
+                         rx_stats: telemetry.Telemetry,
+                         logger: logging.Logger) -> None:
+    """Receives samples to a file, with disk writes on a separate thread
+
+    The receive thread only ever fills buffers from a preallocated pool and
+    queues them, so a disk stall is absorbed by the pool instead of causing
+    the device to overrun. Writer queue depth and high-water mark are added
+    to the periodic telemetry reports, and logged again at the end.
+
+    Args:
+        sdr: A configured `BladeRF` object with its Rx channel enabled.
+        params: The `dict` with capture parameters. Uses `buffer_size`, and
+                the optional `num_writer_buffers`.
+        num_samples: An `int` with the number of samples to receive. A value
+                     of zero means receive until interrupted by the user.
+        out_file: The `iqfile.CaptureWriter` to write the samples to.
+        processor: An optional `dsp.StreamProcessor` to pass each block
+                   through, on the receive thread, before it is queued.
+        rx_stats: The `telemetry.Telemetry` object to record throughput and
+                  `sync_rx` and `write` durations to.
+        logger: The `logging.Logger` object to write diagnostics to.
+
+    Returns:
+        Nothing
+
+    Raises:
+        RuntimeError: If the writer thread fails.
+    """
+
+    bytes_per_sample = 4
+    buffer_samples = params["buffer_size"]
+    num_writer_buffers = params.get("num_writer_buffers", 256)
+
+    num_samples_rcvd = 0
 
+    with async_writer.AsyncWriter(
+        out_file, buffer_samples * bytes_per_sample, num_writer_buffers,
+        logger, rx_stats
+    ) as writer:
+        rx_stats.add_gauge("writer queue depth", lambda: writer.depth)
+        rx_stats.add_gauge("high-water mark", lambda: writer.high_water)
+
+        try:
+            while num_samples <= 0 or num_samples_rcvd < num_samples:
+                if num_samples > 0:
+                    num = min(buffer_samples, num_samples - num_samples_rcvd)
+                else:
+                    num = buffer_samples
+
+                buffer = writer.get_buffer()
+
+                start = time.perf_counter()
+                sdr.sync_rx(buffer, num)
+                rx_stats.record("sync_rx", time.perf_counter() - start)
+
+                if processor is not None:
+                    processor.process(buffer, num)
+                writer.submit(buffer, num * bytes_per_sample)
+
+                rx_stats.add(num)
+                num_samples_rcvd += num
+        except KeyboardInterrupt:
+            logger.info("User interrupt, stopping receiving")
+
+    logger.info(f"Received {num_samples_rcvd} samples in total")
+    writer.log_stats()
+
+
+def _rx_triggered(sdr: "_bladerf.BladeRF", params: dict, num_samples: int,
+                  out_file: iqfile.CaptureWriter,
+                  processor: Optional[dsp.StreamProcessor],
+                  rx_stats: telemetry.Telemetry,
+                  logger: logging.Logger) -> None:
+    """Receives samples, writing only those around threshold crossings
+
+    Every block goes through a `trigger.TriggeredRecorder`, which compares
+    the power of each sample with `trigger_level`. At the first sample above
+    it, the `pre_trigger_samples` before it are committed from a ring buffer
+    to the capture file, followed by the samples up to
+    `post_trigger_samples` after the last one above the level. The event
+    index is stored in the sidecar of the capture file.
+
+    Args:
+        sdr: A configured `BladeRF` object with its Rx channel enabled.
+        params: The `dict` with capture parameters. Uses `buffer_size`, and
+                the optional `trigger_level` in dBFS, `pre_trigger_samples`
+                and `post_trigger_samples`.
+        num_samples: An `int` with the number of samples to receive. A value
+                     of zero means receive until interrupted by the user.
+        out_file: The `iqfile.CaptureWriter` to write the events to.
+        processor: An optional `dsp.StreamProcessor` to pass every block
+                   through, whether it is part of an event or not.
+        rx_stats: The `telemetry.Telemetry` object to record throughput and
+                  `sync_rx` durations to.
+        logger: The `logging.Logger` object to write diagnostics to.
+
+    Returns:
+        Nothing
+
+    Raises:
+        ValueError: If a trigger length is negative.
+    """
+
+    bytes_per_sample = 4
+    buffer_samples = params["buffer_size"]
+    buffer = bytearray(buffer_samples * bytes_per_sample)
 
-    rx_ch.enable = False
+    recorder = trigger.TriggeredRecorder(
+        out_file,
+        params.get("trigger_level", -30.0),
+        params.get("pre_trigger_samples", buffer_samples),
+        params.get("post_trigger_samples", buffer_samples),
+    )
+    rx_stats.add_gauge("trigger events", lambda: len(recorder.events))
+
+    num_samples_rcvd = 0
+
+    try:
+        while num_samples <= 0 or num_samples_rcvd < num_samples:
+            if num_samples > 0:
+                num = min(buffer_samples, num_samples - num_samples_rcvd)
+            else:
+                num = buffer_samples
+
+            start = time.perf_counter()
+            sdr.sync_rx(buffer, num)
+            rx_stats.record("sync_rx", time.perf_counter() - start)
+            rx_stats.add(num)
+
+            if processor is not None:
+                processor.process(buffer, num)
+            recorder.process(buffer, num)
+
+            num_samples_rcvd += num
+    except KeyboardInterrupt:
+        logger.info("User interrupt, stopping receiving")
+
+    recorder.finish()
+    recorder.log_summary(logger)
+
+
+def _rx_timestamped(sdr: "_bladerf.BladeRF", params: dict, num_samples: int,
+                    out_file: iqfile.CaptureWriter,
+                    processor: Optional[dsp.StreamProcessor],
+                    rx_stats: telemetry.Telemetry,
+                    logger: logging.Logger) -> None:
+    """Receives samples with metadata and checks their time base
+
+    Works as the `threaded` capture mode, but every `sync_rx` call also
+    returns the hardware timestamp of the block and any overrun status.
+    These are followed by a `timestamps.GapTracker`, whose block and gap
+    index is saved next to the capture, and whose summary, including
+    whether the run is valid, goes into the sidecar. A call which returns
+    no samples is recorded as an overrun, and receiving stops after
+    `max_empty_reads` of them in a row.
+
+    Args:
+        sdr: A `BladeRF` object configured for `SC16_Q11_META` samples,
+             with its Rx channel enabled.
+        params: The `dict` with capture parameters. Uses `buffer_size`, and
+                the optional `num_writer_buffers` and `max_empty_reads`.
+        num_samples: An `int` with the number of samples to receive. A value
+                     of zero means receive until interrupted by the user.
+        out_file: The `iqfile.CaptureWriter` to write the samples to.
+        processor: An optional `dsp.StreamProcessor` to pass each block
+                   through before it is queued.
+        rx_stats: The `telemetry.Telemetry` object to record throughput and
+                  `sync_rx` and `write` durations to.
+        logger: The `logging.Logger` object to write diagnostics to.
+
+    Returns:
+        Nothing
+
+    Raises:
+        RuntimeError: If the writer thread fails.
+    """
+
+    bytes_per_sample = 4
+    buffer_samples = params["buffer_size"]
+    num_writer_buffers = params.get("num_writer_buffers", 256)
+
+    max_empty_reads = params.get("max_empty_reads", MAX_EMPTY_READS)
+
+    tracker = timestamps.GapTracker()
+    meta = timestamps.new_metadata(sdr)
+
+    num_samples_rcvd = 0
+    empty_reads = 0
+    buffer = None
+
+    with async_writer.AsyncWriter(
+        out_file, buffer_samples * bytes_per_sample, num_writer_buffers,
+        logger, rx_stats
+    ) as writer:
+        rx_stats.add_gauge("writer queue depth", lambda: writer.depth)
+        rx_stats.add_gauge("gaps", lambda: tracker.num_gaps)
+        rx_stats.add_gauge("overruns", lambda: tracker.overruns)
+
+        try:
+            while num_samples <= 0 or num_samples_rcvd < num_samples:
+                if num_samples > 0:
+                    num = min(buffer_samples, num_samples - num_samples_rcvd)
+                else:
+                    num = buffer_samples
+
+                # * A buffer left over from an empty read is used again
+                if buffer is None:
+                    buffer = writer.get_buffer()
+
+                meta.flags = timestamps.META_FLAG_RX_NOW
+                start = time.perf_counter()
+                sdr.sync_rx(buffer, num, meta=meta)
+                rx_stats.record("sync_rx", time.perf_counter() - start)
+
+                # ! On an overrun fewer samples than requested are returned
+                num = meta.actual_count
+                if num == 0:
+                    tracker.record_empty()
+                    empty_reads += 1
+                    logger.warning(
+                        f"sync_rx returned no samples, {empty_reads} times "
+                        f"in a row"
+                    )
+                    if empty_reads >= max_empty_reads:
+                        logger.error(
+                            "Device keeps returning no samples, stopping "
+                            "receiving"
+                        )
+                        break
+                    continue
+
+                empty_reads = 0
+                tracker.record(meta.timestamp, num, meta.status)
+
+                if processor is not None:
+                    processor.process(buffer, num)
+                writer.submit(buffer, num * bytes_per_sample)
+                buffer = None
+
+                rx_stats.add(num)
+                num_samples_rcvd += num
+        except KeyboardInterrupt:
+            logger.info("User interrupt, stopping receiving")
+
+    writer.log_stats()
+    tracker.log_summary(logger)
+
+    out_file.metadata["timestamps"] = tracker.summary()
+    index_file = tracker.save(out_file.filename)
+    logger.info(f"Gap index saved to {index_file}")
+
+
+def _rx_mimo(sdr: "_bladerf.BladeRF", params: dict, num_samples: int,
+             out_files: list, rx_stats: telemetry.Telemetry,
+             logger: logging.Logger) -> None:
+    """Receives both Rx channels with the RX_X2 layout
+
+    With one output file the interleaved stream is received straight into
+    buffers of an `async_writer.AsyncWriter` and written as it is. With one
+    output file per channel the stream is received into a staging buffer
+    and de-interleaved with strided views into a separate writer per
+    channel, one block copy per channel. Either way disk writes happen on
+    background threads, so the receive thread keeps up with the aggregate
+    rate of both channels.
+
+    Args:
+        sdr: A configured `BladeRF` object with both Rx channels enabled.
+        params: The `dict` with capture parameters. Uses `buffer_size`, as
+                the number of samples per channel in each block, and the
+                optional `num_writer_buffers`.
+        num_samples: An `int` with the number of samples to receive per
+                     channel. A value of zero means receive until
+                     interrupted by the user.
+        out_files: A `list` of `iqfile.CaptureWriter`, either a single one
+                   for the interleaved stream or one per channel in
+                   `MIMO_CHANNELS`.
+        rx_stats: The `telemetry.Telemetry` object to record throughput,
+                  over all channels, and `sync_rx` and `write` durations to.
+        logger: The `logging.Logger` object to write diagnostics to.
+
+    Returns:
+        Nothing
+
+    Raises:
+        RuntimeError: If a writer thread fails.
+    """
+
+    bytes_per_sample = 4
+    num_channels = len(MIMO_CHANNELS)
+    buffer_samples = params["buffer_size"]
+    num_writer_buffers = params.get("num_writer_buffers", 256)
+    interleaved = len(out_files) == 1
+    block_samples = buffer_samples * (num_channels if interleaved else 1)
+
+    num_samples_rcvd = 0
+
+    with contextlib.ExitStack() as stack:
+        writers = [
+            stack.enter_context(async_writer.AsyncWriter(
+                out_file, block_samples * bytes_per_sample,
+                num_writer_buffers, logger, rx_stats
+            ))
+            for out_file in out_files
+        ]
+        rx_stats.add_gauge(
+            "writer queue depth",
+            lambda: max(writer.depth for writer in writers)
+        )
+
+        if not interleaved:
+            staging = bytearray(buffer_samples * num_channels
+                                * bytes_per_sample)
+            staging_values = np.frombuffer(staging, dtype=np.int16)
+
+        try:
+            while num_samples <= 0 or num_samples_rcvd < num_samples:
+                if num_samples > 0:
+                    num = min(buffer_samples, num_samples - num_samples_rcvd)
+                else:
+                    num = buffer_samples
+
+                if interleaved:
+                    buffer = writers[0].get_buffer()
+                else:
+                    buffer = staging
+
+                start = time.perf_counter()
+                sdr.sync_rx(buffer, num * num_channels)
+                rx_stats.record("sync_rx", time.perf_counter() - start)
+
+                if interleaved:
+                    writers[0].submit(
+                        buffer, num * num_channels * bytes_per_sample
+                    )
+                else:
+                    channels = iqfile.deinterleave(
+                        staging_values[:2 * num * num_channels], num_channels
+                    )
+                    for writer, samples in zip(writers, channels):
+                        buffer = writer.get_buffer()
+                        np.copyto(
+                            np.frombuffer(
+                                buffer, dtype=np.int16, count=2 * num
+                            ).reshape(-1, 2),
+                            samples
+                        )
+                        writer.submit(buffer, num * bytes_per_sample)
+
+                rx_stats.add(num * num_channels)
+                num_samples_rcvd += num
+        except KeyboardInterrupt:
+            logger.info("User interrupt, stopping receiving")
+
+    logger.info(
+        f"Received {num_samples_rcvd} samples per channel on "
+        f"{num_channels} channels"
+    )
+    for writer in writers:
+        writer.log_stats()
+
+
+def _rx_mimo_capture(sdr: "_bladerf.BladeRF", params: dict, num_samples: int,
+                     metadata: dict, rx_stats: telemetry.Telemetry,
+                     logger: logging.Logger) -> None:
+    """Opens the MIMO capture files and receives into them
+
+    If `mimo_output` in `params` is `separate`, the default, each channel
+    goes to its own capture file, named by `iqfile.channel_filename`, with
+    the usual single-channel sidecar, so it can be memory-mapped and read
+    on its own. If `compression` is set, these are chunked, compressed
+    captures instead, see `_open_capture_writer`. If it is `interleaved`,
+    both channels go to `output_file` as received, uncompressed, and the
+    sidecar records `num_channels` and the channel order so that
+    `iqfile.CaptureReader.channel` can separate them.
+
+    Args:
+        sdr: A configured `BladeRF` object with both Rx channels enabled.
+        params: The `dict` with capture parameters.
+        num_samples: An `int` with the number of samples to receive per
+                     channel. A value of zero means receive until
+                     interrupted by the user.
+        metadata: A `dict` with the actual Rx settings of the device.
+        rx_stats: The `telemetry.Telemetry` object to record to.
+        logger: The `logging.Logger` object to write diagnostics to.
+
+    Returns:
+        Nothing
+
+    Raises:
+        RuntimeError: If a writer thread fails.
+    """
+
+    output_file = params.get("output_file", "test.iqbin")
+    mimo_output = params.get("mimo_output", "separate")
+
+    if mimo_output == "interleaved":
+        filenames = [output_file]
+        file_metadata = [dict(
+            metadata, rx_ch=list(MIMO_CHANNELS),
+            num_channels=len(MIMO_CHANNELS)
+        )]
+    else:
+        filenames = [iqfile.channel_filename(output_file, ch)
+                     for ch in MIMO_CHANNELS]
+        file_metadata = [dict(metadata, rx_ch=ch) for ch in MIMO_CHANNELS]
+
+    with contextlib.ExitStack() as stack:
+        out_files = [
+            stack.enter_context(_open_capture_writer(filename, meta, params))
+            for filename, meta in zip(filenames, file_metadata)
+        ]
+        _rx_mimo(sdr, params, num_samples, out_files, rx_stats, logger)
+
+    for out_file in out_files:
+        logger.info(
+            f"Wrote {out_file.num_samples} samples to {out_file.filename}"
+        )
+
+
+def bladerf_cw_tone_rx(
+        params: dict, logger: logging.Logger,
+        sdr: Optional["_bladerf.BladeRF"] = None) -> Optional[np.ndarray]:
+    """Sets up a BladeRF 2.0 micro xA4 as a CW receiver
+
+    Args:
+        params: A `dict` with the Rx settings and capture parameters.
+        logger: The `logging.Logger` object to write diagnostics to.
+        sdr: An optional device object to use instead of connecting to a
+             bladeRF unit, e.g. a `simulator.SimulatedBladeRF`.
+
+    Returns:
+        In `memory` capture mode, an `np.ndarray` with the received samples,
+        either as interleaved SC16 Q11 `int16` values or, if `complex_output`
+        is set in `params`, as scaled `complex64` values. `None` otherwise.
+    """
+    
+    if sdr is None:
+        try:
+            # * Only needed for real hardware, see `simulator`
+            from bladerf import _bladerf
+
+            sdr = _bladerf.BladeRF()
+        except Exception as error:
+            logger.critical(f"Could not connect to bladeRF unit")
+            logger.critical(f"Error message returned: {error.args[0]}")
+            raise RuntimeError("Could not connect to bladeRF unit") from error
+
+        logger.info(f"Device info: {_bladerf.get_device_list()[0]}")
+        logger.info(f"libbladeRF version: {_bladerf.version()}")
+    else:
+        logger.info(f"Using supplied device: {sdr}")
+
+    logger.info(f"Firmware version: {sdr.get_fw_version()}")
+    logger.info(f"FPGA version: {sdr.get_fpga_version()}")
+        
+    capture_mode = params.get("capture_mode", "file")
+    if capture_mode not in CAPTURE_MODES:
+        logger.critical(f"Invalid capture mode: {capture_mode}")
+        raise RuntimeError("Error configuring bladeRF unit")
+
+    logger.info(f"Using capture mode: {capture_mode}")
+
+    if capture_mode == "mimo":
+        rx_channels = MIMO_CHANNELS
+    else:
+        rx_channels = (params["rx_ch"],)
+
+    rx_chs = [_configure_rx_channel(sdr, ch, params, logger)
+              for ch in rx_channels]
+    bladerf_api = simulator.bladerf_constants(sdr)
+    channel = bladerf_api.CHANNEL_RX(rx_channels[0])
+    rx_ch = rx_chs[0]
+
+    if capture_mode == "mimo":
+        layout = bladerf_api.ChannelLayout.RX_X2
+    else:
+        layout = bladerf_api.ChannelLayout(channel)
+
+    stream_config = stream_tuning.load_stream_config(
+        "rx", params["sample_rate"],
+        params.get("stream_config_file", stream_tuning.CONFIG_FILE)
+    )
+    logger.info(
+        f"Using {'tuned' if stream_config['tuned'] else 'default'} stream "
+        f"config: {stream_tuning.sync_config_args(stream_config)}"
+    )
+
+    params = dict(params)
+    params.setdefault("buffer_size", stream_config["host_buffer_size"])
+    if params["buffer_size"] % stream_tuning.SAMPLE_GRANULARITY:
+        logger.warning(
+            f"Host buffer size of {params['buffer_size']} samples is not a "
+            f"multiple of {stream_tuning.SAMPLE_GRANULARITY}"
+        )
+
+    try:
+        processor = _build_stream_processor(params)
+    except ValueError as error:
+        logger.critical(f"Invalid streaming analysis parameters: {error}")
+        raise RuntimeError("Error configuring bladeRF unit") from error
+
+    if capture_mode == "stream" and processor is None:
+        logger.critical("Stream capture mode needs at least one analysis stage")
+        raise RuntimeError("Error configuring bladeRF unit")
+
+    if capture_mode == "triggered" and (
+        params.get("pre_trigger_samples", 0) < 0
+        or params.get("post_trigger_samples", 0) < 0
+    ):
+        logger.critical("Trigger lengths must not be negative")
+        raise RuntimeError("Error configuring bladeRF unit")
+
+    if capture_mode == "mimo" and processor is not None:
+        logger.critical("Streaming analysis is not supported in MIMO mode")
+        raise RuntimeError("Error configuring bladeRF unit")
+
+    if params.get("compression") and (
+        params["compression"] not in chunkfile.CODECS
+        or params.get("compression_filter", "shuffle") not in chunkfile.FILTERS
+    ):
+        logger.critical("Invalid capture compression parameters")
+        raise RuntimeError("Error configuring bladeRF unit")
+
+    if (capture_mode == "mimo"
+            and params.get("mimo_output", "separate") not in MIMO_OUTPUTS):
+        logger.critical(f"Invalid MIMO output: {params['mimo_output']}")
+        raise RuntimeError("Error configuring bladeRF unit")
+
+    # ! Chunked captures cannot be split into channels when read back
+    if (capture_mode == "mimo" and params.get("compression")
+            and params.get("mimo_output", "separate") == "interleaved"):
+        logger.critical("Interleaved MIMO captures cannot be compressed")
+        raise RuntimeError("Error configuring bladeRF unit")
+
+    if capture_mode == "timestamped":
+        sample_format = bladerf_api.Format.SC16_Q11_META
+    else:
+        sample_format = bladerf_api.Format.SC16_Q11
+
+    sdr.sync_config(
+        layout=layout,
+        fmt=sample_format,
+        **stream_tuning.sync_config_args(stream_config)
+    )
+
+    num_samples = int(params["sample_rate"] * params["time_duration"])
+    logger.info(f"Calculated number of samples: {num_samples:.2e}")
+
+    if capture_mode == "memory" and num_samples <= 0:
+        logger.critical("Memory capture mode needs a fixed time duration")
+        raise RuntimeError("Error configuring bladeRF unit")
+
+    for ch in rx_chs:
+        ch.enable = True
+        logger.info(f"Rx gain set to {ch.gain} dB")
+    logger.info("Rx channel configured and enabled")
+
+    rx_signal = None
+
+    metadata = {
+        "sample_rate": rx_ch.sample_rate,
+        "freq_centre": rx_ch.frequency,
+        "bandwidth": rx_ch.bandwidth,
+        "rx_gain": rx_ch.gain,
+        "rx_ch": params["rx_ch"],
+    }
+
+    rx_stats = telemetry.Telemetry(
+        logger, "Rx", params.get("report_interval", 1.0)
+    )
+
+    with rx_stats:
+        if capture_mode == "memory":
+            # ! Each sample consists of I and Q values
+            rx_signal = np.zeros(num_samples * 2, dtype=np.int16)
+            _rx_to_memory(
+                sdr, params, rx_signal, processor, rx_stats, logger
+            )
+        elif capture_mode == "stream":
+            _rx_stream(sdr, params, num_samples, processor, rx_stats, logger)
+        elif capture_mode == "mimo":
+            _rx_mimo_capture(
+                sdr, params, num_samples, metadata, rx_stats, logger
+            )
+        else:
+            output_file = params.get("output_file", "test.iqbin")
+
+            with _open_capture_writer(
+                output_file, metadata, params
+            ) as out_file:
+                if capture_mode == "triggered":
+                    _rx_triggered(
+                        sdr, params, num_samples, out_file, processor,
+                        rx_stats, logger
+                    )
+                elif capture_mode == "timestamped":
+                    _rx_timestamped(
+                        sdr, params, num_samples, out_file, processor,
+                        rx_stats, logger
+                    )
+                elif capture_mode == "threaded":
+                    _rx_to_file_threaded(
+                        sdr, params, num_samples, out_file, processor,
+                        rx_stats, logger
+                    )
+                else:
+                    _rx_to_file(
+                        sdr, params, num_samples, out_file, processor,
+                        rx_stats, logger
+                    )
+
+            logger.info(
+                f"Wrote {out_file.num_samples} samples to {output_file}"
+            )
+            if isinstance(out_file, chunkfile.ChunkedWriter):
+                logger.info(
+                    f"Compressed to {out_file.compressed_bytes:.3e} bytes, "
+                    f"ratio {out_file.compression_ratio:.2f}"
+                )
+
+    if rx_signal is not None and params.get("complex_output", False):
+        rx_signal = iqfile.sc16_to_complex64(rx_signal)
+
+    if processor is not None:
+        _save_stream_results(processor, params, metadata, logger)
+
+    for ch in rx_chs:
+        ch.enable = False
     logger.info("Rx channel disabled")
 
+    return rx_signal
+
    
 if __name__ == "__main__":
     # args = cli_args()
@@ -123,7 +1006,9 @@ if __name__ == "__main__":
        "bandwidth": 10e6, 
        "rx_gain": 0,
        "time_duration": 0.01,
-       "buffer_size": 2000
+       "capture_mode": "file",
+       "output_file": "test.iqbin",
+       "report_interval": 1.0
     }
 
     bladerf_rx_logger = helpers.setup_logger(
@@ -1,42 +1,281 @@
 """bladeRF 2.0 micro xA4 control - Tx side
 
 Quick and simple script to generate a CW tone from a bladeRF 2.0 micro xA4
-unit.
+unit. In `stream` mode it transmits a non-repeating signal instead, such as
+a stepped sweep or a hop sequence, generated on the fly by a background
+producer, and in `replay` mode it plays back a recorded capture.
 """
 
 
+import contextlib
 import datetime
 import logging
+import time
 import numpy as np
-import matplotlib.pyplot as plt
 
-from bladerf import _bladerf
+from typing import Optional
 
+import chunkfile
 import helpers
+import simulator
+import stream_tuning
+import telemetry
+import tx_stream
+import waveforms
 
 
 NTP_SERVER = "0.uk.pool.ntp.org"
 
+TX_MODES = ("static", "stream", "replay")
+TX_SIGNALS = ("tone", "sweep", "hop")
 
-def bladerf_cw_tone_tx(params: dict, logger: logging.Logger) -> None:
+
+def _build_tx_signal(params: dict) -> waveforms.Generator:
+    """Builds the generator of a streamed Tx signal from the parameters
+
+    Args:
+        params: A `dict` with either a ready-made `generator`, or a
+                `signal` of `tone`, a CW tone at `freq_tone` from a lookup
+                table NCO, interpolated if `nco_interpolate` is set,
+                `sweep`, stepping from `sweep_start` to `sweep_stop` in
+                `sweep_step` Hz, or `hop`, visiting `hop_freqs`, shuffled if
+                `hop_seed` is set. Each sweep or hop step lasts `dwell_time`
+                seconds.
+
+    Returns:
+        A generator function from `waveforms`.
+
+    Raises:
+        ValueError: If the signal is unknown or its parameters invalid.
+    """
+
+    if params.get("generator") is not None:
+        return params["generator"]
+
+    signal = params.get("signal", "sweep")
+    if signal not in TX_SIGNALS:
+        raise ValueError(f"Unknown Tx signal: {signal}")
+
+    if signal == "tone":
+        return waveforms.NCO(
+            params["sample_rate"], params["freq_tone"],
+            interpolate=params.get("nco_interpolate", False)
+        )
+
+    if signal == "sweep":
+        if params["sweep_step"] == 0:
+            raise ValueError("Sweep step must not be zero")
+        freqs = np.arange(
+            params["sweep_start"],
+            params["sweep_stop"] + params["sweep_step"] / 2,
+            params["sweep_step"]
+        )
+    else:
+        freqs = np.asarray(params["hop_freqs"], dtype=np.float64)
+        if params.get("hop_seed") is not None:
+            freqs = np.random.default_rng(params["hop_seed"]).permutation(
+                freqs
+            )
+
+    if freqs.size == 0:
+        raise ValueError("Tx signal has no frequencies")
+    if params["dwell_time"] <= 0:
+        raise ValueError("Dwell time must be positive")
+
+    return waveforms.frequency_steps(
+        params["sample_rate"], freqs, params["dwell_time"]
+    )
+
+
+def _tx_telemetry(params: dict, logger: logging.Logger):
+    """Sets up the Tx telemetry and underrun monitor
+
+    Returns:
+        A `tuple` of the `telemetry.Telemetry` object, reporting every
+        `report_interval` seconds, and the `telemetry.UnderrunMonitor`,
+        whose count is reported as a gauge.
+    """
+
+    tx_stats = telemetry.Telemetry(
+        logger, "Tx", params.get("report_interval", 1.0),
+        timed_calls=("sync_tx",), nominal_rate=params["sample_rate"]
+    )
+    monitor = telemetry.UnderrunMonitor(params["sample_rate"])
+    tx_stats.add_gauge("underruns", lambda: monitor.underruns)
+
+    return tx_stats, monitor
+
+
+def _log_underruns(monitor: telemetry.UnderrunMonitor,
+                   logger: logging.Logger) -> None:
+    if monitor.underruns:
+        logger.warning(
+            f"Tx underran {monitor.underruns} times, device idle for "
+            f"{monitor.lost_time:.3e} sec"
+        )
+    else:
+        logger.info("No Tx underruns detected")
+
+
+def _open_tx_producer(params: dict, block_samples: int,
+                      logger: logging.Logger,
+                      stack: contextlib.ExitStack) -> tx_stream.TxProducer:
+    """Starts the producer of a `stream` or `replay` mode transmission
+
+    Args:
+        params: A `dict` with the Tx settings, see `bladerf_cw_tone_tx`.
+        block_samples: An `int` with the number of samples per Tx buffer.
+        logger: The `logging.Logger` object to write diagnostics to.
+        stack: A `contextlib.ExitStack` which the capture file and the
+               producer are entered into.
+
+    Returns:
+        The running `tx_stream.TxProducer`.
+
+    Raises:
+        KeyError: If a required parameter is missing.
+        ValueError: If the signal or playback parameters are invalid.
+        OSError: If the capture to replay cannot be opened.
+    """
+
+    duration = params.get("time_duration", 0)
+    num_samples = (int(round(duration * params["sample_rate"]))
+                   if duration > 0 else None)
+    num_buffers = params.get("tx_ring_buffers", 16)
+
+    if params["tx_mode"] == "stream":
+        return stack.enter_context(tx_stream.TxProducer(
+            _build_tx_signal(params), block_samples,
+            params.get("amplitude", 1.0), num_buffers, num_samples, logger
+        ))
+
+    reader = stack.enter_context(
+        chunkfile.open_capture(params["replay_file"])
+    )
+    logger.info(f"Replaying {params['replay_file']}, {len(reader)} samples")
+    if reader.sample_rate not in (None, params["sample_rate"]):
+        logger.warning(
+            f"Capture was recorded at {reader.sample_rate:.3e} samples/sec, "
+            f"replaying at {params['sample_rate']:.3e} samples/sec"
+        )
+
+    return stack.enter_context(tx_stream.ReplayProducer(
+        reader, block_samples, params.get("replay_start", 0),
+        params.get("replay_stop"), params.get("replay_loop", False),
+        params.get("replay_gain", 1.0), num_buffers, num_samples, logger
+    ))
+
+
+def _tx_stream(sdr: "_bladerf.BladeRF", tx_ch, params: dict,
+               stream_config: dict, logger: logging.Logger) -> None:
+    """Transmits buffers from a `tx_stream.TxProducer` as they are ready
+
+    Runs for `time_duration` seconds if set, otherwise until the signal
+    ends or the user interrupts.
+    """
+
+    # * Whole stream buffers per call, so every sync_tx submits full ones
+    buffer_size = stream_config["buffer_size"]
+    block_samples = max(1, params.get("tx_block_samples",
+                                      stream_config["host_buffer_size"])
+                        // buffer_size) * buffer_size
+
+    with contextlib.ExitStack() as stack:
+        try:
+            producer = _open_tx_producer(params, block_samples, logger, stack)
+        except (KeyError, ValueError, OSError) as error:
+            logger.critical(f"Invalid Tx {params['tx_mode']} parameters: "
+                            f"{error}")
+            raise RuntimeError("Error configuring bladeRF unit") from error
+
+        producer.prime()
+        logger.info(
+            f"Tx ring primed with {producer.depth} buffers of "
+            f"{block_samples} samples"
+        )
+
+        tx_stats, monitor = _tx_telemetry(params, logger)
+        tx_stats.add_gauge("ring depth", lambda: producer.depth)
+        tx_stats.add_gauge("starvations", lambda: producer.starvations)
+
+        tx_ch.enable = True
+        logger.info("Tx channel configured and enabled")
+
+        try:
+            with tx_stats:
+                while True:
+                    item = producer.get_buffer()
+                    if item is None:
+                        break
+
+                    buffer, num = item
+                    monitor.submit(num)
+                    start = time.perf_counter()
+                    sdr.sync_tx(buffer, num)
+                    tx_stats.record("sync_tx", time.perf_counter() - start)
+                    tx_stats.add(num)
+                    producer.release(buffer)
+
+        except KeyboardInterrupt:
+            logger.info("User interrupt, stopping transmitting")
+
+        finally:
+            tx_ch.enable = False
+            logger.info("Tx channel disabled")
+
+    producer.log_stats()
+    _log_underruns(monitor, logger)
+
+
+def bladerf_cw_tone_tx(params: dict, logger: logging.Logger,
+                       sdr: Optional["_bladerf.BladeRF"] = None) -> None:
     """Sets up a BladeRF 2.0 micro xA4 as a CW transmitter
 
+    Args:
+        params: A `dict` with the Tx settings and signal parameters. If the
+                optional `time_duration` is set, transmission stops after
+                that many seconds, otherwise it runs until interrupted. The
+                tone buffer holds a whole number of tone periods and stream
+                buffers, repeated to at least the optional `num_samples`
+                and the tuned `host_buffer_size`, and is cached in the
+                optional `waveform_cache` directory. If `tx_mode` is
+                `stream`, the signal described by the parameters, see
+                `_build_tx_signal`, is generated while transmitting
+                instead, in blocks of `tx_block_samples`, by default the
+                tuned `host_buffer_size`. If it is `replay`, the capture in
+                `replay_file` is played back from the optional
+                `replay_start` sample up to `replay_stop`, looped if
+                `replay_loop` is set and scaled by `replay_gain`.
+                Throughput, `sync_tx` latency and underruns are reported
+                every `report_interval` seconds.
+        logger: The `logging.Logger` object to write diagnostics to.
+        sdr: An optional device object to use instead of connecting to a
+             bladeRF unit, e.g. a `simulator.SimulatedBladeRF`.
     """
     
-    try:
-        sdr = _bladerf.BladeRF()
-    except Exception as error:
-        logger.critical(f"Could not connect to bladeRF unit")
-        logger.critical(f"Error message returned: {error.args[0]}")
-        raise RuntimeError("Could not connect to bladeRF unit") from error
-        
-    logger.info(f"Device info: {_bladerf.get_device_list()[0]}")
-    logger.info(f"libbladeRF version: {_bladerf.version()}")
+    if sdr is None:
+        try:
+            # * Only needed for real hardware, see `simulator`
+            from bladerf import _bladerf
+
+            sdr = _bladerf.BladeRF()
+        except Exception as error:
+            logger.critical(f"Could not connect to bladeRF unit")
+            logger.critical(f"Error message returned: {error.args[0]}")
+            raise RuntimeError("Could not connect to bladeRF unit") from error
+
+        logger.info(f"Device info: {_bladerf.get_device_list()[0]}")
+        logger.info(f"libbladeRF version: {_bladerf.version()}")
+    else:
+        logger.info(f"Using supplied device: {sdr}")
+
     logger.info(f"Firmware version: {sdr.get_fw_version()}")
     logger.info(f"FPGA version: {sdr.get_fpga_version()}")
         
+    bladerf_api = simulator.bladerf_constants(sdr)
+
     try:
-        channel = _bladerf.CHANNEL_TX(params["tx_ch"])
+        channel = bladerf_api.CHANNEL_TX(params["tx_ch"])
         tx_ch = sdr.Channel(channel)
     except Exception as error:
         logger.critical(f"Invalid Tx channel value: {channel}")
@@ -56,49 +295,85 @@ def bladerf_cw_tone_tx(params: dict, logger: logging.Logger) -> None:
     tx_ch.gain = params["tx_gain"]
     logger.info(f"Tx gain set to {tx_ch.gain} dB")
 
-    sdr.sync_config(
-        layout=_bladerf.ChannelLayout(channel),
-        fmt=_bladerf.Format.SC16_Q11,
-        num_buffers=512,
-        buffer_size=4096,
-        num_transfers=32,
-        stream_timeout=3500
+    stream_config = stream_tuning.load_stream_config(
+        "tx", params["sample_rate"],
+        params.get("stream_config_file", stream_tuning.CONFIG_FILE)
+    )
+    logger.info(
+        f"Using {'tuned' if stream_config['tuned'] else 'default'} stream "
+        f"config: {stream_tuning.sync_config_args(stream_config)}"
     )
 
-    time_duration = np.arange(params["num_samples"]) / params["sample_rate"]
-    logger.info(f"Calculated signal duration: {np.max(time_duration):.2e} sec")
+    sdr.sync_config(
+        layout=bladerf_api.ChannelLayout(channel),
+        fmt=bladerf_api.Format.SC16_Q11,
+        **stream_tuning.sync_config_args(stream_config)
+    )
 
-    samples = np.exp(1j * 2 * np.pi * time_duration * params["freq_tone"])
+    tx_mode = params.get("tx_mode", "static")
+    if tx_mode not in TX_MODES:
+        logger.critical(f"Invalid Tx mode: {tx_mode}")
+        raise RuntimeError("Error configuring bladeRF unit")
 
-    #samples = samples.astype(np.complex64)  # TODO: check this
-    samples *= 2047
+    if tx_mode in ("stream", "replay"):
+        _tx_stream(sdr, tx_ch, dict(params, tx_mode=tx_mode), stream_config,
+                   logger)
+        return
 
-    #samples = samples.view(np.int16)
-    samples = np.vstack((samples.real, samples.imag)).reshape((-1,), order='F')
-    samples = samples.astype(np.int16)
+    try:
+        waveform = waveforms.cw_waveform(
+            params["sample_rate"], params["freq_tone"],
+            params.get("amplitude", 1.0), stream_config["buffer_size"],
+            params.get("waveform_cache", waveforms.CACHE_DIR),
+            logger=logger
+        )
+    except ValueError as error:
+        logger.critical(f"Invalid waveform parameters: {error}")
+        raise RuntimeError("Error configuring bladeRF unit") from error
 
-    logger.info(f"Size of buffer, samples: {np.size(samples):.2e}")
+    # * Whole periods only, repeated to make each sync_tx call long enough
+    bytes_per_sample = 4
+    period_samples = len(waveform) // bytes_per_sample
+    min_samples = max(params.get("num_samples", 0),
+                      stream_config["host_buffer_size"])
+    repeats = max(1, -(-min_samples // period_samples))
+    buffer = waveform * repeats
+    num_samples = period_samples * repeats
 
-    buffer = samples.tobytes()
+    logger.info(
+        f"Calculated signal duration: {num_samples / params['sample_rate']:.2e}"
+        f" sec"
+    )
+    logger.info(f"Size of buffer, samples: {num_samples:.2e}")
     logger.info(f"Size of buffer, bytes: {len(buffer):.2e}")
 
+    tx_stats, monitor = _tx_telemetry(params, logger)
+
     tx_ch.enable = True
     logger.info("Tx channel configured and enabled")
 
     transmit_counter = 0
+    max_transmits = int(np.ceil(
+        params.get("time_duration", 0) * params["sample_rate"] / num_samples
+    ))
 
-    while True:
-        try:
-            sdr.sync_tx(buffer, params["num_samples"])
-            transmit_counter += 1
-            # logger.info(f"Transmitted {transmit_counter} buffers")
-           
-        except KeyboardInterrupt:
-            logger.info("User interrupt, stopping transmitting")
-            break
+    with tx_stats:
+        while max_transmits <= 0 or transmit_counter < max_transmits:
+            try:
+                monitor.submit(num_samples)
+                start = time.perf_counter()
+                sdr.sync_tx(buffer, num_samples)
+                tx_stats.record("sync_tx", time.perf_counter() - start)
+                tx_stats.add(num_samples)
+                transmit_counter += 1
+
+            except KeyboardInterrupt:
+                logger.info("User interrupt, stopping transmitting")
+                break
 
     tx_ch.enable = False
     logger.info("Tx channel disabled")
+    _log_underruns(monitor, logger)
 
    
 if __name__ == "__main__":
@@ -0,0 +1,521 @@
+"""Chunked, compressed IQ capture files
+
+An alternative to the raw `.iqbin` files of `iqfile` for long captures. The
+sample stream is cut into fixed-size chunks, each chunk is passed through a
+byte-shuffle or delta filter, which groups the slowly varying high bytes of
+the SC16 values together, and then compressed with a codec from the
+standard library. Chunks are compressed by a pool of worker threads or
+processes, and written to disk in order by a writer thread of their own, so
+the thread calling `write` only ever copies samples into the current chunk.
+
+The chunks are written one after the other, followed by an index with the
+file offset, compressed size and sample count of every chunk, and a fixed
+size footer pointing at the index. Readers only decompress the chunks
+covering the samples they access. The metadata goes into the same JSON
+sidecar as for raw captures, with the chunking parameters added.
+"""
+
+import bz2
+import concurrent.futures
+import datetime
+import json
+import lzma
+import os
+import queue
+import struct
+import threading
+import zlib
+
+from typing import Optional, Union
+
+import numpy as np
+
+import iqfile
+
+
+CONTAINER = "chunked"
+CODECS = ("zlib_huffman", "zlib", "bz2", "lzma")
+FILTERS = ("none", "shuffle", "delta")
+
+FOOTER_MAGIC = b"IQCHUNK1"
+FOOTER = struct.Struct("<QQ8s")
+
+# * One row per chunk: file offset, compressed size, number of samples
+INDEX_DTYPE = np.dtype("<i8")
+
+
+def _compress(data: bytes, codec: str, level: int) -> bytes:
+    if codec == "zlib_huffman":
+        # * Skips the match search, which finds little in shuffled IQ data
+        compressor = zlib.compressobj(
+            max(level, 1), zlib.DEFLATED, 15, 9, zlib.Z_HUFFMAN_ONLY
+        )
+        return compressor.compress(data) + compressor.flush()
+    if codec == "zlib":
+        return zlib.compress(data, level)
+    if codec == "bz2":
+        return bz2.compress(data, max(level, 1))
+    return lzma.compress(data, preset=level)
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec in ("zlib_huffman", "zlib"):
+        return zlib.decompress(data)
+    if codec == "bz2":
+        return bz2.decompress(data)
+    return lzma.decompress(data)
+
+
+def encode_chunk(data: bytes, codec: str, level: int,
+                 sample_filter: str) -> bytes:
+    """Filters and compresses one chunk of SC16 Q11 samples
+
+    Args:
+        data: A `bytes` object with interleaved I and Q `int16` values.
+        codec: A `str` with the codec name, one of `CODECS`.
+        level: An `int` with the compression level.
+        sample_filter: A `str` with the filter name, one of `FILTERS`.
+
+    Returns:
+        A `bytes` object with the compressed chunk.
+    """
+
+    values = np.frombuffer(data, dtype=np.int16).reshape(-1, 2)
+
+    if sample_filter == "delta":
+        # * Wraps around on overflow, undone exactly by a wrapping cumsum
+        filtered = np.empty_like(values)
+        filtered[0] = values[0]
+        np.subtract(values[1:], values[:-1], out=filtered[1:])
+        values = filtered
+
+    if sample_filter in ("shuffle", "delta"):
+        # * Low bytes of all values first, then all the high bytes
+        data = np.ascontiguousarray(values.view(np.uint8).reshape(-1, 2).T)
+
+    return _compress(memoryview(data).cast("B"), codec, level)
+
+
+def decode_chunk(data: bytes, codec: str, sample_filter: str) -> np.ndarray:
+    """Decompresses one chunk written by `encode_chunk`
+
+    Args:
+        data: A `bytes` object with the compressed chunk.
+        codec: A `str` with the codec name, one of `CODECS`.
+        sample_filter: A `str` with the filter name, one of `FILTERS`.
+
+    Returns:
+        An `np.ndarray` of `int16` with shape `(num_samples, 2)`.
+    """
+
+    raw = np.frombuffer(_decompress(data, codec), dtype=np.uint8)
+
+    if sample_filter in ("shuffle", "delta"):
+        raw = np.ascontiguousarray(raw.reshape(2, -1).T)
+
+    values = raw.view(np.int16).reshape(-1, 2)
+
+    if sample_filter == "delta":
+        values = np.cumsum(values, axis=0, dtype=np.int16)
+
+    return values
+
+
+class ChunkedWriter:
+    """Writes SC16 Q11 samples to a chunked, compressed capture file
+
+    It has the same interface as `iqfile.CaptureWriter`, so it can be used
+    wherever a capture writer is expected, e.g. behind an
+    `async_writer.AsyncWriter`. `write` only copies data into the current
+    chunk; full chunks are handed to the worker pool, and a writer thread
+    waits for the compressed chunks and writes them out in order. The
+    number of chunks in flight is bounded, so memory use stays fixed; if
+    compression or the disk falls behind, `write` waits for a free slot.
+
+    Attributes:
+        filename: A `str` with the path to the capture file.
+        metadata: A `dict` with the metadata written to the sidecar.
+        chunk_samples: An `int` with the number of samples per chunk.
+        bytes_written: An `int` with the number of uncompressed sample bytes
+                       written.
+        compressed_bytes: An `int` with the number of compressed bytes
+                          written, not counting the index.
+    """
+
+    def __init__(self, filename: str, metadata: Optional[dict] = None,
+                 chunk_samples: int = 1 << 18, codec: str = "zlib_huffman",
+                 level: int = 1, sample_filter: str = "shuffle",
+                 num_workers: Optional[int] = None,
+                 use_processes: bool = False):
+        """Creates the capture file, the worker pool and the writer thread
+
+        Args:
+            filename: A `str` with the path to the capture file. An existing
+                      file is overwritten.
+            metadata: An optional `dict` with capture parameters, as for
+                      `iqfile.CaptureWriter`.
+            chunk_samples: An `int` with the number of samples per chunk.
+            codec: A `str` with the codec, one of `CODECS`. The default,
+                   `zlib_huffman`, is zlib with entropy coding only, which
+                   is about twice as fast as plain `zlib` on IQ data and
+                   compresses it as well.
+            level: An `int` with the compression level. Low levels are
+                   needed to keep up with high sample rates.
+            sample_filter: A `str` with the filter applied before
+                           compression, one of `FILTERS`.
+            num_workers: An optional `int` with the size of the worker pool,
+                         by default the number of CPUs.
+            use_processes: A `bool`, if set chunks are compressed in worker
+                           processes rather than threads. All codecs release
+                           the GIL, so threads are usually sufficient.
+
+        Raises:
+            ValueError: If the codec, filter or chunk size is invalid.
+        """
+
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec: {codec}")
+        if sample_filter not in FILTERS:
+            raise ValueError(f"Unknown sample filter: {sample_filter}")
+        if chunk_samples <= 0:
+            raise ValueError("Chunk size must be positive")
+
+        self.filename = filename
+        self.chunk_samples = chunk_samples
+        self.codec = codec
+        self.level = level
+        self.sample_filter = sample_filter
+
+        self.metadata = dict(metadata) if metadata is not None else {}
+        self.metadata["format"] = iqfile.SAMPLE_FORMAT
+        self.metadata["version"] = iqfile.FORMAT_VERSION
+        self.metadata["container"] = CONTAINER
+        self.metadata["codec"] = codec
+        self.metadata["filter"] = sample_filter
+        self.metadata["chunk_samples"] = chunk_samples
+        self.metadata["created"] = datetime.datetime.now(
+            datetime.timezone.utc
+        ).isoformat()
+        self.metadata["num_samples"] = 0
+
+        self.bytes_written = 0
+        self.compressed_bytes = 0
+
+        num_workers = num_workers or os.cpu_count() or 1
+        if use_processes:
+            self._pool = concurrent.futures.ProcessPoolExecutor(num_workers)
+        else:
+            self._pool = concurrent.futures.ThreadPoolExecutor(
+                num_workers, thread_name_prefix="ChunkCompress"
+            )
+        self._pending = queue.Queue(maxsize=2 * num_workers)
+
+        self._chunk_bytes = chunk_samples * iqfile.BYTES_PER_SAMPLE
+        self._chunk = bytearray(self._chunk_bytes)
+        self._chunk_fill = 0
+        self._index = []
+
+        self._file = open(filename, "wb")
+        self._write_sidecar()
+
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(
+            target=self._drain, name="ChunkWriter", daemon=True
+        )
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def num_samples(self) -> int:
+        """Number of complete samples written so far"""
+        return self.bytes_written // iqfile.BYTES_PER_SAMPLE
+
+    @property
+    def compression_ratio(self) -> float:
+        """Ratio of raw to compressed size of the chunks written so far"""
+
+        written = sum(size for _, size, _ in self._index)
+        raw = sum(count for _, _, count in self._index)
+        return raw * iqfile.BYTES_PER_SAMPLE / written if written else 0.0
+
+    def write(self, data) -> int:
+        """Appends raw SC16 Q11 data to the capture
+
+        Args:
+            data: A bytes-like object with interleaved I and Q values.
+
+        Returns:
+            An `int` with the number of bytes accepted.
+
+        Raises:
+            RuntimeError: If compressing or writing a chunk has failed.
+        """
+
+        self._check_error()
+
+        data = memoryview(data).cast("B")
+        num_bytes = data.nbytes
+        position = 0
+
+        while position < num_bytes:
+            count = min(num_bytes - position,
+                        self._chunk_bytes - self._chunk_fill)
+            self._chunk[self._chunk_fill:self._chunk_fill + count] = (
+                data[position:position + count]
+            )
+            self._chunk_fill += count
+            position += count
+
+            if self._chunk_fill == self._chunk_bytes:
+                self._submit_chunk()
+
+        self.bytes_written += num_bytes
+
+        return num_bytes
+
+    def close(self) -> None:
+        """Compresses the last chunk, writes the index and closes the file
+
+        Raises:
+            RuntimeError: If compressing or writing a chunk has failed.
+        """
+
+        if self._file.closed:
+            return
+
+        # * Only whole samples are stored
+        self._chunk_fill -= self._chunk_fill % iqfile.BYTES_PER_SAMPLE
+        if self._chunk_fill:
+            self._submit_chunk()
+
+        self._pending.put(None)
+        self._thread.join()
+        self._pool.shutdown()
+
+        if self._error is not None:
+            self._file.close()
+            self._check_error()
+
+        index_offset = self._file.tell()
+        index = np.array(self._index, dtype=INDEX_DTYPE).reshape(-1, 3)
+        self._file.write(index.tobytes())
+        self._file.write(
+            FOOTER.pack(index_offset, len(self._index), FOOTER_MAGIC)
+        )
+        self._file.close()
+
+        self.metadata["num_samples"] = self.num_samples
+        self.metadata["num_chunks"] = len(self._index)
+        self._write_sidecar()
+
+    def _check_error(self) -> None:
+        if self._error is not None:
+            raise RuntimeError("Chunk writer thread failed") from self._error
+
+    def _submit_chunk(self) -> None:
+        chunk = bytes(memoryview(self._chunk)[:self._chunk_fill])
+        num_samples = self._chunk_fill // iqfile.BYTES_PER_SAMPLE
+        future = self._pool.submit(
+            encode_chunk, chunk, self.codec, self.level, self.sample_filter
+        )
+        # * Blocks only while the maximum number of chunks are in flight
+        self._pending.put((future, num_samples))
+        self._chunk_fill = 0
+
+    def _drain(self) -> None:
+        # Writes compressed chunks in submission order until the end marker
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+
+            future, num_samples = item
+            if self._error is not None:
+                continue
+
+            try:
+                compressed = future.result()
+                self._index.append(
+                    (self._file.tell(), len(compressed), num_samples)
+                )
+                self._file.write(compressed)
+            except BaseException as error:
+                self._error = error
+            else:
+                self.compressed_bytes += len(compressed)
+
+    def _write_sidecar(self) -> None:
+        with open(iqfile.sidecar_filename(self.filename), "w") as sidecar:
+            json.dump(self.metadata, sidecar, indent=4)
+
+
+class ChunkedReader:
+    """Random-access view of a chunked capture file
+
+    Indexing a `ChunkedReader` with a sample index or slice returns the
+    selected samples as `complex64`, like `iqfile.CaptureReader`. Only the
+    chunks overlapping the selection are read and decompressed, and the
+    most recently used chunk is cached for sequential access.
+
+    Attributes:
+        filename: A `str` with the path to the capture file.
+        metadata: A `dict` with the contents of the sidecar file.
+        index: An `np.ndarray` of `int64` with shape `(num_chunks, 3)`,
+               holding the file offset, compressed size and number of
+               samples of every chunk.
+    """
+
+    def __init__(self, filename: str):
+        """Opens a chunked capture file and reads its index
+
+        Args:
+            filename: A `str` with the path to the capture file.
+
+        Raises:
+            ValueError: If the file is not a chunked capture, or the sidecar
+                        describes an unsupported format.
+        """
+
+        self.filename = filename
+        self.metadata = iqfile.read_metadata(filename)
+        self._codec = self.metadata.get("codec", "zlib_huffman")
+        self._filter = self.metadata.get("filter", "shuffle")
+
+        self._file = open(filename, "rb")
+        self._file.seek(-FOOTER.size, os.SEEK_END)
+        index_offset, num_chunks, magic = FOOTER.unpack(
+            self._file.read(FOOTER.size)
+        )
+        if magic != FOOTER_MAGIC:
+            self._file.close()
+            raise ValueError(f"Not a chunked capture file: {filename}")
+
+        self._file.seek(index_offset)
+        self.index = np.frombuffer(
+            self._file.read(num_chunks * 3 * INDEX_DTYPE.itemsize),
+            dtype=INDEX_DTYPE
+        ).reshape(-1, 3)
+
+        # * Sample offset of the start of every chunk, and of the end
+        self._starts = np.concatenate(([0], np.cumsum(self.index[:, 2])))
+
+        self._cached_chunk = None
+        self._cached_values = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return int(self._starts[-1])
+
+    def __getitem__(self, key: Union[int, slice]) -> np.ndarray:
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            values = self.read_raw(start, max(stop - start, 0))
+            return iqfile.sc16_to_complex64(values[::step])
+
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("Sample index out of range")
+
+        return iqfile.sc16_to_complex64(self.read_raw(key, 1))[0]
+
+    @property
+    def sample_rate(self) -> Optional[float]:
+        """Sample rate of the capture, if recorded"""
+        return self.metadata.get("sample_rate")
+
+    @property
+    def freq_centre(self) -> Optional[float]:
+        """Centre frequency of the capture, if recorded"""
+        return self.metadata.get("freq_centre")
+
+    def read_raw(self, offset: int, count: int) -> np.ndarray:
+        """Reads a block of raw samples, decompressing only what is needed
+
+        Args:
+            offset: An `int` with the index of the first sample.
+            count: An `int` with the number of samples to read. Fewer are
+                   returned if the end of the file is reached.
+
+        Returns:
+            An `np.ndarray` of `int16` with shape `(count, 2)`.
+        """
+
+        end = min(offset + count, len(self))
+        if offset >= end:
+            return np.zeros((0, 2), dtype=np.int16)
+
+        first = int(np.searchsorted(self._starts, offset, side="right")) - 1
+        last = int(np.searchsorted(self._starts, end, side="left"))
+
+        parts = []
+        for chunk in range(first, last):
+            values = self._chunk(chunk)
+            chunk_start = int(self._starts[chunk])
+            parts.append(values[max(offset - chunk_start, 0):
+                                end - chunk_start])
+
+        if len(parts) == 1:
+            return parts[0]
+
+        return np.concatenate(parts)
+
+    def read(self, offset: int, count: int) -> np.ndarray:
+        """Reads a block of samples as `complex64`
+
+        Args:
+            offset: An `int` with the index of the first sample.
+            count: An `int` with the number of samples to read. Fewer are
+                   returned if the end of the file is reached.
+
+        Returns:
+            An `np.ndarray` of `complex64` with the scaled samples.
+        """
+
+        return iqfile.sc16_to_complex64(self.read_raw(offset, count))
+
+    def close(self) -> None:
+        """Closes the capture file"""
+
+        self._file.close()
+        self._cached_chunk = None
+        self._cached_values = None
+
+    def _chunk(self, chunk: int) -> np.ndarray:
+        if chunk != self._cached_chunk:
+            file_offset, size, _ = self.index[chunk]
+            self._file.seek(int(file_offset))
+            self._cached_values = decode_chunk(
+                self._file.read(int(size)), self._codec, self._filter
+            )
+            self._cached_chunk = chunk
+
+        return self._cached_values
+
+
+def open_capture(filename: str) -> Union[iqfile.CaptureReader,
+                                         ChunkedReader]:
+    """Opens a raw or chunked capture file, according to its sidecar
+
+    Args:
+        filename: A `str` with the path to the capture file.
+
+    Returns:
+        A `ChunkedReader` for chunked captures, otherwise an
+        `iqfile.CaptureReader`.
+    """
+
+    if iqfile.read_metadata(filename).get("container") == CONTAINER:
+        return ChunkedReader(filename)
+
+    return iqfile.CaptureReader(filename)
@@ -0,0 +1,625 @@
+"""Streaming signal processing stages for the Rx loop
+
+Long CW measurements do not need gigabytes of raw IQ - usually an averaged
+spectrum, or a handful of tone parameters, is all that is kept. The stages
+in this module run block by block inside the Rx loop. Every received block
+is converted once from SC16 Q11 into a reusable `complex64` buffer, and then
+handed to each stage. All working buffers are allocated up front, so memory
+use is bounded and does not depend on the length of the capture.
+"""
+
+import logging
+
+from typing import Sequence, Union
+
+import numpy as np
+
+import iqfile
+
+
+WINDOWS = {
+    "rectangular": np.ones,
+    "hann": np.hanning,
+    "hamming": np.hamming,
+    "blackman": np.blackman,
+}
+
+
+def get_window(window: Union[str, np.ndarray], size: int) -> np.ndarray:
+    """Returns a `float32` window of a given size
+
+    Args:
+        window: A `str` with the name of a window from `WINDOWS`, or an
+                `np.ndarray` with the window coefficients.
+        size: An `int` with the number of points in the window.
+
+    Returns:
+        An `np.ndarray` of `float32` with the window coefficients.
+
+    Raises:
+        ValueError: If the window name is unknown, or the coefficients do
+                    not match the requested size.
+    """
+
+    if isinstance(window, str):
+        try:
+            coefficients = WINDOWS[window](size)
+        except KeyError as error:
+            raise ValueError(f"Unknown window: {window}") from error
+    else:
+        coefficients = np.asarray(window)
+        if coefficients.shape != (size,):
+            raise ValueError("Window length does not match FFT size")
+
+    return coefficients.astype(np.float32)
+
+
+def sc16_to_complex64_into(samples: np.ndarray,
+                           out: np.ndarray) -> np.ndarray:
+    """Converts interleaved SC16 Q11 samples into an existing buffer
+
+    The conversion and scaling are a single vectorised multiply from `int16`
+    into the `float32` view of `out`, so nothing is allocated and no
+    `complex128` temporaries are created.
+
+    Args:
+        samples: An `np.ndarray` of `int16` with interleaved I and Q values.
+        out: An `np.ndarray` of `complex64` with room for at least
+             `samples.size // 2` values.
+
+    Returns:
+        A view of `out` holding the converted samples.
+
+    Raises:
+        ValueError: If `out` is too small.
+    """
+
+    num_samples = samples.size // 2
+    if out.size < num_samples:
+        raise ValueError("Output buffer is too small")
+
+    np.multiply(
+        samples[:2 * num_samples], np.float32(iqfile.SC16_SCALE),
+        out=out.view(np.float32)[:2 * num_samples], dtype=np.float32
+    )
+
+    return out[:num_samples]
+
+
+def _fft_into(frames: np.ndarray, out: np.ndarray) -> np.ndarray:
+    # NumPy >= 2.0 can write the FFT into an existing array
+    try:
+        return np.fft.fft(frames, axis=-1, out=out)
+    except TypeError:
+        out[...] = np.fft.fft(frames, axis=-1)
+        return out
+
+
+class _FramedStage:
+    """Common framing and FFT machinery of the spectral stages
+
+    Incoming samples are collected in a fixed-size staging buffer. Whenever
+    it holds at least one full FFT frame, all complete, possibly overlapping,
+    frames are windowed and transformed in one vectorised batch into
+    preallocated buffers, and handed to `_accumulate`. Blocks of any length
+    can be fed in.
+
+    Attributes:
+        fft_size: An `int` with the number of points per FFT frame.
+        hop: An `int` with the number of samples between frame starts.
+        window: An `np.ndarray` of `float32` with the window coefficients.
+        num_frames: An `int` with the number of frames processed so far.
+    """
+
+    def __init__(self, fft_size: int, window: Union[str, np.ndarray],
+                 overlap: float, batch_frames: int):
+        if fft_size <= 0 or batch_frames <= 0:
+            raise ValueError("FFT size and batch size must be positive")
+        if not 0 <= overlap < 1:
+            raise ValueError("Overlap must be in the range [0, 1)")
+
+        self.fft_size = fft_size
+        self.hop = max(1, fft_size - int(round(fft_size * overlap)))
+        self.window = get_window(window, fft_size)
+
+        capacity = fft_size + (batch_frames - 1) * self.hop
+        self._staging = np.zeros(capacity, dtype=np.complex64)
+        self._fill = 0
+
+        self._frames = np.zeros((batch_frames, fft_size), dtype=np.complex64)
+        self._spectra = np.zeros_like(self._frames)
+        self._power = np.zeros((batch_frames, fft_size), dtype=np.float32)
+
+        self.num_frames = 0
+
+    def update(self, samples: np.ndarray) -> None:
+        """Adds a block of `complex64` samples
+
+        Args:
+            samples: An `np.ndarray` of `complex64` samples. Samples which
+                     do not complete a frame are kept for the next call.
+        """
+
+        capacity = self._staging.size
+        offset = 0
+
+        while offset < samples.size:
+            count = min(capacity - self._fill, samples.size - offset)
+            self._staging[self._fill:self._fill + count] = (
+                samples[offset:offset + count]
+            )
+            self._fill += count
+            offset += count
+
+            if self._fill >= self.fft_size:
+                self._process_frames()
+
+    def _process_frames(self) -> None:
+        num_frames = (self._fill - self.fft_size) // self.hop + 1
+
+        frames = np.lib.stride_tricks.as_strided(
+            self._staging,
+            shape=(num_frames, self.fft_size),
+            strides=(self._staging.strides[0] * self.hop,
+                     self._staging.strides[0]),
+            writeable=False
+        )
+        windowed = self._frames[:num_frames]
+        np.multiply(frames, self.window, out=windowed)
+
+        spectra = _fft_into(windowed, self._spectra[:num_frames])
+        iq = spectra.view(np.float32).reshape(num_frames, self.fft_size, 2)
+        power = np.einsum("ijk,ijk->ij", iq, iq, out=self._power[:num_frames])
+
+        self._accumulate(windowed, power)
+        self.num_frames += num_frames
+
+        consumed = num_frames * self.hop
+        remaining = self._fill - consumed
+        self._staging[:remaining] = self._staging[consumed:self._fill]
+        self._fill = remaining
+
+    def _accumulate(self, windowed: np.ndarray, power: np.ndarray) -> None:
+        raise NotImplementedError
+
+    def _reset_frames(self) -> None:
+        self._fill = 0
+        self.num_frames = 0
+
+
+class StreamingPSD(_FramedStage):
+    """Running Welch-style averaged power spectrum
+
+    The power of every FFT frame is added to a running sum, so only a single
+    spectrum is kept no matter how long the capture runs.
+
+    Attributes:
+        fft_size: An `int` with the number of points per FFT frame.
+        hop: An `int` with the number of samples between frame starts.
+        num_averages: An `int` with the number of frames averaged so far.
+    """
+
+    def __init__(self, fft_size: int = 4096,
+                 window: Union[str, np.ndarray] = "hann",
+                 overlap: float = 0.5, batch_frames: int = 16):
+        """Allocates all working buffers
+
+        Args:
+            fft_size: An `int` with the number of points per FFT frame.
+            window: A `str` with the name of a window from `WINDOWS`, or an
+                    `np.ndarray` with `fft_size` window coefficients.
+            overlap: A `float` with the fraction of overlap between adjacent
+                     frames, from 0 (inclusive) to 1 (exclusive).
+            batch_frames: An `int` with the maximum number of frames to
+                          transform in a single batch.
+
+        Raises:
+            ValueError: If any of the arguments are out of range.
+        """
+
+        super().__init__(fft_size, window, overlap, batch_frames)
+        self._power_sum = np.zeros(fft_size, dtype=np.float64)
+        self._lobe = ToneEstimator.TONE_BINS.get(window, 3) if isinstance(
+            window, str) else 3
+
+    @property
+    def num_averages(self) -> int:
+        return self.num_frames
+
+    def reset(self) -> None:
+        """Discards all averaged and staged data"""
+
+        self._reset_frames()
+        self._power_sum[:] = 0
+
+    def _accumulate(self, windowed: np.ndarray, power: np.ndarray) -> None:
+        self._power_sum += power.sum(axis=0)
+
+    def partial(self) -> tuple:
+        """Returns the unnormalised state of the average
+
+        Returns:
+            A `tuple` with an `np.ndarray` of the summed power per FFT bin,
+            in FFT order, and an `int` with the number of frames summed.
+            Much smaller than the stage itself, so cheap to send between
+            processes.
+        """
+
+        return self._power_sum.copy(), self.num_frames
+
+    def merge(self, power_sum: np.ndarray, num_frames: int) -> None:
+        """Adds the state of another average of the same FFT size
+
+        Args:
+            power_sum: An `np.ndarray` with the summed power per FFT bin,
+                       as returned by `partial`.
+            num_frames: An `int` with the number of frames in `power_sum`.
+        """
+
+        self._power_sum += power_sum
+        self.num_frames += num_frames
+
+    def tone(self, sample_rate: float) -> dict:
+        """Estimates the strongest tone from the averaged spectrum
+
+        Uses the same method as `ToneEstimator`, applied once to the
+        averaged spectrum instead of to every frame.
+
+        Args:
+            sample_rate: A `float` with the sample rate, in samples/sec.
+
+        Returns:
+            A `dict` with the tone `frequency` offset from the LO, in Hz,
+            its `power_dbfs` and the `snr_db` over the full band.
+
+        Raises:
+            RuntimeError: If no complete frames have been averaged yet.
+        """
+
+        psd = self.psd()
+        peak = int(np.argmax(psd))
+        offsets = np.arange(-self._lobe, self._lobe + 1)
+        lobe = psd[(peak + offsets) % self.fft_size]
+
+        # * Gaussian interpolation of the peak from its two neighbours
+        log_lobe = np.log(np.maximum(lobe[self._lobe - 1:self._lobe + 2],
+                                     1e-30))
+        denominator = log_lobe[0] - 2 * log_lobe[1] + log_lobe[2]
+        delta = (0.5 * (log_lobe[0] - log_lobe[2]) / denominator
+                 if denominator < 0 else 0.0)
+
+        # * Back from coherent to energy normalisation, see `psd`
+        window = self.window.astype(np.float64)
+        scale = np.sum(window) ** 2 / (self.fft_size * np.sum(window ** 2))
+
+        tone = float(lobe.sum())
+        noise = max(float(psd.sum()) - tone, 1e-30)
+
+        return {
+            "frequency": ((peak - self.fft_size // 2 + delta) * sample_rate
+                          / self.fft_size),
+            "power_dbfs": float(10 * np.log10(max(tone * scale, 1e-30))),
+            "snr_db": float(10 * np.log10(max(tone / noise, 1e-30))),
+        }
+
+    def psd(self) -> np.ndarray:
+        """Returns the averaged power spectrum
+
+        Returns:
+            An `np.ndarray` of `float64` with the mean power per FFT bin,
+            normalised to the coherent gain of the window so that a
+            full-scale tone on a bin centre reads 0 dBFS. Bins are ordered
+            from the most negative to the most positive frequency.
+
+        Raises:
+            RuntimeError: If no complete frames have been averaged yet.
+        """
+
+        if self.num_averages == 0:
+            raise RuntimeError("No complete FFT frames averaged yet")
+
+        scale = self.num_averages * float(np.sum(self.window)) ** 2
+        return np.fft.fftshift(self._power_sum / scale)
+
+    def psd_db(self) -> np.ndarray:
+        """Returns the averaged power spectrum in dBFS"""
+        return 10 * np.log10(np.maximum(self.psd(), 1e-20))
+
+    def frequencies(self, sample_rate: float,
+                    freq_centre: float = 0.0) -> np.ndarray:
+        """Returns the frequency of each bin of `psd`
+
+        Args:
+            sample_rate: A `float` with the sample rate, in samples/sec.
+            freq_centre: A `float` with the centre frequency to offset the
+                         bins by, e.g. the Rx LO frequency.
+
+        Returns:
+            An `np.ndarray` of `float64` with the bin frequencies, in Hz.
+        """
+
+        bins = np.fft.fftshift(np.fft.fftfreq(self.fft_size, 1 / sample_rate))
+        return bins + freq_centre
+
+    def save(self, filename: str, sample_rate: float,
+             freq_centre: float = 0.0) -> None:
+        """Saves the averaged spectrum to a `.npz` file
+
+        Args:
+            filename: A `str` with the path to the output file.
+            sample_rate: A `float` with the sample rate, in samples/sec.
+            freq_centre: A `float` with the Rx LO frequency, in Hz.
+        """
+
+        np.savez(
+            filename,
+            frequencies=self.frequencies(sample_rate, freq_centre),
+            psd_db=self.psd_db(),
+            num_averages=self.num_averages,
+            fft_size=self.fft_size,
+        )
+
+    def log_summary(self, logger: logging.Logger) -> None:
+        """Writes a summary of the averaged spectrum to the log"""
+
+        if self.num_averages == 0:
+            logger.warning("PSD: no complete FFT frames averaged")
+            return
+
+        psd_db = self.psd_db()
+        peak_bin = int(np.argmax(psd_db))
+        logger.info(
+            f"PSD: {self.num_averages} frames of {self.fft_size} points, "
+            f"peak {psd_db[peak_bin]:.2f} dBFS in bin "
+            f"{peak_bin - self.fft_size // 2}"
+        )
+
+
+class ToneEstimator(_FramedStage):
+    """Streaming estimator of the frequency, power and SNR of a CW tone
+
+    Each FFT frame gives one set of estimates, computed for a whole batch of
+    frames at once. The tone frequency comes from the peak bin, refined by
+    Gaussian interpolation between its neighbours. The tone power is the sum
+    of the bins in the window main lobe around the peak, which by Parseval's
+    theorem is free of scalloping loss, and everything outside these bins
+    is counted as noise. Optionally, the power at a set of expected tone
+    frequencies is also measured with Goertzel-style single-bin DFTs.
+
+    All estimates are smoothed with an exponential moving average, and a
+    row of averaged results is kept every `record_interval` seconds, so a
+    long measurement run produces kilobytes of results instead of
+    gigabytes of IQ.
+
+    Attributes:
+        sample_rate: A `float` with the sample rate, in samples/sec.
+        alpha: A `float` with the smoothing factor of the moving average.
+        tone_freqs: An `np.ndarray` with the expected tone offsets, in Hz,
+                    measured with single-bin DFTs.
+        frequency: A `float` with the averaged tone offset, in Hz.
+        power: A `float` with the averaged linear tone power, relative to
+               full scale.
+        snr: A `float` with the averaged linear SNR over the full band.
+        goertzel_power: An `np.ndarray` with the averaged linear power at
+                        each of `tone_freqs`.
+        results: A `list` of recorded rows, see `RESULT_COLUMNS`.
+    """
+
+    RESULT_COLUMNS = ("time", "frequency", "power_dbfs", "snr_db")
+
+    # * Half-widths, in bins, of the main lobe plus the first side lobe of
+    # * the named windows, so that off-bin tones do not leak into the noise
+    TONE_BINS = {
+        "rectangular": 2,
+        "hann": 3,
+        "hamming": 3,
+        "blackman": 4,
+    }
+
+    def __init__(self, sample_rate: float, fft_size: int = 4096,
+                 window: Union[str, np.ndarray] = "hann",
+                 alpha: float = 0.1, tone_freqs: Sequence[float] = (),
+                 record_interval: float = 0.1, batch_frames: int = 16):
+        """Allocates all working buffers
+
+        Args:
+            sample_rate: A `float` with the sample rate, in samples/sec.
+            fft_size: An `int` with the number of points per FFT frame.
+            window: A `str` with the name of a window from `WINDOWS`, or an
+                    `np.ndarray` with `fft_size` window coefficients, in
+                    which case the tone is assumed to occupy three bins
+                    either side of the peak.
+            alpha: A `float` with the smoothing factor of the exponential
+                   moving average, between 0 (exclusive) and 1 (inclusive).
+            tone_freqs: A sequence of `float` with expected tone offsets from
+                        the LO, in Hz, to measure with single-bin DFTs.
+            record_interval: A `float` with the time between recorded rows
+                             of results, in seconds of received signal.
+            batch_frames: An `int` with the maximum number of frames to
+                          transform in a single batch.
+
+        Raises:
+            ValueError: If any of the arguments are out of range.
+        """
+
+        if not 0 < alpha <= 1:
+            raise ValueError("Smoothing factor must be in the range (0, 1]")
+
+        super().__init__(fft_size, window, 0.0, batch_frames)
+
+        self.sample_rate = sample_rate
+        self.alpha = alpha
+        self.record_interval = record_interval
+
+        lobe = self.TONE_BINS.get(window, 3) if isinstance(
+            window, str) else 3
+        self._lobe_offsets = np.arange(-lobe, lobe + 1)
+        self._energy_norm = fft_size * float(
+            np.sum(self.window.astype(np.float64) ** 2)
+        )
+
+        # * Smoothing weights of the newest to oldest frame in a batch
+        self._decay = (1 - alpha) ** np.arange(batch_frames + 1)
+
+        self.tone_freqs = np.asarray(tone_freqs, dtype=np.float64)
+        phase = np.outer(np.arange(fft_size), self.tone_freqs) / sample_rate
+        self._dft_basis = np.exp(-2j * np.pi * phase).astype(np.complex64)
+        self._coherent_norm = float(np.sum(self.window)) ** 2
+
+        self.frequency = None
+        self.power = None
+        self.snr = None
+        self.goertzel_power = None
+
+        self.results = []
+        self._next_record = 0.0
+
+    def reset(self) -> None:
+        """Discards all estimates, results and staged data"""
+
+        self._reset_frames()
+        self.frequency = self.power = self.snr = None
+        self.goertzel_power = None
+        self.results = []
+        self._next_record = 0.0
+
+    def _smooth(self, average, values: np.ndarray):
+        # Exponential moving average over the frames of a batch, newest last
+        num_frames = values.shape[0]
+        if average is None:
+            average = values[0]
+
+        weights = self.alpha * self._decay[num_frames - 1::-1]
+        if values.ndim > 1:
+            weights = weights[:, None]
+
+        return self._decay[num_frames] * average + np.sum(
+            weights * values, axis=0
+        )
+
+    def _accumulate(self, windowed: np.ndarray, power: np.ndarray) -> None:
+        num_frames, fft_size = power.shape
+        rows = np.arange(num_frames)[:, None]
+
+        peak = np.argmax(power, axis=1)
+        lobe = power[rows, (peak[:, None] + self._lobe_offsets) % fft_size]
+        centre = self._lobe_offsets.size // 2
+
+        # * Gaussian interpolation of the peak from its two neighbours
+        log_lobe = np.log(np.maximum(lobe[:, centre - 1:centre + 2], 1e-30))
+        denominator = log_lobe[:, 0] - 2 * log_lobe[:, 1] + log_lobe[:, 2]
+        delta = np.divide(
+            0.5 * (log_lobe[:, 0] - log_lobe[:, 2]), denominator,
+            out=np.zeros(num_frames), where=denominator < 0
+        )
+
+        peak_bin = peak + delta
+        peak_bin = np.where(peak_bin >= fft_size / 2, peak_bin - fft_size,
+                            peak_bin)
+        frequency = peak_bin * self.sample_rate / fft_size
+
+        tone = lobe.sum(axis=1, dtype=np.float64)
+        noise = np.maximum(power.sum(axis=1, dtype=np.float64) - tone, 1e-30)
+
+        self.frequency = self._smooth(self.frequency, frequency)
+        self.power = self._smooth(self.power, tone / self._energy_norm)
+        self.snr = self._smooth(self.snr, tone / noise)
+
+        if self.tone_freqs.size:
+            bins = windowed @ self._dft_basis
+            bin_power = (bins.real ** 2 + bins.imag ** 2) / self._coherent_norm
+            self.goertzel_power = self._smooth(self.goertzel_power, bin_power)
+
+        elapsed = (self.num_frames + num_frames) * self.hop / self.sample_rate
+        if elapsed >= self._next_record:
+            self.results.append((
+                elapsed, float(self.frequency), self.power_dbfs, self.snr_db
+            ))
+            self._next_record = elapsed + self.record_interval
+
+    @property
+    def power_dbfs(self) -> float:
+        """Averaged tone power, in dBFS"""
+        return float(10 * np.log10(max(float(self.power), 1e-30)))
+
+    @property
+    def snr_db(self) -> float:
+        """Averaged SNR over the full band, in dB"""
+        return float(10 * np.log10(max(float(self.snr), 1e-30)))
+
+    def save(self, filename: str) -> None:
+        """Saves the recorded rows of results to a CSV file
+
+        Args:
+            filename: A `str` with the path to the output file.
+        """
+
+        np.savetxt(
+            filename, np.array(self.results).reshape(-1, 4), delimiter=",",
+            header=",".join(self.RESULT_COLUMNS), comments=""
+        )
+
+    def log_summary(self, logger: logging.Logger) -> None:
+        """Writes the current estimates to the log"""
+
+        if self.frequency is None:
+            logger.warning("Tone: no complete FFT frames processed")
+            return
+
+        logger.info(
+            f"Tone: {self.num_frames} frames, offset "
+            f"{float(self.frequency):.3f} Hz, power {self.power_dbfs:.2f} "
+            f"dBFS, SNR {self.snr_db:.2f} dB"
+        )
+
+        if self.goertzel_power is not None:
+            for freq, power in zip(self.tone_freqs, self.goertzel_power):
+                logger.info(
+                    f"Tone: power at {freq:.3f} Hz offset "
+                    f"{10 * np.log10(max(float(power), 1e-30)):.2f} dBFS"
+                )
+
+
+class StreamProcessor:
+    """Feeds received SC16 Q11 blocks through a list of analysis stages
+
+    Each block is converted once into a reusable `complex64` buffer, which
+    is then passed to the `update` method of every stage in turn.
+
+    Attributes:
+        stages: A sequence of stage objects, such as `StreamingPSD`.
+    """
+
+    def __init__(self, max_block_samples: int, stages: Sequence):
+        """Allocates the conversion buffer
+
+        Args:
+            max_block_samples: An `int` with the largest number of samples
+                               that will be passed to `process` at once.
+            stages: A sequence of objects with an `update` method taking an
+                    `np.ndarray` of `complex64` samples.
+        """
+
+        self.stages = list(stages)
+        self._converted = np.zeros(max_block_samples, dtype=np.complex64)
+
+    def process(self, buffer, num_samples: int) -> None:
+        """Converts a received block and runs every stage over it
+
+        Args:
+            buffer: A bytes-like object with interleaved SC16 Q11 values, as
+                    filled by `sync_rx`.
+            num_samples: An `int` with the number of valid samples.
+        """
+
+        samples = np.frombuffer(buffer, dtype=np.int16, count=2 * num_samples)
+        converted = sc16_to_complex64_into(samples, self._converted)
+
+        for stage in self.stages:
+            stage.update(converted)
+
+    def log_summary(self, logger: logging.Logger) -> None:
+        """Writes the summary of every stage to the log"""
+
+        for stage in self.stages:
+            stage.log_summary(logger)
@@ -10,8 +10,6 @@ import datetime
 import logging
 import time
 
-import ntplib
-
 
 def setup_logger(filename_base: str, timestamp: str) -> logging.Logger:
     """Sets up a `Logger` object for diagnostic and debug
@@ -89,6 +87,10 @@ def log_ntp_time(logger: logging.Logger,
         Nothing
     """
 
+    # * Only the scripts sync to NTP, so modules importing these helpers
+    # * do not depend on ntplib
+    import ntplib
+
     ntp_client = ntplib.NTPClient()
     ntp_connected = False
     ntp_retries = 3
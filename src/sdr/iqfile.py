@@ -0,0 +1,336 @@
+"""Self-describing IQ capture files
+
+Captures are stored as raw interleaved SC16 Q11 values, exactly as they come
+out of `sync_rx`, so they stay readable by GNU Radio's `file_source` and by
+anything else that expects a plain `.iqbin` file. Everything needed to make
+sense of the samples - sample rate, centre frequency, gain, channel and so
+on - goes into a JSON sidecar file next to the samples.
+
+Reading is done through `np.memmap`, so opening a multi-GB capture is
+instant and only the slices which are actually accessed are paged in and
+converted to `complex64`.
+"""
+
+import datetime
+import json
+import os
+
+from typing import Optional, Union
+
+import numpy as np
+
+
+SAMPLE_FORMAT = "SC16_Q11"
+SC16_SCALE = 1.0 / 2048.0
+BYTES_PER_SAMPLE = 4
+FORMAT_VERSION = 1
+
+
+def sidecar_filename(filename: str) -> str:
+    """Returns the name of the JSON sidecar file for a capture file
+
+    Args:
+        filename: A `str` with the path to the capture file.
+
+    Returns:
+        A `str` with the path of the sidecar, which is the capture file name
+        with its extension replaced by `.json`.
+    """
+
+    return os.path.splitext(filename)[0] + ".json"
+
+
+def channel_filename(filename: str, channel: int) -> str:
+    """Returns the name of the capture file for one channel of a MIMO capture
+
+    Args:
+        filename: A `str` with the path given for the whole capture.
+        channel: An `int` with the Rx channel index.
+
+    Returns:
+        A `str` with `_ch<channel>` inserted before the extension, e.g.
+        `test_ch1.iqbin` for `test.iqbin`.
+    """
+
+    root, extension = os.path.splitext(filename)
+    return f"{root}_ch{channel}{extension}"
+
+
+def read_metadata(filename: str) -> dict:
+    """Reads the metadata stored alongside a capture file
+
+    Args:
+        filename: A `str` with the path to the capture file.
+
+    Returns:
+        A `dict` with the contents of the sidecar file. If there is no
+        sidecar, for example for captures made before it was introduced, an
+        empty `dict` is returned.
+
+    Raises:
+        ValueError: If the sidecar describes an unsupported sample format.
+    """
+
+    try:
+        with open(sidecar_filename(filename), "r") as sidecar:
+            metadata = json.load(sidecar)
+    except FileNotFoundError:
+        return {}
+
+    sample_format = metadata.get("format", SAMPLE_FORMAT)
+    if sample_format != SAMPLE_FORMAT:
+        raise ValueError(f"Unsupported sample format: {sample_format}")
+
+    return metadata
+
+
+def sc16_to_complex64(samples: np.ndarray) -> np.ndarray:
+    """Converts interleaved SC16 Q11 samples to scaled complex values
+
+    Args:
+        samples: An `np.ndarray` of `int16` with interleaved I and Q values,
+                 either flat or with I and Q along the last axis.
+
+    Returns:
+        A flat `np.ndarray` of `complex64` scaled to the range -1 to 1. The I
+        and Q values are converted into a single `float32` array which is
+        then viewed as complex, so no `complex128` temporaries are created.
+    """
+
+    result = np.array(samples, dtype=np.float32, order="C")
+    result *= SC16_SCALE
+
+    return result.reshape(-1).view(np.complex64)
+
+
+def deinterleave(samples: np.ndarray, num_channels: int) -> list:
+    """Splits a multi-channel SC16 Q11 stream into per-channel views
+
+    In MIMO layouts the device interleaves one sample of every channel in
+    turn, i.e. `I0 Q0 I1 Q1 I0 Q0 ...` for two channels.
+
+    Args:
+        samples: An `np.ndarray` of `int16` with the interleaved values of
+                 all channels, either flat or with I and Q along the last
+                 axis.
+        num_channels: An `int` with the number of channels in the stream.
+
+    Returns:
+        A `list` of `num_channels` strided `np.ndarray` views of `int16`,
+        each with shape `(num_samples, 2)`. No data is copied.
+    """
+
+    frames = samples.reshape(-1, num_channels, 2)
+    return [frames[:, channel, :] for channel in range(num_channels)]
+
+
+class CaptureWriter:
+    """Writes SC16 Q11 samples to a capture file with a metadata sidecar
+
+    The sidecar is written when the file is opened, so that even a capture
+    which is cut short is described, and updated with the final sample count
+    when it is closed. Objects of this class can be used wherever a binary
+    file object is expected, e.g. with `async_writer.AsyncWriter`.
+
+    Attributes:
+        filename: A `str` with the path to the capture file.
+        metadata: A `dict` with the metadata written to the sidecar.
+        bytes_written: An `int` with the number of sample bytes written.
+    """
+
+    def __init__(self, filename: str, metadata: Optional[dict] = None):
+        """Creates the capture file and its sidecar
+
+        Args:
+            filename: A `str` with the path to the capture file. An existing
+                      file is overwritten.
+            metadata: An optional `dict` with capture parameters such as
+                      `sample_rate`, `freq_centre`, `rx_gain` and `rx_ch`.
+                      Values must be JSON-serialisable.
+        """
+
+        self.filename = filename
+        self.metadata = dict(metadata) if metadata is not None else {}
+        self.metadata["format"] = SAMPLE_FORMAT
+        self.metadata["version"] = FORMAT_VERSION
+        self.metadata["created"] = datetime.datetime.now(
+            datetime.timezone.utc
+        ).isoformat()
+        self.metadata["num_samples"] = 0
+
+        self.bytes_written = 0
+
+        self._file = open(filename, "wb")
+        self._write_sidecar()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def num_samples(self) -> int:
+        """Number of complete samples written so far"""
+        return self.bytes_written // BYTES_PER_SAMPLE
+
+    def write(self, data) -> int:
+        """Appends raw SC16 Q11 data to the capture file
+
+        Args:
+            data: A bytes-like object with interleaved I and Q values.
+
+        Returns:
+            An `int` with the number of bytes written.
+        """
+
+        num_bytes = memoryview(data).nbytes
+        self._file.write(data)
+        self.bytes_written += num_bytes
+
+        return num_bytes
+
+    def close(self) -> None:
+        """Closes the capture file and records the final sample count"""
+
+        if self._file.closed:
+            return
+
+        self._file.close()
+        self.metadata["num_samples"] = self.num_samples
+        self._write_sidecar()
+
+    def _write_sidecar(self) -> None:
+        with open(sidecar_filename(self.filename), "w") as sidecar:
+            json.dump(self.metadata, sidecar, indent=4)
+
+
+class CaptureReader:
+    """Memory-mapped, random-access view of a capture file
+
+    Indexing a `CaptureReader` with a sample index returns that sample as a
+    `complex64` scalar, and with a slice the selected samples as an array
+    of `complex64`. Only the selected samples are read from disk and
+    converted.
+
+    Attributes:
+        filename: A `str` with the path to the capture file.
+        metadata: A `dict` with the contents of the sidecar file.
+        samples: An `np.memmap` of `int16` with shape `(num_samples, 2)`,
+                 holding the raw I and Q values. For a MIMO capture stored
+                 in one file these are the samples of all channels,
+                 interleaved, see `channel`.
+    """
+
+    def __init__(self, filename: str):
+        """Opens a capture file and its sidecar
+
+        Args:
+            filename: A `str` with the path to the capture file.
+
+        Raises:
+            ValueError: If the sidecar describes an unsupported format.
+        """
+
+        self.filename = filename
+        self.metadata = read_metadata(filename)
+
+        num_samples = os.path.getsize(filename) // BYTES_PER_SAMPLE
+        if num_samples > 0:
+            self.samples = np.memmap(
+                filename, dtype=np.int16, mode="r", shape=(num_samples, 2)
+            )
+        else:
+            self.samples = np.zeros((0, 2), dtype=np.int16)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.samples.shape[0]
+
+    def __getitem__(self, key: Union[int, slice]) -> np.ndarray:
+        if isinstance(key, slice):
+            return sc16_to_complex64(self.samples[key])
+
+        # * A single sample, as a scalar like `chunkfile.ChunkedReader`
+        return sc16_to_complex64(self.samples[key])[0]
+
+    @property
+    def num_channels(self) -> int:
+        """Number of channels interleaved in the capture file"""
+        return self.metadata.get("num_channels", 1)
+
+    @property
+    def sample_rate(self) -> Optional[float]:
+        """Sample rate of the capture, if recorded"""
+        return self.metadata.get("sample_rate")
+
+    @property
+    def freq_centre(self) -> Optional[float]:
+        """Centre frequency of the capture, if recorded"""
+        return self.metadata.get("freq_centre")
+
+    def read_raw(self, offset: int, count: int) -> np.ndarray:
+        """Returns a block of raw samples, without converting them
+
+        Args:
+            offset: An `int` with the index of the first sample.
+            count: An `int` with the number of samples to read. Fewer are
+                   returned if the end of the file is reached.
+
+        Returns:
+            A slice of `samples`, of `int16` with shape `(count, 2)`.
+        """
+
+        return self.samples[offset:offset + count]
+
+    def read(self, offset: int, count: int) -> np.ndarray:
+        """Reads a block of samples as `complex64`
+
+        Args:
+            offset: An `int` with the index of the first sample.
+            count: An `int` with the number of samples to read. Fewer are
+                   returned if the end of the file is reached.
+
+        Returns:
+            An `np.ndarray` of `complex64` with the scaled samples.
+        """
+
+        return self[offset:offset + count]
+
+    def channel(self, index: int) -> np.ndarray:
+        """Returns the raw samples of one channel of a MIMO capture
+
+        Args:
+            index: An `int` with the position of the channel in the file,
+                   from zero to `num_channels - 1`.
+
+        Returns:
+            A strided view of `samples`, of `int16` with shape
+            `(num_samples, 2)`, which is only paged in when accessed. Pass
+            slices of it to `sc16_to_complex64` to convert them.
+
+        Raises:
+            IndexError: If `index` is out of range.
+        """
+
+        if not 0 <= index < self.num_channels:
+            raise IndexError(f"Channel {index} not in capture")
+
+        num_frames = len(self) // self.num_channels
+        samples = self.samples[:num_frames * self.num_channels]
+
+        return deinterleave(samples, self.num_channels)[index]
+
+    def close(self) -> None:
+        """Releases the memory map
+
+        The underlying file is unmapped once no other references to slices
+        of `samples` remain.
+        """
+
+        self.samples = np.zeros((0, 2), dtype=np.int16)
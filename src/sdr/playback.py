@@ -0,0 +1,171 @@
+"""Index of a multi-file capture campaign, for seeking during playback
+
+A long measurement campaign is usually recorded as many capture files, one
+after the other. `PlaybackIndex` lists them as consecutive segments of a
+single recording and maps any playback time to a segment and a sample
+offset in it, and back, without reading any samples. Only the file sizes
+and sidecars are looked at, so indexing hours of captures is instant.
+
+The playback time counts samples played, segment after segment. The wall
+clock time of a position is taken from the creation time in the sidecar of
+its segment, or from the file modification time for captures without one.
+"""
+
+import bisect
+import datetime
+import os
+
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import chunkfile
+import iqfile
+
+
+class PlaybackIndex:
+    """Segments of a multi-file recording, in playback order
+
+    Attributes:
+        segments: A `list` of `dict`, one per capture file, with its
+                  `filename`, `num_samples`, `sample_rate`, the `offset` of
+                  its first sample and `start_time` of its first sample in
+                  playback time, in seconds, its `duration` in seconds, and
+                  the wall clock `timestamp` of its first sample, in POSIX
+                  seconds.
+        num_samples: An `int` with the number of samples in all segments.
+        duration: A `float` with the playback time of all segments, in
+                  seconds.
+    """
+
+    def __init__(self, filenames: Sequence[str],
+                 sample_rate: Optional[float] = None):
+        """Builds the index from the file sizes and sidecars
+
+        Args:
+            filenames: A sequence of `str` with the paths to the capture
+                       files, in playback order.
+            sample_rate: An optional `float` with the sample rate of
+                         captures whose sidecar does not record one.
+
+        Raises:
+            ValueError: If there are no samples, a capture is compressed,
+                        so it cannot be read at an arbitrary offset, or its
+                        sample rate is unknown.
+        """
+
+        if not filenames:
+            raise ValueError("Playback needs at least one capture file")
+
+        self.segments: List[dict] = []
+        offset = 0
+        start_time = 0.0
+
+        for filename in filenames:
+            metadata = iqfile.read_metadata(filename)
+            if metadata.get("container") == chunkfile.CONTAINER:
+                raise ValueError(
+                    f"Compressed capture cannot be played back: {filename}"
+                )
+
+            segment_rate = metadata.get("sample_rate", sample_rate)
+            if not segment_rate:
+                raise ValueError(f"Unknown sample rate for {filename}")
+
+            num_samples = os.path.getsize(filename) // iqfile.BYTES_PER_SAMPLE
+            if "created" in metadata:
+                timestamp = datetime.datetime.fromisoformat(
+                    metadata["created"]
+                ).timestamp()
+            else:
+                timestamp = os.path.getmtime(filename)
+
+            self.segments.append({
+                "filename": filename,
+                "num_samples": num_samples,
+                "sample_rate": segment_rate,
+                "offset": offset,
+                "start_time": start_time,
+                "duration": num_samples / segment_rate,
+                "timestamp": timestamp,
+            })
+
+            offset += num_samples
+            start_time += num_samples / segment_rate
+
+        if offset == 0:
+            raise ValueError("Capture files hold no samples")
+
+        self.num_samples = offset
+        self.duration = start_time
+        self._start_times = [segment["start_time"]
+                             for segment in self.segments]
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    def locate(self, seconds: float) -> Tuple[int, int]:
+        """Finds the sample at a playback time
+
+        Args:
+            seconds: A `float` with the playback time, clipped to the
+                     recording.
+
+        Returns:
+            A `tuple` of `int`, the index of the segment and the offset of
+            the sample in it.
+        """
+
+        seconds = min(max(seconds, 0.0), self.duration)
+        index = max(bisect.bisect_right(self._start_times, seconds) - 1, 0)
+        segment = self.segments[index]
+
+        # * The margin absorbs rounding, so `locate` inverts `time_of`
+        offset = int((seconds - segment["start_time"])
+                     * segment["sample_rate"] + 1e-6)
+        if offset >= segment["num_samples"] and index + 1 < len(self):
+            return index + 1, 0
+
+        return index, min(offset, max(segment["num_samples"] - 1, 0))
+
+    def time_of(self, index: int, offset: int) -> float:
+        """Returns the playback time of a sample, in seconds
+
+        Args:
+            index: An `int` with the index of the segment.
+            offset: An `int` with the offset of the sample in the segment.
+        """
+
+        segment = self.segments[index]
+        return segment["start_time"] + offset / segment["sample_rate"]
+
+    def timestamp_of(self, index: int, offset: int) -> float:
+        """Returns the wall clock time a sample was recorded, POSIX seconds
+
+        Args:
+            index: An `int` with the index of the segment.
+            offset: An `int` with the offset of the sample in the segment.
+        """
+
+        segment = self.segments[index]
+        return segment["timestamp"] + offset / segment["sample_rate"]
+
+    def open_segment(self, index: int) -> np.ndarray:
+        """Memory maps the samples of a segment
+
+        Args:
+            index: An `int` with the index of the segment.
+
+        Returns:
+            An `np.ndarray` of `int16` with shape `(num_samples, 2)`,
+            backed by the file.
+        """
+
+        segment = self.segments[index]
+        if segment["num_samples"] == 0:
+            return np.zeros((0, 2), dtype=np.int16)
+
+        return np.memmap(
+            segment["filename"], dtype=np.int16, mode="r",
+            shape=(segment["num_samples"], 2)
+        )
@@ -0,0 +1,486 @@
+"""Software simulation of a bladeRF 2.0 micro xA4
+
+A stand-in for `_bladerf.BladeRF` which implements the subset of its
+interface used by `bladerf_rx_cw` and `bladerf_tx_cw`: `Channel`,
+`sync_config`, `sync_rx` and `sync_tx`. It can be passed to
+`bladerf_cw_tone_rx` and `bladerf_cw_tone_tx` in place of a real device,
+which allows the host side of the pipeline to be tested and benchmarked
+on machines without any hardware attached.
+
+Received samples are either a synthetic CW tone, white noise, or the
+contents of an existing capture file, replayed in a loop. They are
+generated once into a cyclic SC16 Q11 buffer when streaming starts, so
+`sync_rx` itself is little more than a copy. The device either runs in
+real time, throttled to the configured sample rate, or as fast as the host
+can consume samples.
+
+In real time mode the device buffering set by `sync_config` is modelled
+as well. If the host falls behind by more than `num_buffers` buffers of Rx
+samples, the excess is dropped and counted as an overrun; if the Tx
+buffers drain completely, an underrun is counted.
+
+The module also provides stand-ins for the few libbladeRF constants the Rx
+and Tx code uses with a device, returned by `bladerf_constants` for
+simulated devices, so that the whole pipeline runs on machines without
+libbladeRF installed.
+"""
+
+import argparse
+import enum
+import logging
+import sys
+import time
+import types
+
+from typing import Optional
+
+import numpy as np
+
+import iqfile
+
+
+SIGNALS = ("cw", "noise", "file")
+
+
+def CHANNEL_RX(channel: int) -> int:
+    """Returns the index of an Rx channel, as `_bladerf.CHANNEL_RX`"""
+    return channel << 1
+
+
+def CHANNEL_TX(channel: int) -> int:
+    """Returns the index of a Tx channel, as `_bladerf.CHANNEL_TX`"""
+    return (channel << 1) | 0x1
+
+
+class ChannelLayout(enum.IntEnum):
+    """Stand-in for `_bladerf.ChannelLayout`, with the libbladeRF values"""
+
+    RX_X1 = 0
+    TX_X1 = 1
+    RX_X2 = 2
+    TX_X2 = 3
+
+
+class Format(enum.IntEnum):
+    """Stand-in for `_bladerf.Format`, with the libbladeRF values"""
+
+    SC16_Q11 = 0
+    SC16_Q11_META = 1
+    PACKET_META = 2
+    SC8_Q7 = 3
+    SC8_Q7_META = 4
+
+
+class GainMode(enum.IntEnum):
+    """Stand-in for `_bladerf.GainMode`, with the libbladeRF values"""
+
+    Default = 0
+    Manual = 1
+    FastAttack_AGC = 2
+    SlowAttack_AGC = 3
+    Hybrid_AGC = 4
+
+
+class SimulatedChannel:
+    """Plain attribute holder mimicking a `_bladerf.BladeRF.Channel`"""
+
+    def __init__(self, channel: int):
+        self.channel = channel
+        self.frequency = 1e9
+        self.sample_rate = 1e6
+        self.bandwidth = 1e6
+        self.gain = 0
+        self.gain_mode = None
+        self.enable = False
+
+    @property
+    def is_tx(self) -> bool:
+        """Whether this is a Tx channel"""
+        return bool(self.channel & 0x1)
+
+
+class SimulatedBladeRF:
+    """Simulated bladeRF device
+
+    Attributes:
+        signal: A `str` with the type of signal received, one of `SIGNALS`.
+        realtime: A `bool`, if set `sync_rx` and `sync_tx` block so that
+                  samples are streamed at the configured sample rate.
+        samples_rx: An `int` with the number of samples received so far.
+        timestamp: An `int` with the Rx timestamp counter, in samples,
+                   including any dropped in overruns.
+        samples_tx: An `int` with the number of samples transmitted so far.
+        overruns: An `int` with the number of Rx overruns, real time only.
+        underruns: An `int` with the number of Tx underruns, real time only.
+        stream_config: A `dict` with the arguments of the last call to
+                       `sync_config`.
+        bladerf_api: The module with the stand-in libbladeRF constants to
+                     use with this device, see `bladerf_constants`.
+    """
+
+    def __init__(self, signal: str = "cw", freq_tone: float = 1e5,
+                 amplitude: float = 0.5, noise_level: float = 0.01,
+                 realtime: bool = False, replay_file: Optional[str] = None,
+                 cycle_length: int = 1 << 20, seed: Optional[int] = None):
+        """Sets up the simulated device
+
+        Args:
+            signal: A `str` with the type of signal to receive: `cw` for a
+                    tone at `freq_tone` offset from the LO, `noise` for white
+                    Gaussian noise only, or `file` to replay `replay_file`.
+            freq_tone: A `float` with the offset of the CW tone from the Rx
+                       LO, in Hz. It is rounded so that the tone is phase
+                       continuous across the cyclic buffer.
+            amplitude: A `float` with the tone amplitude, relative to full
+                       scale.
+            noise_level: A `float` with the RMS of the added noise, relative
+                         to full scale.
+            realtime: A `bool`, if set streaming is throttled to the sample
+                      rate of the enabled channel.
+            replay_file: A `str` with the path to a capture file, required
+                         if `signal` is `file`.
+            cycle_length: An `int` with the number of samples generated for
+                          the cyclic Rx buffer.
+            seed: An optional `int` to seed the noise generator with.
+
+        Raises:
+            ValueError: If `signal` is unknown, or `file` is requested
+                        without a `replay_file`.
+        """
+
+        if signal not in SIGNALS:
+            raise ValueError(f"Unknown simulated signal: {signal}")
+        if signal == "file" and replay_file is None:
+            raise ValueError("File replay needs a replay file")
+
+        self.signal = signal
+        self.freq_tone = freq_tone
+        self.amplitude = amplitude
+        self.noise_level = noise_level
+        self.realtime = realtime
+        self.replay_file = replay_file
+        self.cycle_length = cycle_length
+
+        self._rng = np.random.default_rng(seed)
+        self._channels = {}
+        self._cycle = None
+        self._cycle_rate = None
+        self._cycle_pos = 0
+
+        self.samples_rx = 0
+        self.timestamp = 0
+        self.samples_tx = 0
+        self.overruns = 0
+        self.underruns = 0
+        self.stream_config = {}
+        # * Also right when this file is run as a script
+        self.bladerf_api = sys.modules[__name__]
+        self._reset_timing()
+
+    def __str__(self) -> str:
+        return f"Simulated bladeRF ({self.signal})"
+
+    def get_fw_version(self) -> str:
+        return "simulated"
+
+    def get_fpga_version(self) -> str:
+        return "simulated"
+
+    def Channel(self, channel: int) -> SimulatedChannel:
+        """Returns the simulated channel with a given index
+
+        Args:
+            channel: An `int` with the channel as returned by
+                     `_bladerf.CHANNEL_RX` or `_bladerf.CHANNEL_TX`.
+        """
+
+        channel = int(channel)
+        if channel not in self._channels:
+            self._channels[channel] = SimulatedChannel(channel)
+
+        return self._channels[channel]
+
+    def sync_config(self, layout, fmt, num_buffers: int, buffer_size: int,
+                    num_transfers: int, stream_timeout: int) -> None:
+        """Records the stream configuration and resets the stream"""
+
+        self.stream_config = {
+            "layout": layout,
+            "fmt": fmt,
+            "num_buffers": num_buffers,
+            "buffer_size": buffer_size,
+            "num_transfers": num_transfers,
+            "stream_timeout": stream_timeout,
+        }
+        self._cycle_pos = 0
+        self._reset_timing()
+
+    def new_metadata(self) -> types.SimpleNamespace:
+        """Returns a stand-in for a `struct bladerf_metadata`"""
+
+        return types.SimpleNamespace(
+            timestamp=0, flags=0, status=0, actual_count=0
+        )
+
+    def sync_rx(self, buf, num: int, meta=None) -> None:
+        """Fills `buf` with `num` simulated SC16 Q11 samples
+
+        Args:
+            buf: A writable bytes-like object with room for `num` samples.
+            num: An `int` with the number of samples to receive.
+            meta: An optional object from `new_metadata`, which is filled in
+                  with the timestamp of the first sample, the sample count
+                  and, if samples were dropped before it, an overrun status.
+        """
+
+        # * Regenerated only if the Rx sample rate has changed
+        sample_rate = self._sample_rate(is_tx=False)
+        if self._cycle is None or self._cycle_rate != sample_rate:
+            self._cycle = self._generate_cycle()
+            self._cycle_rate = sample_rate
+            self._cycle_pos = 0
+
+        out = np.frombuffer(buf, dtype=np.int16, count=2 * num)
+        cycle = self._cycle
+        cycle_samples = cycle.size // 2
+
+        dropped = self._rx_overrun() if self.realtime else 0
+        self._cycle_pos = (self._cycle_pos + dropped) % cycle_samples
+        self.timestamp += dropped
+
+        if meta is not None:
+            meta.timestamp = self.timestamp
+            meta.actual_count = num
+            # * BLADERF_META_STATUS_OVERRUN
+            meta.status = 1 if dropped else 0
+
+        filled = 0
+        while filled < num:
+            count = min(num - filled, cycle_samples - self._cycle_pos)
+            out[2 * filled:2 * (filled + count)] = (
+                cycle[2 * self._cycle_pos:2 * (self._cycle_pos + count)]
+            )
+            filled += count
+            self._cycle_pos = (self._cycle_pos + count) % cycle_samples
+
+        self.samples_rx += num
+        self.timestamp += num
+
+        if self.realtime:
+            self._rx_pos += num
+            self._wait_until(self._rx_start + self._rx_pos / self._rx_rate())
+
+    def sync_tx(self, buf, num: int) -> None:
+        """Consumes `num` SC16 Q11 samples from `buf`
+
+        Args:
+            buf: A bytes-like object holding at least `num` samples.
+            num: An `int` with the number of samples to transmit.
+
+        Raises:
+            ValueError: If `buf` holds fewer than `num` samples.
+        """
+
+        if memoryview(buf).nbytes < num * iqfile.BYTES_PER_SAMPLE:
+            raise ValueError("Tx buffer is smaller than the sample count")
+
+        self.samples_tx += num
+
+        if self.realtime:
+            self._tx_submit(num)
+
+    def _sample_rate(self, is_tx: bool) -> float:
+        for channel in self._channels.values():
+            if channel.is_tx == is_tx and channel.enable:
+                return channel.sample_rate
+        for channel in self._channels.values():
+            if channel.is_tx == is_tx:
+                return channel.sample_rate
+
+        return 1e6
+
+    def _rx_rate(self) -> float:
+        # * With both Rx channels enabled the stream carries both, in turn
+        enabled = sum(
+            1 for channel in self._channels.values()
+            if not channel.is_tx and channel.enable
+        )
+        return self._sample_rate(is_tx=False) * max(enabled, 1)
+
+    def _reset_timing(self) -> None:
+        self._rx_start = None
+        self._rx_pos = 0
+        self._tx_start = None
+        self._tx_pos = 0
+
+    def _buffered_samples(self) -> int:
+        return (self.stream_config.get("num_buffers", 32)
+                * self.stream_config.get("buffer_size", 4096))
+
+    @staticmethod
+    def _wait_until(due: float) -> None:
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _rx_overrun(self) -> int:
+        # Returns the number of samples the device had to drop
+        now = time.perf_counter()
+        if self._rx_start is None:
+            self._rx_start = now
+            return 0
+
+        produced = (now - self._rx_start) * self._rx_rate()
+        backlog = produced - self._rx_pos
+        if backlog <= self._buffered_samples():
+            return 0
+
+        dropped = int(backlog - self._buffered_samples())
+        self.overruns += 1
+        self._rx_pos += dropped
+
+        return dropped
+
+    def _tx_submit(self, num: int) -> None:
+        now = time.perf_counter()
+        sample_rate = self._sample_rate(True)
+
+        if self._tx_start is None:
+            self._tx_start = now
+        elif self._tx_start + self._tx_pos / sample_rate < now:
+            # * Device ran out of samples, restart its clock from here
+            self.underruns += 1
+            self._tx_start = now - self._tx_pos / sample_rate
+
+        self._tx_pos += num
+
+        # * Block while the device buffers are full
+        self._wait_until(
+            self._tx_start
+            + (self._tx_pos - self._buffered_samples()) / sample_rate
+        )
+
+    def _generate_cycle(self) -> np.ndarray:
+        if self.signal == "file":
+            with iqfile.CaptureReader(self.replay_file) as reader:
+                return np.array(reader.samples).reshape(-1)
+
+        sample_rate = self._sample_rate(is_tx=False)
+        length = self.cycle_length
+        samples = np.zeros(length, dtype=np.complex64)
+
+        if self.signal == "cw":
+            # * Integer number of cycles per buffer keeps the tone continuous
+            cycles = round(self.freq_tone * length / sample_rate)
+            phase = np.arange(length, dtype=np.float64) * (cycles / length)
+            samples += self.amplitude * np.exp(2j * np.pi * phase)
+
+        if self.noise_level > 0:
+            noise = self._rng.standard_normal((length, 2), dtype=np.float32)
+            noise *= self.noise_level / np.sqrt(2)
+            samples += noise.view(np.complex64).reshape(-1)
+
+        iq = samples.view(np.float32) * 2048.0
+        return np.clip(np.round(iq), -2047, 2047).astype(np.int16)
+
+
+def bladerf_constants(sdr):
+    """Returns the module with the libbladeRF constants to use with a device
+
+    Args:
+        sdr: A `BladeRF`, or simulated, device object.
+
+    Returns:
+        For a `SimulatedBladeRF`, this module, whose `CHANNEL_RX`,
+        `CHANNEL_TX`, `ChannelLayout`, `Format` and `GainMode` stand-ins do
+        not need libbladeRF. For a real device, the `_bladerf` bindings.
+    """
+
+    if hasattr(sdr, "bladerf_api"):
+        return sdr.bladerf_api
+
+    from bladerf import _bladerf
+
+    return _bladerf
+
+
+def benchmark_rx(capture_modes, params: dict, duration: float,
+                 logger: logging.Logger) -> dict:
+    """Measures the maximum sustainable Rx throughput of the host pipeline
+
+    Runs `bladerf_cw_tone_rx` against an unthrottled simulated device, once
+    per capture mode, and reports the achieved sample rate.
+
+    Args:
+        capture_modes: A sequence of `str` with the capture modes to try.
+        params: The `dict` with capture parameters for `bladerf_cw_tone_rx`.
+        duration: A `float` with the capture length, in simulated seconds.
+        logger: The `logging.Logger` object to write results to.
+
+    Returns:
+        A `dict` with the achieved rate, in samples/sec, per capture mode.
+    """
+
+    import bladerf_rx_cw
+
+    results = {}
+
+    for capture_mode in capture_modes:
+        run_params = dict(params, capture_mode=capture_mode,
+                          time_duration=duration)
+        sdr = SimulatedBladeRF(signal="cw")
+
+        start = time.perf_counter()
+        bladerf_rx_cw.bladerf_cw_tone_rx(run_params, logger, sdr=sdr)
+        elapsed = time.perf_counter() - start
+
+        results[capture_mode] = sdr.samples_rx / elapsed
+        logger.info(
+            f"Capture mode {capture_mode}: {results[capture_mode]:.3e} "
+            f"samples/sec, {results[capture_mode] / params['sample_rate']:.2f}"
+            f"x real time"
+        )
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Rx host pipeline against a simulated "
+                    "bladeRF"
+    )
+    parser.add_argument(
+        "--modes", nargs="+", default=["file", "threaded", "memory"],
+        help="Capture modes to benchmark [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--sample-rate", type=float, default=20e6,
+        help="Nominal sample rate, in samples/sec [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=5.0,
+        help="Capture length, in simulated seconds [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--buffer-size", type=int, default=16384,
+        help="Host buffer size, in samples [default=%(default)r]"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    benchmark_rx(
+        args.modes,
+        {
+            "rx_ch": 0,
+            "sample_rate": args.sample_rate,
+            "freq_centre": 1e9,
+            "bandwidth": args.sample_rate / 2,
+            "rx_gain": 0,
+            "buffer_size": args.buffer_size,
+            "output_file": "benchmark.iqbin",
+            "report_interval": 1.0,
+        },
+        args.duration,
+        logging.getLogger("SimulatedRx"),
+    )
@@ -0,0 +1,286 @@
+"""Offline spectrogram rendering of long captures
+
+Replaying a capture through a real time display takes as long as the
+capture itself. Instead, this module renders a waterfall image of fixed
+size straight from the capture file. The capture is divided into as many
+equal time slices as the image has rows, and each row is the max-hold or
+mean-hold of the power spectra of the FFT frames in its slice.
+
+Frames are read from the memory-mapped capture, converted, windowed and
+transformed in batches of fixed size, and reduced into the rows with
+`reduceat`, so memory use is set by the batch and image sizes only. Every
+frame is transformed by default, so that max-hold catches any transient.
+For a quicker look at very long captures, `max_frames_per_row` limits the
+frames transformed per row to that many, evenly spread over the slice,
+which bounds the rendering time as well; only the pages holding those
+frames are read from disk.
+
+Run this module as a script to render a capture to `.npz` and `.png`.
+"""
+
+import argparse
+import logging
+import os
+
+from typing import Optional, Union
+
+import numpy as np
+
+import chunkfile
+import dsp
+import iqfile
+
+
+HOLD_MODES = ("max", "mean")
+
+
+def select_frames(num_frames: int, num_rows: int,
+                  max_frames_per_row: Optional[int] = None) -> tuple:
+    """Picks the FFT frames making up each row of the image
+
+    Args:
+        num_frames: An `int` with the number of complete frames available.
+        num_rows: An `int` with the number of rows in the image.
+        max_frames_per_row: An optional `int` with the largest number of
+                            frames to transform for each row. By default
+                            every frame is used.
+
+    Returns:
+        A `tuple` of three `np.ndarray` of `int64`: the index of every
+        selected frame, in increasing order, the row each one belongs to,
+        and the index of the first frame of each row.
+    """
+
+    edges = (np.arange(num_rows + 1) * num_frames) // num_rows
+    lengths = np.diff(edges)
+    if max_frames_per_row is None:
+        counts = lengths
+    else:
+        counts = np.minimum(lengths, max_frames_per_row)
+
+    rows = np.repeat(np.arange(num_rows), counts)
+    position = np.arange(rows.size) - np.repeat(np.cumsum(counts) - counts,
+                                                counts)
+    frames = edges[rows] + (position * lengths[rows]) // counts[rows]
+
+    return frames, rows, edges[:-1]
+
+
+def render_spectrogram(reader: Union[iqfile.CaptureReader,
+                                     chunkfile.ChunkedReader],
+                       num_rows: int = 1000, fft_size: int = 1024,
+                       window: str = "hann", hold: str = "max",
+                       max_frames_per_row: Optional[int] = None,
+                       batch_frames: int = 256,
+                       logger: Optional[logging.Logger] = None) -> dict:
+    """Renders the spectrogram of a capture
+
+    Args:
+        reader: An open `iqfile.CaptureReader` or `chunkfile.ChunkedReader`.
+        num_rows: An `int` with the number of time rows of the image. Fewer
+                  are rendered if the capture has fewer frames.
+        fft_size: An `int` with the number of frequency bins of the image.
+        window: A `str` with the name of a window from `dsp.WINDOWS`.
+        hold: A `str`, `max` to keep the peak power of each bin over the
+              frames of a row, or `mean` to average it.
+        max_frames_per_row: An optional `int` with the largest number of
+                            frames to transform for each row, to render
+                            faster. By default every frame is transformed,
+                            so that the holds cover the whole capture.
+        batch_frames: An `int` with the number of frames transformed at
+                      once.
+        logger: An optional `logging.Logger` object, warned when frames
+                are skipped.
+
+    Returns:
+        A `dict` with `image`, an `np.ndarray` of `float32` with the power
+        in dBFS, one row per time slice and bins ordered from the most
+        negative to the most positive frequency, plus the start `times` of
+        the rows in seconds and the bin `frequencies` in Hz, if the sample
+        rate is known, or in cycles/sample otherwise.
+
+    Raises:
+        ValueError: If the hold mode is unknown or the capture is too short
+                    for a single frame.
+    """
+
+    if hold not in HOLD_MODES:
+        raise ValueError(f"Unknown hold mode: {hold}")
+
+    num_frames = len(reader) // fft_size
+    if num_frames == 0:
+        raise ValueError("Capture is shorter than one FFT frame")
+
+    num_rows = min(num_rows, num_frames)
+    frames, rows, row_starts = select_frames(
+        num_frames, num_rows, max_frames_per_row
+    )
+    if frames.size < num_frames and logger is not None:
+        logger.warning(
+            f"Only {frames.size} of {num_frames} frames are transformed, "
+            f"{hold} hold does not cover the whole capture"
+        )
+
+    window = dsp.get_window(window, fft_size)
+    # * Coherent gain normalisation, a full-scale tone on a bin is 0 dBFS
+    scale = float(np.sum(window)) ** -2
+
+    # * Raw samples as whole frames, a view of the memory map when possible
+    samples = getattr(reader, "samples", None)
+    if samples is not None:
+        frame_view = samples[:num_frames * fft_size].reshape(
+            num_frames, fft_size, 2
+        )
+
+    raw = np.zeros((batch_frames, fft_size, 2), dtype=np.int16)
+    batch = np.zeros((batch_frames, fft_size), dtype=np.complex64)
+    image = np.zeros((num_rows, fft_size), dtype=np.float64)
+    counts = np.zeros(num_rows, dtype=np.int64)
+
+    for start in range(0, frames.size, batch_frames):
+        batch_index = frames[start:start + batch_frames]
+        batch_rows = rows[start:start + batch_frames]
+        count = batch_index.size
+
+        if samples is not None:
+            np.take(frame_view, batch_index, axis=0, out=raw[:count])
+        else:
+            for position, frame in enumerate(batch_index):
+                raw[position] = reader.read_raw(int(frame) * fft_size,
+                                                fft_size)
+
+        converted = dsp.sc16_to_complex64_into(
+            raw[:count].reshape(-1), batch.reshape(-1)
+        ).reshape(count, fft_size)
+        converted *= window
+
+        spectra = np.fft.fft(converted, axis=-1)
+        power = spectra.real ** 2 + spectra.imag ** 2
+
+        # * Rows are sorted, so every row is one contiguous run of frames
+        run_starts = np.flatnonzero(np.diff(batch_rows, prepend=-1))
+        run_rows = batch_rows[run_starts]
+
+        if hold == "max":
+            reduced = np.maximum.reduceat(power, run_starts, axis=0)
+            np.maximum(image[run_rows], reduced, out=reduced)
+            image[run_rows] = reduced
+        else:
+            image[run_rows] += np.add.reduceat(power, run_starts, axis=0)
+            counts[run_rows] += np.diff(np.append(run_starts, count))
+
+    if hold == "mean":
+        image /= np.maximum(counts, 1)[:, None]
+
+    image_db = 10 * np.log10(np.maximum(np.fft.fftshift(image, axes=1)
+                                        * scale, 1e-20))
+
+    sample_rate = reader.sample_rate or 1.0
+    frequencies = np.fft.fftshift(np.fft.fftfreq(fft_size, 1 / sample_rate))
+
+    return {
+        "image": image_db.astype(np.float32),
+        "times": row_starts * fft_size / sample_rate,
+        "frequencies": frequencies + (reader.freq_centre or 0.0),
+        "hold": hold,
+        "frames_used": int(frames.size),
+        "frames_total": int(num_frames),
+    }
+
+
+def save_png(result: dict, filename: str, title: str = "",
+             dynamic_range: float = 80.0) -> None:
+    """Saves a rendered spectrogram as an image with labelled axes
+
+    Needs matplotlib, which is only imported here.
+
+    Args:
+        result: A `dict` as returned by `render_spectrogram`.
+        filename: A `str` with the path to the output image.
+        title: A `str` with the plot title.
+        dynamic_range: A `float` with the range of the colour scale, in dB,
+                       below the strongest bin.
+    """
+
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    image = result["image"]
+    times = result["times"]
+    frequencies = result["frequencies"]
+    peak = float(image.max())
+
+    fig, ax = plt.subplots(figsize=(10, 8))
+    mesh = ax.imshow(
+        image, aspect="auto", origin="lower", interpolation="nearest",
+        vmin=peak - dynamic_range, vmax=peak,
+        extent=(frequencies[0], frequencies[-1], times[0],
+                times[-1] + (times[-1] - times[0]) / max(len(times) - 1, 1))
+    )
+    ax.set_xlabel("Frequency (Hz)")
+    ax.set_ylabel("Time (s)")
+    ax.set_title(title)
+    fig.colorbar(mesh, ax=ax, label=f"Power, {result['hold']} hold (dBFS)")
+    fig.savefig(filename, dpi=100)
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Render the spectrogram of an IQ capture"
+    )
+    parser.add_argument("capture", help="Capture file to render")
+    parser.add_argument(
+        "--output", default=None,
+        help="Output file name, without extension [default: capture name]"
+    )
+    parser.add_argument(
+        "--rows", type=int, default=1000,
+        help="Number of time rows [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--fft-size", type=int, default=1024,
+        help="Number of frequency bins [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--window", choices=sorted(dsp.WINDOWS), default="hann",
+        help="FFT window [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--hold", choices=HOLD_MODES, default="max",
+        help="Reduction over the frames of a row [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--max-frames-per-row", type=int, default=None,
+        help="Transform at most this many frames per row, evenly spread, to "
+             "render faster [default: every frame]"
+    )
+    parser.add_argument(
+        "--no-png", action="store_true",
+        help="Only save the rendered data, without plotting it"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    spectrogram_logger = logging.getLogger("Spectrogram")
+
+    output = args.output or os.path.splitext(args.capture)[0] + "_waterfall"
+
+    with chunkfile.open_capture(args.capture) as capture:
+        rendered = render_spectrogram(
+            capture, args.rows, args.fft_size, args.window, args.hold,
+            args.max_frames_per_row, logger=spectrogram_logger
+        )
+
+    spectrogram_logger.info(
+        f"Rendered {rendered['image'].shape[0]} rows from "
+        f"{rendered['frames_used']} of {rendered['frames_total']} frames"
+    )
+
+    np.savez(output + ".npz", **rendered)
+    spectrogram_logger.info(f"Spectrogram data saved to {output}.npz")
+
+    if not args.no_png:
+        save_png(rendered, output + ".png", os.path.basename(args.capture))
+        spectrogram_logger.info(f"Spectrogram image saved to {output}.png")
@@ -0,0 +1,429 @@
+"""Benchmark and persist bladeRF sync interface stream parameters
+
+The throughput and latency of the libbladeRF sync interface depend on
+`num_buffers`, `buffer_size` and `num_transfers` passed to `sync_config`,
+and on the size of the host buffer handed to each `sync_rx` / `sync_tx`
+call. Good values differ between sample rates and host machines, so rather
+than hardcoding them this module sweeps combinations of all four, records
+throughput, call latency and overrun / underrun counts for each, and saves
+the best combination per sample rate to a JSON file. `bladerf_rx_cw` and
+`bladerf_tx_cw` load the saved configuration automatically.
+
+The sync interface does not count overruns or underruns itself, so they are
+detected on the host: Rx is measured with `SC16_Q11_META` samples and the
+block timestamps followed by a `timestamps.GapTracker`, and Tx underruns are
+inferred from the submit timing by a `telemetry.UnderrunMonitor`.
+
+Run this module as a script to perform the sweep, either against a real
+bladeRF or, with `--simulate`, against `simulator.SimulatedBladeRF`.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import time
+
+from typing import Iterable, List, Optional
+
+import simulator
+import telemetry
+import timestamps
+
+
+CONFIG_FILE = "stream_config.json"
+
+# * libbladeRF transfers are made of 1024-sample blocks
+SAMPLE_GRANULARITY = 1024
+
+DEFAULT_CONFIGS = {
+    "rx": {
+        "num_buffers": 32,
+        "buffer_size": 4096,
+        "num_transfers": 16,
+        "stream_timeout": 3500,
+        "host_buffer_size": 4096,
+    },
+    "tx": {
+        "num_buffers": 512,
+        "buffer_size": 4096,
+        "num_transfers": 32,
+        "stream_timeout": 3500,
+        "host_buffer_size": 65536,
+    },
+}
+
+SYNC_CONFIG_KEYS = ("num_buffers", "buffer_size", "num_transfers",
+                    "stream_timeout")
+
+# * Everything saved per sample rate, the measured figures are only logged
+CONFIG_KEYS = SYNC_CONFIG_KEYS + ("host_buffer_size",)
+
+
+def _rate_key(sample_rate: float) -> str:
+    return str(int(round(sample_rate)))
+
+
+def sync_config_args(config: dict) -> dict:
+    """Picks the `sync_config` keyword arguments out of a configuration
+
+    Args:
+        config: A `dict` as returned by `load_stream_config`.
+
+    Returns:
+        A `dict` with only `num_buffers`, `buffer_size`, `num_transfers`
+        and `stream_timeout`.
+    """
+
+    return {key: config[key] for key in SYNC_CONFIG_KEYS}
+
+
+def load_stream_config(direction: str, sample_rate: float,
+                       filename: str = CONFIG_FILE) -> dict:
+    """Loads the tuned stream configuration for a sample rate
+
+    Args:
+        direction: A `str`, either `rx` or `tx`.
+        sample_rate: A `float` with the sample rate, in samples/sec.
+        filename: A `str` with the path to the JSON file written by
+                  `save_stream_config`.
+
+    Returns:
+        A `dict` with `sync_config` parameters and `host_buffer_size`. If
+        there is no saved configuration for this sample rate, the defaults
+        from `DEFAULT_CONFIGS` are returned, with `tuned` set to `False`.
+
+    Raises:
+        ValueError: If `direction` is not `rx` or `tx`.
+    """
+
+    if direction not in DEFAULT_CONFIGS:
+        raise ValueError(f"Invalid stream direction: {direction}")
+
+    config = dict(DEFAULT_CONFIGS[direction], tuned=False)
+
+    try:
+        with open(filename, "r") as config_file:
+            saved = json.load(config_file)
+    except FileNotFoundError:
+        return config
+
+    tuned = saved.get(direction, {}).get(_rate_key(sample_rate))
+    if tuned is not None:
+        config.update(tuned)
+        config["tuned"] = True
+
+    return config
+
+
+def save_stream_config(direction: str, sample_rate: float, config: dict,
+                       filename: str = CONFIG_FILE) -> None:
+    """Stores a stream configuration for a sample rate
+
+    Configurations for other directions and sample rates already in the
+    file are kept. Only the keys in `CONFIG_KEYS` are saved, so that the
+    measured figures of a sweep result are not loaded back as parameters.
+
+    Args:
+        direction: A `str`, either `rx` or `tx`.
+        sample_rate: A `float` with the sample rate, in samples/sec.
+        config: A `dict` with `sync_config` parameters, `host_buffer_size`
+                and, optionally, the measured figures of merit.
+        filename: A `str` with the path to the JSON file.
+    """
+
+    try:
+        with open(filename, "r") as config_file:
+            saved = json.load(config_file)
+    except FileNotFoundError:
+        saved = {}
+
+    saved.setdefault(direction, {})[_rate_key(sample_rate)] = {
+        key: config[key] for key in CONFIG_KEYS
+    }
+
+    with open(filename, "w") as config_file:
+        json.dump(saved, config_file, indent=4)
+
+
+def candidate_configs(num_buffers: Iterable[int], buffer_sizes: Iterable[int],
+                      num_transfers: Iterable[int],
+                      host_buffer_sizes: Iterable[int],
+                      stream_timeout: int = 3500) -> List[dict]:
+    """Builds all valid combinations of stream parameters
+
+    Combinations where `num_transfers` is not less than `num_buffers`, or
+    where a buffer size is not a multiple of `SAMPLE_GRANULARITY`, are
+    skipped, as libbladeRF would reject them.
+
+    Returns:
+        A `list` of `dict` with `sync_config` parameters and
+        `host_buffer_size`.
+    """
+
+    configs = []
+
+    for buffers, size, transfers, host_size in itertools.product(
+        num_buffers, buffer_sizes, num_transfers, host_buffer_sizes
+    ):
+        if transfers >= buffers:
+            continue
+        if size % SAMPLE_GRANULARITY or host_size % SAMPLE_GRANULARITY:
+            continue
+
+        configs.append({
+            "num_buffers": buffers,
+            "buffer_size": size,
+            "num_transfers": transfers,
+            "stream_timeout": stream_timeout,
+            "host_buffer_size": host_size,
+        })
+
+    return configs
+
+
+def measure_stream(sdr: "_bladerf.BladeRF", channel: int, direction: str,
+                   config: dict, sample_rate: float,
+                   duration: float) -> dict:
+    """Streams with one configuration and measures how well it keeps up
+
+    Calls are made before the measurement starts, so that stream start-up
+    is not timed. For Tx, these fill the whole ring of device buffers first,
+    as until it is full `sync_tx` returns as soon as the samples are copied
+    and the throughput would be inflated. Rx overruns are counted from the metadata of every block,
+    as samples lost between block timestamps or blocks flagged with an
+    overrun. Tx underruns are inferred from the submit timing.
+
+    Args:
+        sdr: A `BladeRF`, or simulated, device object.
+        channel: An `int` with the channel, as returned by
+                 `_bladerf.CHANNEL_RX` or `_bladerf.CHANNEL_TX`.
+        direction: A `str`, either `rx` or `tx`.
+        config: A `dict` with `sync_config` parameters and
+                `host_buffer_size`.
+        sample_rate: A `float` with the sample rate, in samples/sec.
+        duration: A `float` with how long to stream for, in seconds.
+
+    Returns:
+        A `dict` with the configuration, achieved `throughput` in
+        samples/sec, mean and p99 sync call durations in seconds, the
+        number of failed calls, the number of overruns or underruns in
+        `stream_events`, and the samples lost to them in `lost_samples`.
+    """
+
+    is_tx = direction == "tx"
+    ch = sdr.Channel(channel)
+    bladerf_api = simulator.bladerf_constants(sdr)
+
+    sdr.sync_config(
+        layout=bladerf_api.ChannelLayout(channel),
+        fmt=(bladerf_api.Format.SC16_Q11 if is_tx
+             else bladerf_api.Format.SC16_Q11_META),
+        **sync_config_args(config)
+    )
+
+    host_size = config["host_buffer_size"]
+    buffer = bytearray(host_size * 4)
+    meta = None if is_tx else timestamps.new_metadata(sdr)
+
+    def stream() -> int:
+        # Makes one sync call, returns the number of samples transferred
+        if is_tx:
+            sdr.sync_tx(buffer, host_size)
+            return host_size
+
+        meta.flags = timestamps.META_FLAG_RX_NOW
+        sdr.sync_rx(buffer, host_size, meta=meta)
+        return meta.actual_count
+
+    latency = telemetry.LatencyStats("sync", capacity=1 << 20)
+    tracker = timestamps.GapTracker()
+    monitor = telemetry.UnderrunMonitor(sample_rate)
+    num_samples = 0
+    errors = 0
+
+    ch.enable = True
+
+    # * Warm-up calls, stream start-up is not part of the measurement. A Tx
+    # * stream also has to fill num_buffers * buffer_size samples of device
+    # * buffers before sync_tx starts waiting on the sample rate
+    if is_tx:
+        ring_samples = config["num_buffers"] * config["buffer_size"]
+        num_warmup = max(1, -(-ring_samples // host_size))
+    else:
+        num_warmup = 1
+
+    for _ in range(num_warmup):
+        try:
+            stream()
+        except Exception:
+            errors += 1
+
+    start = time.perf_counter()
+    end = start + duration
+    now = start
+
+    while now < end:
+        try:
+            if is_tx:
+                monitor.submit(host_size)
+            count = stream()
+        except Exception:
+            errors += 1
+        else:
+            num_samples += count
+            if not is_tx:
+                tracker.record(meta.timestamp, count, meta.status)
+
+        call_end = time.perf_counter()
+        latency.record(call_end - now)
+        now = call_end
+
+    ch.enable = False
+
+    stats = latency.totals() or {"mean": 0.0, "p99": 0.0}
+
+    if is_tx:
+        stream_events = monitor.underruns
+        lost_samples = int(round(monitor.lost_time * sample_rate))
+    else:
+        # * An overrun shows up as a gap, a flag on the next block, or both
+        stream_events = max(tracker.num_gaps, tracker.overruns)
+        lost_samples = tracker.lost_samples
+
+    return dict(
+        config,
+        throughput=num_samples / (now - start),
+        mean_latency=stats["mean"],
+        p99_latency=stats["p99"],
+        errors=errors,
+        stream_events=stream_events,
+        lost_samples=lost_samples,
+        buffering_delay=(config["num_buffers"] * config["buffer_size"]
+                         / sample_rate),
+    )
+
+
+def best_config(results: List[dict], sample_rate: float) -> Optional[dict]:
+    """Picks the best configuration from a sweep
+
+    Configurations which had failed calls, overruns or underruns, or which
+    did not reach 99% of the sample rate, are discarded. Of the rest, the
+    one with the least buffering delay is chosen, with ties broken by the
+    lowest p99 call duration.
+
+    Args:
+        results: A `list` of `dict` as returned by `measure_stream`.
+        sample_rate: A `float` with the sample rate, in samples/sec.
+
+    Returns:
+        The `dict` of the best configuration, or `None` if none passed.
+    """
+
+    passed = [
+        result for result in results
+        if result["errors"] == 0 and result["stream_events"] == 0
+        and result["throughput"] >= 0.99 * sample_rate
+    ]
+
+    if not passed:
+        return None
+
+    return min(
+        passed, key=lambda result: (result["buffering_delay"],
+                                    result["p99_latency"])
+    )
+
+
+def sweep_stream(sdr: "_bladerf.BladeRF", channel: int, direction: str,
+                 configs: List[dict], sample_rate: float, duration: float,
+                 logger: logging.Logger) -> List[dict]:
+    """Measures every configuration in turn
+
+    Returns:
+        A `list` of `dict` as returned by `measure_stream`.
+    """
+
+    results = []
+
+    for index, config in enumerate(configs):
+        result = measure_stream(
+            sdr, channel, direction, config, sample_rate, duration
+        )
+        results.append(result)
+
+        logger.info(
+            f"[{index + 1}/{len(configs)}] "
+            f"buffers={config['num_buffers']} "
+            f"size={config['buffer_size']} "
+            f"transfers={config['num_transfers']} "
+            f"host={config['host_buffer_size']}: "
+            f"{result['throughput']:.3e} samples/sec, "
+            f"p99 {1e3 * result['p99_latency']:.3f} ms, "
+            f"{result['errors']} errors, {result['stream_events']} "
+            f"{'underruns' if direction == 'tx' else 'overruns'}, "
+            f"{result['lost_samples']} samples lost"
+        )
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sweep bladeRF sync_config parameters and save the best "
+                    "combination for a sample rate"
+    )
+    parser.add_argument("--direction", choices=["rx", "tx"], default="rx")
+    parser.add_argument("--channel", type=int, default=0)
+    parser.add_argument("--sample-rate", type=float, default=20e6)
+    parser.add_argument("--duration", type=float, default=0.5,
+                        help="Streaming time per combination, in seconds")
+    parser.add_argument("--num-buffers", type=int, nargs="+",
+                        default=[16, 32, 64, 128, 256, 512])
+    parser.add_argument("--buffer-sizes", type=int, nargs="+",
+                        default=[2048, 4096, 8192, 16384])
+    parser.add_argument("--num-transfers", type=int, nargs="+",
+                        default=[8, 16, 32])
+    parser.add_argument("--host-buffer-sizes", type=int, nargs="+",
+                        default=[4096, 16384, 65536])
+    parser.add_argument("--config-file", default=CONFIG_FILE)
+    parser.add_argument("--simulate", action="store_true",
+                        help="Use a real time simulated device")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    tuning_logger = logging.getLogger("StreamTuning")
+
+    if args.simulate:
+        sdr = simulator.SimulatedBladeRF(realtime=True)
+    else:
+        from bladerf import _bladerf
+        sdr = _bladerf.BladeRF()
+
+    bladerf_api = simulator.bladerf_constants(sdr)
+    if args.direction == "tx":
+        channel = bladerf_api.CHANNEL_TX(args.channel)
+    else:
+        channel = bladerf_api.CHANNEL_RX(args.channel)
+
+    sdr.Channel(channel).sample_rate = args.sample_rate
+
+    configs = candidate_configs(
+        args.num_buffers, args.buffer_sizes, args.num_transfers,
+        args.host_buffer_sizes
+    )
+    tuning_logger.info(f"Sweeping {len(configs)} combinations")
+
+    results = sweep_stream(
+        sdr, channel, args.direction, configs, args.sample_rate,
+        args.duration, tuning_logger
+    )
+    best = best_config(results, args.sample_rate)
+
+    if best is None:
+        tuning_logger.error("No combination kept up with the sample rate")
+    else:
+        save_stream_config(
+            args.direction, args.sample_rate, best, args.config_file
+        )
+        tuning_logger.info(f"Best configuration saved: {best}")
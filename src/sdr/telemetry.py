@@ -0,0 +1,362 @@
+"""Rate-limited throughput telemetry for streaming loops
+
+Logging every received buffer costs more than receiving it at 20 MS/s.
+Instead, the hot loop only bumps counters and records call latencies into
+preallocated arrays, and a background reporter thread turns them into one
+summary line per interval, plus a final report when the stream stops.
+"""
+
+import logging
+import threading
+import time
+
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+
+class LatencyStats:
+    """Collects call durations with a fixed memory footprint
+
+    Durations are stored in a preallocated array until the next snapshot.
+    Every snapshot is also folded into a log-spaced histogram, from which
+    the percentiles of the whole run are estimated.
+
+    Attributes:
+        name: A `str` identifying the call being timed.
+        count: An `int` with the number of durations recorded in total.
+        dropped: An `int` with the number of durations which did not fit in
+                 the interval buffer and were left out of the statistics.
+    """
+
+    # * Histogram edges from 100 ns to 100 s, 20 bins per decade
+    _EDGES = np.logspace(-7, 2, 181)
+
+    def __init__(self, name: str, capacity: int = 65536):
+        """Allocates the interval buffers
+
+        Args:
+            name: A `str` identifying the call being timed.
+            capacity: An `int` with the maximum number of durations kept
+                      per reporting interval.
+        """
+
+        self.name = name
+        self._lock = threading.Lock()
+        self._values = np.zeros(capacity, dtype=np.float64)
+        self._spare = np.zeros(capacity, dtype=np.float64)
+        self._fill = 0
+
+        self.count = 0
+        self.dropped = 0
+        self._sum = 0.0
+        self._min = np.inf
+        self._max = 0.0
+        self._histogram = np.zeros(self._EDGES.size + 1, dtype=np.int64)
+
+    def record(self, duration: float) -> None:
+        """Records a single call duration, in seconds"""
+
+        with self._lock:
+            if self._fill < self._values.size:
+                self._values[self._fill] = duration
+                self._fill += 1
+            else:
+                self.dropped += 1
+
+    def snapshot(self) -> Optional[dict]:
+        """Returns statistics of the durations since the last snapshot
+
+        Returns:
+            A `dict` with `count`, `min`, `mean`, `max` and `p99` durations,
+            in seconds, or `None` if nothing was recorded.
+        """
+
+        with self._lock:
+            values = self._values[:self._fill]
+            self._values, self._spare = self._spare, self._values
+            self._fill = 0
+
+        if values.size == 0:
+            return None
+
+        self.count += values.size
+        self._sum += float(values.sum())
+        self._min = min(self._min, float(values.min()))
+        self._max = max(self._max, float(values.max()))
+        self._histogram += np.bincount(
+            np.searchsorted(self._EDGES, values),
+            minlength=self._histogram.size
+        )
+
+        return {
+            "count": values.size,
+            "min": float(values.min()),
+            "mean": float(values.mean()),
+            "max": float(values.max()),
+            "p99": float(np.percentile(values, 99)),
+        }
+
+    def totals(self) -> Optional[dict]:
+        """Returns statistics of all durations recorded so far
+
+        The `p99` value is estimated from the histogram, to within one bin.
+
+        Returns:
+            A `dict` with `count`, `min`, `mean`, `max` and `p99` durations,
+            in seconds, or `None` if nothing was recorded.
+        """
+
+        self.snapshot()
+
+        if self.count == 0:
+            return None
+
+        target = 0.99 * self.count
+        index = int(np.searchsorted(np.cumsum(self._histogram), target))
+        p99 = self._EDGES[min(index, self._EDGES.size - 1)]
+
+        return {
+            "count": self.count,
+            "min": self._min,
+            "mean": self._sum / self.count,
+            "max": self._max,
+            "p99": min(float(p99), self._max),
+        }
+
+
+def format_latency(name: str, stats: Optional[dict]) -> str:
+    """Formats latency statistics, in milliseconds, for the log
+
+    Args:
+        name: A `str` identifying the call being timed.
+        stats: A `dict` as returned by `LatencyStats.snapshot`, or `None`.
+
+    Returns:
+        A `str` with a compact summary of the statistics.
+    """
+
+    if stats is None:
+        return f"{name}: no calls"
+
+    return (
+        f"{name} ms min/mean/max/p99: {1e3 * stats['min']:.3f}/"
+        f"{1e3 * stats['mean']:.3f}/{1e3 * stats['max']:.3f}/"
+        f"{1e3 * stats['p99']:.3f}"
+    )
+
+
+class Telemetry:
+    """Throughput and latency counters with a background reporter
+
+    The streaming loop calls `add` for every block and `record` for every
+    timed call, neither of which does any formatting or I/O. A daemon thread
+    logs a summary every `interval` seconds between `start` and `stop`, and
+    `stop` writes a final report for the whole run. Gauges, such as a queue
+    depth, are sampled by the reporter thread at every report.
+
+    Attributes:
+        name: A `str` used as a prefix for the log messages, e.g. `Rx`.
+        interval: A `float` with the reporting interval, in seconds.
+        samples: An `int` with the number of samples streamed so far.
+        bytes: An `int` with the number of bytes streamed so far.
+        latency: A `dict` of `LatencyStats` objects, keyed by call name.
+        gauges: A `dict` of callables returning a value to report, keyed by
+                gauge name.
+        nominal_rate: An optional `float` with the expected sample rate, to
+                      which the achieved rate is compared in the reports.
+    """
+
+    def __init__(self, logger: logging.Logger, name: str = "Rx",
+                 interval: float = 1.0,
+                 timed_calls: Sequence[str] = ("sync_rx", "write"),
+                 bytes_per_sample: int = 4,
+                 nominal_rate: Optional[float] = None):
+        """Sets up the counters, without starting the reporter
+
+        Args:
+            logger: The `logging.Logger` object to write the reports to.
+            name: A `str` used as a prefix for the log messages.
+            interval: A `float` with the reporting interval, in seconds.
+            timed_calls: A sequence of `str` with the names of the calls
+                         whose durations will be passed to `record`.
+            bytes_per_sample: An `int` with the size of a single sample.
+            nominal_rate: An optional `float` with the expected sample rate,
+                          in samples/sec.
+
+        Raises:
+            ValueError: If `interval` is not positive.
+        """
+
+        if interval <= 0:
+            raise ValueError("Reporting interval must be positive")
+
+        self.logger = logger
+        self.name = name
+        self.interval = interval
+        self.bytes_per_sample = bytes_per_sample
+        self.nominal_rate = nominal_rate
+
+        self.samples = 0
+        self.bytes = 0
+        self.latency = {call: LatencyStats(call) for call in timed_calls}
+        self.gauges = {}
+
+        self._start_time = None
+        self._last_time = None
+        self._last_samples = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add(self, num_samples: int) -> None:
+        """Counts a block of streamed samples"""
+
+        self.samples += num_samples
+        self.bytes += num_samples * self.bytes_per_sample
+
+    def record(self, name: str, duration: float) -> None:
+        """Records the duration, in seconds, of a call named `name`
+
+        Raises:
+            KeyError: If `name` was not listed in `timed_calls`.
+        """
+
+        self.latency[name].record(duration)
+
+    def add_gauge(self, name: str, gauge: Callable[[], object]) -> None:
+        """Adds a value to be sampled and logged with every report
+
+        Args:
+            name: A `str` with the name of the gauge.
+            gauge: A callable with no arguments returning the current value.
+        """
+
+        self.gauges[name] = gauge
+
+    def start(self) -> None:
+        """Starts the background reporter thread"""
+
+        self._start_time = self._last_time = time.perf_counter()
+        self._last_samples = self.samples
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=f"{self.name}Telemetry", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the reporter thread and writes the final report"""
+
+        if self._thread is None:
+            return
+
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        self.report(final=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def report(self, final: bool = False) -> None:
+        """Logs a summary of the last interval, or of the whole run
+
+        Args:
+            final: A `bool`, if set the summary covers the whole run.
+        """
+
+        now = time.perf_counter()
+        samples = self.samples
+
+        if final:
+            elapsed = now - self._start_time
+            count = samples
+            parts = [
+                f"{self.name} total: {samples} samples, "
+                f"{self.bytes:.3e} bytes in {elapsed:.3f} sec"
+            ]
+            latency = {
+                name: stats.totals() for name, stats in self.latency.items()
+            }
+        else:
+            elapsed = now - self._last_time
+            count = samples - self._last_samples
+            parts = [f"{self.name}: {samples} samples"]
+            latency = {
+                name: stats.snapshot() for name, stats in self.latency.items()
+            }
+
+        self._last_time = now
+        self._last_samples = samples
+
+        rate = count / elapsed if elapsed > 0 else 0.0
+        parts.append(
+            f"{rate:.3e} samples/sec, "
+            f"{rate * self.bytes_per_sample:.3e} bytes/sec"
+        )
+        if self.nominal_rate:
+            parts.append(f"{100 * rate / self.nominal_rate:.1f}% of nominal")
+        parts.extend(
+            format_latency(name, stats) for name, stats in latency.items()
+        )
+        parts.extend(
+            f"{name}: {gauge()}" for name, gauge in self.gauges.items()
+        )
+
+        self.logger.info(", ".join(parts))
+
+        for stats in self.latency.values():
+            if final and stats.dropped:
+                self.logger.warning(
+                    f"{self.name}: {stats.dropped} {stats.name} durations "
+                    f"did not fit in the interval buffer"
+                )
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.report()
+
+
+class UnderrunMonitor:
+    """Detects Tx underruns from the timing of the submit loop
+
+    The device plays out samples at the sample rate. If, when a block is
+    about to be submitted, more time has passed since the start than all the
+    samples submitted so far last, the device has run out of samples. The
+    sync interface does not report this, so it is inferred on the host.
+    After an underrun the reference time is moved forward by the gap, as the
+    device restarts from the next samples it gets.
+
+    Attributes:
+        sample_rate: A `float` with the Tx sample rate, in samples/sec.
+        underruns: An `int` with the number of underruns detected.
+        lost_time: A `float` with the total time the device ran dry, in
+                   seconds.
+    """
+
+    def __init__(self, sample_rate: float):
+        self.sample_rate = sample_rate
+        self.underruns = 0
+        self.lost_time = 0.0
+        self._start = None
+        self._submitted = 0
+
+    def submit(self, num_samples: int) -> None:
+        """Checks for an underrun, just before submitting `num_samples`"""
+
+        now = time.perf_counter()
+
+        if self._start is None:
+            self._start = now
+        else:
+            due = self._start + self._submitted / self.sample_rate
+            if now > due:
+                self.underruns += 1
+                self.lost_time += now - due
+                self._start += now - due
+
+        self._submitted += num_samples
@@ -0,0 +1,29 @@
+"""Shared fixtures for the host-side tests
+
+The modules in `src/sdr` are scripts which import each other directly, so
+their directory is put on the import path here rather than installing
+them as a package.
+"""
+
+import logging
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def logger() -> logging.Logger:
+    """Logger for functions which write diagnostics"""
+    return logging.getLogger("sdr-tests")
+
+
+@pytest.fixture
+def sc16_samples() -> np.ndarray:
+    """Random interleaved SC16 Q11 samples, 10000 of them"""
+
+    rng = np.random.default_rng(1234)
+    return rng.integers(-2047, 2048, size=20000, dtype=np.int16)
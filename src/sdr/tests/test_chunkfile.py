@@ -0,0 +1,100 @@
+"""Tests for the chunked, compressed capture files"""
+
+import numpy as np
+import pytest
+
+import chunkfile
+import iqfile
+
+CHUNK_SAMPLES = 1000
+
+
+def _tone(num_samples: int) -> np.ndarray:
+    # Noisy tone, as captured, with full-scale swings between samples
+    rng = np.random.default_rng(42)
+    phase = 2 * np.pi * 0.01 * np.arange(num_samples)
+    iq = np.stack([np.cos(phase), np.sin(phase)], axis=1) * 1500
+    iq += rng.normal(0, 20, iq.shape)
+    values = np.clip(np.rint(iq), -2047, 2047).astype(np.int16)
+    values[::97] = (2047, -2047)
+    values[1::97] = (-2047, 2047)
+    return values.reshape(-1)
+
+
+@pytest.mark.parametrize("codec", chunkfile.CODECS)
+@pytest.mark.parametrize("sample_filter", chunkfile.FILTERS)
+def test_round_trip(tmp_path, codec, sample_filter):
+    filename = str(tmp_path / "capture.iqbin")
+    samples = _tone(10500)
+
+    with chunkfile.ChunkedWriter(
+        filename, {"sample_rate": 1e6}, chunk_samples=CHUNK_SAMPLES,
+        codec=codec, sample_filter=sample_filter, num_workers=2
+    ) as out_file:
+        # * Blocks which do not line up with the chunks
+        for start in range(0, samples.size, 2 * 777):
+            out_file.write(samples[start:start + 2 * 777])
+
+    assert out_file.num_samples == 10500
+    assert out_file.compressed_bytes > 0
+
+    with chunkfile.open_capture(filename) as reader:
+        assert isinstance(reader, chunkfile.ChunkedReader)
+        assert len(reader) == 10500
+        assert reader.sample_rate == 1e6
+        assert reader.metadata["codec"] == codec
+        assert reader.metadata["filter"] == sample_filter
+        assert reader.index.shape == (11, 3)
+        np.testing.assert_array_equal(
+            reader.read_raw(0, len(reader)).reshape(-1), samples
+        )
+
+
+@pytest.mark.parametrize("sample_filter", chunkfile.FILTERS)
+def test_encode_decode_chunk(sample_filter):
+    samples = _tone(CHUNK_SAMPLES)
+    encoded = chunkfile.encode_chunk(samples.tobytes(), "zlib", 1,
+                                     sample_filter)
+    decoded = chunkfile.decode_chunk(encoded, "zlib", sample_filter)
+
+    np.testing.assert_array_equal(decoded.reshape(-1), samples)
+
+
+def test_random_access(tmp_path):
+    filename = str(tmp_path / "capture.iqbin")
+    samples = _tone(5000)
+    with chunkfile.ChunkedWriter(filename,
+                                 chunk_samples=CHUNK_SAMPLES) as out_file:
+        out_file.write(samples)
+
+    expected = iqfile.sc16_to_complex64(samples)
+    with chunkfile.ChunkedReader(filename) as reader:
+        # * Across a chunk boundary, within a chunk, and past the end
+        np.testing.assert_array_equal(reader.read(950, 100),
+                                      expected[950:1050])
+        np.testing.assert_array_equal(reader[2100:2200], expected[2100:2200])
+        np.testing.assert_array_equal(reader[::500], expected[::500])
+        assert reader.read_raw(4990, 100).shape == (10, 2)
+        assert reader[1234] == expected[1234]
+        assert reader[-1] == expected[-1]
+        with pytest.raises(IndexError):
+            reader[5000]
+
+
+def test_open_raw_capture(tmp_path, sc16_samples):
+    filename = str(tmp_path / "capture.iqbin")
+    with iqfile.CaptureWriter(filename) as out_file:
+        out_file.write(sc16_samples)
+
+    with chunkfile.open_capture(filename) as reader:
+        assert isinstance(reader, iqfile.CaptureReader)
+
+
+def test_invalid_parameters(tmp_path):
+    filename = str(tmp_path / "capture.iqbin")
+    with pytest.raises(ValueError):
+        chunkfile.ChunkedWriter(filename, codec="zstd")
+    with pytest.raises(ValueError):
+        chunkfile.ChunkedWriter(filename, sample_filter="bitshuffle")
+    with pytest.raises(ValueError):
+        chunkfile.ChunkedWriter(filename, chunk_samples=0)
@@ -0,0 +1,100 @@
+"""Tests for the raw capture files and their sidecars"""
+
+import json
+
+import numpy as np
+import pytest
+
+import iqfile
+
+
+def test_round_trip(tmp_path, sc16_samples):
+    filename = str(tmp_path / "capture.iqbin")
+    metadata = {"sample_rate": 1e6, "freq_centre": 2.4e9, "rx_ch": 0}
+
+    with iqfile.CaptureWriter(filename, metadata) as out_file:
+        # * Written in uneven blocks, as in the Rx loop
+        out_file.write(sc16_samples[:6000])
+        out_file.write(sc16_samples[6000:].tobytes())
+
+    with iqfile.CaptureReader(filename) as reader:
+        assert len(reader) == sc16_samples.size // 2
+        assert reader.sample_rate == 1e6
+        assert reader.freq_centre == 2.4e9
+        assert reader.metadata["num_samples"] == len(reader)
+        np.testing.assert_array_equal(
+            np.asarray(reader.samples).reshape(-1), sc16_samples
+        )
+
+        expected = iqfile.sc16_to_complex64(sc16_samples)
+        np.testing.assert_array_equal(reader[:], expected)
+        np.testing.assert_array_equal(reader.read(100, 50), expected[100:150])
+
+
+def test_sidecar_written_on_open(tmp_path):
+    filename = str(tmp_path / "capture.iqbin")
+
+    out_file = iqfile.CaptureWriter(filename, {"sample_rate": 5e6})
+    with open(iqfile.sidecar_filename(filename)) as sidecar:
+        metadata = json.load(sidecar)
+    out_file.close()
+
+    assert metadata["format"] == iqfile.SAMPLE_FORMAT
+    assert metadata["sample_rate"] == 5e6
+    assert metadata["num_samples"] == 0
+
+
+def test_integer_index_returns_scalar(tmp_path):
+    filename = str(tmp_path / "capture.iqbin")
+    with iqfile.CaptureWriter(filename) as out_file:
+        out_file.write(np.array([1024, -512, 2047, 0], dtype=np.int16))
+
+    with iqfile.CaptureReader(filename) as reader:
+        assert reader[0] == np.complex64(0.5 - 0.25j)
+        assert np.ndim(reader[1]) == 0
+        assert reader[-1] == np.complex64(2047 / 2048)
+
+
+def test_sc16_scaling():
+    samples = np.array([2047, -2048, 1, -1], dtype=np.int16)
+    result = iqfile.sc16_to_complex64(samples)
+
+    assert result.dtype == np.complex64
+    np.testing.assert_allclose(
+        result, [2047 / 2048 - 1j, 1 / 2048 - 1j / 2048]
+    )
+
+
+def test_mimo_channels(tmp_path):
+    filename = str(tmp_path / "mimo.iqbin")
+    ch0 = np.arange(200, dtype=np.int16).reshape(-1, 2)
+    ch1 = -ch0
+    interleaved = np.stack([ch0, ch1], axis=1).reshape(-1)
+
+    with iqfile.CaptureWriter(filename, {"num_channels": 2}) as out_file:
+        out_file.write(interleaved)
+
+    with iqfile.CaptureReader(filename) as reader:
+        assert reader.num_channels == 2
+        np.testing.assert_array_equal(reader.channel(0), ch0)
+        np.testing.assert_array_equal(reader.channel(1), ch1)
+        with pytest.raises(IndexError):
+            reader.channel(2)
+
+
+def test_missing_sidecar(tmp_path):
+    filename = tmp_path / "legacy.iqbin"
+    filename.write_bytes(np.zeros(8, dtype=np.int16).tobytes())
+
+    with iqfile.CaptureReader(str(filename)) as reader:
+        assert reader.metadata == {}
+        assert len(reader) == 4
+
+
+def test_unsupported_format(tmp_path):
+    filename = str(tmp_path / "capture.iqbin")
+    with open(iqfile.sidecar_filename(filename), "w") as sidecar:
+        json.dump({"format": "SC8_Q7"}, sidecar)
+
+    with pytest.raises(ValueError):
+        iqfile.read_metadata(filename)
@@ -0,0 +1,98 @@
+"""Tests for the lookup-table NCO"""
+
+import numpy as np
+import pytest
+
+import waveforms
+
+SAMPLE_RATE = 1e6
+
+
+def _exact(nco: waveforms.NCO, start: int, count: int) -> np.ndarray:
+    # Reference tone computed from the exact integer phase
+    phases = np.array([nco.phase_at(start + n) for n in range(count)])
+    return np.exp(2j * np.pi * phases / 2.0 ** 32)
+
+
+@pytest.mark.parametrize("freq", [1e5, -2.5e5, 12345.6])
+def test_frequency_and_phase(freq):
+    nco = waveforms.NCO(SAMPLE_RATE, freq, phase=np.pi / 2, table_bits=16)
+
+    assert abs(nco.frequency - freq) <= SAMPLE_RATE / 2 ** 32
+    out = np.zeros(4096, dtype=np.complex64)
+    nco(0, out)
+
+    assert abs(np.angle(out[0]) - np.pi / 2) <= 2 * np.pi / 2 ** 16
+    # * Peak of the spectrum in the bin of the tone
+    spectrum = np.abs(np.fft.fft(out))
+    peak = np.fft.fftfreq(out.size, 1 / SAMPLE_RATE)[np.argmax(spectrum)]
+    assert abs(peak - freq) <= SAMPLE_RATE / out.size
+
+
+@pytest.mark.parametrize("interpolate, tolerance", [
+    (False, 2 * np.pi / 2 ** 14),
+    (True, 1e-6),
+])
+def test_accuracy(interpolate, tolerance):
+    nco = waveforms.NCO(SAMPLE_RATE, 123456.7, interpolate=interpolate)
+    out = np.zeros(2000, dtype=np.complex64)
+    nco(10 ** 9, out)
+
+    np.testing.assert_allclose(out, _exact(nco, 10 ** 9, 2000),
+                               atol=tolerance)
+
+
+@pytest.mark.parametrize("interpolate", [False, True])
+def test_chunks_join_up(interpolate):
+    nco = waveforms.NCO(SAMPLE_RATE, 3.3e4, interpolate=interpolate)
+    reference = np.zeros(100000, dtype=np.complex64)
+    nco(0, reference)
+
+    # * Chunks larger than the initial work buffers as well
+    chunked = np.zeros_like(reference)
+    for start, size in ((0, 1), (1, 999), (1000, 70000), (71000, 29000)):
+        nco(start, chunked[start:start + size])
+
+    np.testing.assert_array_equal(chunked, reference)
+
+
+@pytest.mark.parametrize("interpolate", [False, True])
+@pytest.mark.parametrize("amplitude", [1.0, 0.25])
+def test_fill_sc16_scaling(interpolate, amplitude):
+    nco = waveforms.NCO(SAMPLE_RATE, 2e5, interpolate=interpolate)
+    samples = np.zeros(5000, dtype=np.complex64)
+    nco(777, samples)
+
+    expected = np.zeros(10000, dtype=np.int16)
+    waveforms.pack_sc16(samples, amplitude * waveforms.FULL_SCALE, expected,
+                        np.zeros(10000, dtype=np.float32))
+
+    out = np.zeros(12000, dtype=np.int16)
+    values = nco.fill_sc16(777, out, 5000, amplitude)
+    np.testing.assert_array_equal(values, expected)
+
+    magnitude = np.hypot(*values.reshape(-1, 2).T.astype(np.float64))
+    np.testing.assert_allclose(
+        magnitude, amplitude * waveforms.FULL_SCALE, atol=1.5
+    )
+
+
+def test_next_sc16_advances():
+    nco = waveforms.NCO(SAMPLE_RATE, -1e5)
+    first = nco.next_sc16(np.zeros(2000, dtype=np.int16), 1000).copy()
+    second = nco.next_sc16(np.zeros(2000, dtype=np.int16), 1000)
+
+    assert nco.position == 2000
+    np.testing.assert_array_equal(
+        np.concatenate([first, second]),
+        nco.fill_sc16(0, np.zeros(4000, dtype=np.int16), 2000)
+    )
+
+
+def test_invalid_parameters():
+    with pytest.raises(ValueError):
+        waveforms.NCO(SAMPLE_RATE, 1e5, table_bits=2)
+    with pytest.raises(ValueError):
+        waveforms.NCO(SAMPLE_RATE, 1e5).fill_sc16(
+            0, np.zeros(20, dtype=np.int16), 10, amplitude=1.5
+        )
@@ -0,0 +1,118 @@
+"""Tests for the multi-segment playback index"""
+
+import datetime
+import os
+
+import numpy as np
+import pytest
+
+import chunkfile
+import iqfile
+import playback
+
+
+def _capture(tmp_path, name: str, num_samples: int,
+             sample_rate: float = None) -> str:
+    filename = str(tmp_path / name)
+    metadata = {"sample_rate": sample_rate} if sample_rate else {}
+    with iqfile.CaptureWriter(filename, metadata) as out_file:
+        out_file.write(np.zeros(2 * num_samples, dtype=np.int16))
+    return filename
+
+
+@pytest.fixture
+def index(tmp_path) -> playback.PlaybackIndex:
+    # * 1 s at 1000 samples/sec, 0.5 s at 2000, then 2 s at 1000
+    return playback.PlaybackIndex([
+        _capture(tmp_path, "a.iqbin", 1000, 1000.0),
+        _capture(tmp_path, "b.iqbin", 1000, 2000.0),
+        _capture(tmp_path, "c.iqbin", 2000, 1000.0),
+    ])
+
+
+def test_segments(index):
+    assert len(index) == 3
+    assert index.num_samples == 4000
+    assert index.duration == pytest.approx(3.5)
+    assert [segment["offset"] for segment in index.segments] == [0, 1000,
+                                                                 2000]
+    assert [segment["start_time"] for segment in index.segments] == [
+        0.0, 1.0, 1.5
+    ]
+
+
+@pytest.mark.parametrize("seconds, expected", [
+    (0.0, (0, 0)),
+    (0.25, (0, 250)),
+    (0.9995, (0, 999)),
+    (1.0, (1, 0)),
+    (1.25, (1, 500)),
+    (1.5, (2, 0)),
+    (3.0, (2, 1500)),
+    # * Clipped to the recording
+    (-1.0, (0, 0)),
+    (3.5, (2, 1999)),
+    (100.0, (2, 1999)),
+])
+def test_locate(index, seconds, expected):
+    assert index.locate(seconds) == expected
+
+
+@pytest.mark.parametrize("segment, offset", [
+    (0, 0), (0, 999), (1, 1), (1, 750), (2, 0), (2, 1999)
+])
+def test_time_of_inverts_locate(index, segment, offset):
+    seconds = index.time_of(segment, offset)
+
+    assert index.locate(seconds) == (segment, offset)
+
+
+def test_time_of(index):
+    assert index.time_of(1, 500) == pytest.approx(1.25)
+    assert index.time_of(2, 1000) == pytest.approx(2.5)
+
+
+def test_timestamp_of(index):
+    created = datetime.datetime.fromisoformat(
+        iqfile.read_metadata(index.segments[2]["filename"])["created"]
+    ).timestamp()
+
+    assert index.timestamp_of(2, 500) == pytest.approx(created + 0.5)
+
+
+def test_timestamp_without_sidecar(tmp_path):
+    filename = tmp_path / "legacy.iqbin"
+    filename.write_bytes(np.zeros(200, dtype=np.int16).tobytes())
+    os.utime(filename, (1e9, 1e9))
+
+    index = playback.PlaybackIndex([str(filename)], sample_rate=100.0)
+
+    assert index.duration == pytest.approx(1.0)
+    assert index.timestamp_of(0, 50) == pytest.approx(1e9 + 0.5)
+
+
+def test_open_segment(tmp_path):
+    filename = str(tmp_path / "ramp.iqbin")
+    values = np.arange(200, dtype=np.int16)
+    with iqfile.CaptureWriter(filename, {"sample_rate": 1e3}) as out_file:
+        out_file.write(values)
+
+    samples = playback.PlaybackIndex([filename]).open_segment(0)
+
+    np.testing.assert_array_equal(samples, values.reshape(-1, 2))
+
+
+def test_invalid_captures(tmp_path):
+    with pytest.raises(ValueError):
+        playback.PlaybackIndex([])
+    with pytest.raises(ValueError):
+        playback.PlaybackIndex([_capture(tmp_path, "rate.iqbin", 10)])
+    with pytest.raises(ValueError):
+        playback.PlaybackIndex([_capture(tmp_path, "empty.iqbin", 0, 1e3)])
+
+    compressed = str(tmp_path / "compressed.iqbin")
+    metadata = {"sample_rate": 1e3}
+    with chunkfile.ChunkedWriter(compressed, metadata) as out_file:
+        out_file.write(np.zeros(20, dtype=np.int16))
+    with pytest.raises(ValueError):
+        playback.PlaybackIndex([compressed])
@@ -0,0 +1,263 @@
+"""Smoke tests of the Rx and Tx pipelines against the simulated device
+
+Every capture and Tx mode is run end to end, unthrottled, for a fraction of
+a second of simulated time. None of it needs libbladeRF.
+"""
+
+import numpy as np
+import pytest
+
+import bladerf_rx_cw
+import bladerf_tx_cw
+import chunkfile
+import iqfile
+import simulator
+import stream_tuning
+
+SAMPLE_RATE = 1e6
+DURATION = 0.05
+NUM_SAMPLES = int(SAMPLE_RATE * DURATION)
+
+
+@pytest.fixture
+def rx_params(tmp_path) -> dict:
+    return {
+        "rx_ch": 0,
+        "sample_rate": SAMPLE_RATE,
+        "freq_centre": 1e9,
+        "bandwidth": SAMPLE_RATE / 2,
+        "rx_gain": 0,
+        "time_duration": DURATION,
+        "buffer_size": 8192,
+        "output_file": str(tmp_path / "capture.iqbin"),
+        "stream_config_file": str(tmp_path / "stream_config.json"),
+    }
+
+
+@pytest.fixture
+def tx_params(tmp_path) -> dict:
+    return {
+        "tx_ch": 1,
+        "sample_rate": SAMPLE_RATE,
+        "freq_centre": 1e9,
+        "bandwidth": SAMPLE_RATE / 2,
+        "tx_gain": 0,
+        "freq_tone": 1e5,
+        "time_duration": DURATION,
+        "num_samples": 10000,
+        "waveform_cache": str(tmp_path / "waveform_cache"),
+        "stream_config_file": str(tmp_path / "stream_config.json"),
+    }
+
+
+def _rx(params, logger, **kwargs):
+    sdr = simulator.SimulatedBladeRF(seed=0, **kwargs)
+    return sdr, bladerf_rx_cw.bladerf_cw_tone_rx(params, logger, sdr=sdr)
+
+
+def test_rx_memory(rx_params, logger):
+    rx_params.update(capture_mode="memory", complex_output=True)
+    sdr, rx_signal = _rx(rx_params, logger, noise_level=0.0)
+
+    assert rx_signal.dtype == np.complex64
+    assert rx_signal.size == NUM_SAMPLES
+    assert sdr.samples_rx >= NUM_SAMPLES
+    np.testing.assert_allclose(np.abs(rx_signal), 0.5, atol=2e-3)
+
+
+def _check_capture(params):
+    with iqfile.CaptureReader(params["output_file"]) as reader:
+        assert len(reader) >= NUM_SAMPLES
+        assert reader.metadata["num_samples"] == len(reader)
+        assert reader.sample_rate == SAMPLE_RATE
+
+
+def test_rx_file(rx_params, logger):
+    rx_params["capture_mode"] = "file"
+    _, rx_signal = _rx(rx_params, logger)
+
+    assert rx_signal is None
+    _check_capture(rx_params)
+
+
+def test_rx_threaded(rx_params, logger):
+    rx_params["capture_mode"] = "threaded"
+    _rx(rx_params, logger)
+
+    _check_capture(rx_params)
+
+
+def test_rx_timestamped(rx_params, logger):
+    rx_params["capture_mode"] = "timestamped"
+    _rx(rx_params, logger)
+
+    _check_capture(rx_params)
+
+
+class _StalledBladeRF(simulator.SimulatedBladeRF):
+    """Simulated device whose timestamped reads come back empty"""
+
+    def __init__(self, num_good: int, **kwargs):
+        super().__init__(**kwargs)
+        self.num_good = num_good
+        self.num_reads = 0
+
+    def sync_rx(self, buf, num, meta=None):
+        super().sync_rx(buf, num, meta)
+        self.num_reads += 1
+        if meta is not None and self.num_reads > self.num_good:
+            meta.actual_count = 0
+
+
+def test_rx_timestamped_empty_reads(rx_params, logger):
+    rx_params.update(capture_mode="timestamped", max_empty_reads=4)
+    sdr = _StalledBladeRF(2, seed=0)
+    bladerf_rx_cw.bladerf_cw_tone_rx(rx_params, logger, sdr=sdr)
+
+    # * Stops after the empty reads instead of spinning forever
+    assert sdr.num_reads == 2 + 4
+    with iqfile.CaptureReader(rx_params["output_file"]) as reader:
+        assert len(reader) == 2 * rx_params["buffer_size"]
+        summary = reader.metadata["timestamps"]
+        assert summary["empty_reads"] == 4
+        assert not summary["valid"]
+
+
+def test_rx_compressed(rx_params, logger):
+    rx_params.update(capture_mode="threaded", compression="zlib",
+                     chunk_samples=16384, compression_workers=1)
+    _rx(rx_params, logger)
+
+    with chunkfile.open_capture(rx_params["output_file"]) as reader:
+        assert isinstance(reader, chunkfile.ChunkedReader)
+        assert len(reader) >= NUM_SAMPLES
+
+
+def test_rx_stream(rx_params, logger, tmp_path):
+    psd_file = str(tmp_path / "psd.npz")
+    rx_params.update(capture_mode="stream", psd_fft_size=1024,
+                     psd_file=psd_file)
+    _rx(rx_params, logger)
+
+    assert (tmp_path / "psd.npz").exists()
+
+
+def test_rx_memory_psd(rx_params, logger, tmp_path):
+    psd_file = str(tmp_path / "psd.npz")
+    rx_params.update(capture_mode="memory", psd_fft_size=1024,
+                     psd_file=psd_file)
+    _rx(rx_params, logger)
+
+    assert (tmp_path / "psd.npz").exists()
+
+
+def test_rx_triggered(rx_params, logger):
+    rx_params.update(capture_mode="triggered", trigger_level=-20.0,
+                     pre_trigger_samples=100, post_trigger_samples=100)
+    _rx(rx_params, logger)
+
+    # * The simulated tone is always above the threshold, so there is a
+    # * single event covering the whole capture
+    with iqfile.CaptureReader(rx_params["output_file"]) as reader:
+        events = reader.metadata["events"]
+        assert len(events) == 1
+        assert events[0]["trigger"] == 0
+        assert events[0]["length"] == len(reader)
+
+
+@pytest.mark.parametrize("mimo_output", ["separate", "interleaved"])
+def test_rx_mimo(rx_params, logger, mimo_output):
+    rx_params.update(capture_mode="mimo", mimo_output=mimo_output)
+    _rx(rx_params, logger)
+
+    output_file = rx_params["output_file"]
+    if mimo_output == "separate":
+        for channel in (0, 1):
+            filename = iqfile.channel_filename(output_file, channel)
+            with iqfile.CaptureReader(filename) as reader:
+                assert len(reader) >= NUM_SAMPLES
+    else:
+        with iqfile.CaptureReader(output_file) as reader:
+            assert reader.num_channels == 2
+            assert len(reader.channel(1)) >= NUM_SAMPLES
+
+
+def test_rx_invalid_mode(rx_params, logger):
+    rx_params["capture_mode"] = "bogus"
+    with pytest.raises(RuntimeError):
+        _rx(rx_params, logger)
+
+
+def _tx(params, logger):
+    sdr = simulator.SimulatedBladeRF()
+    bladerf_tx_cw.bladerf_cw_tone_tx(params, logger, sdr=sdr)
+    return sdr
+
+
+def test_tx_static(tx_params, logger):
+    sdr = _tx(tx_params, logger)
+    assert sdr.samples_tx >= NUM_SAMPLES
+
+
+@pytest.mark.parametrize("signal", ["sweep", "hop"])
+def test_tx_stream(tx_params, logger, signal):
+    tx_params.update(tx_mode="stream", signal=signal, sweep_start=-1e5,
+                     sweep_stop=1e5, sweep_step=5e4, hop_freqs=[1e4, 2e4],
+                     hop_seed=0, dwell_time=0.01, tx_block_samples=8192)
+    sdr = _tx(tx_params, logger)
+
+    assert sdr.samples_tx == NUM_SAMPLES
+
+
+def test_tx_stream_tone(tx_params, logger):
+    tx_params.update(tx_mode="stream", signal="tone", tx_block_samples=8192)
+    sdr = _tx(tx_params, logger)
+
+    assert sdr.samples_tx == NUM_SAMPLES
+
+
+def test_tx_replay(tx_params, logger, tmp_path, sc16_samples):
+    replay_file = str(tmp_path / "replay.iqbin")
+    metadata = {"sample_rate": SAMPLE_RATE}
+    with iqfile.CaptureWriter(replay_file, metadata) as out_file:
+        out_file.write(sc16_samples)
+
+    tx_params.update(tx_mode="replay", replay_file=replay_file,
+                     replay_loop=True, tx_block_samples=4096)
+    sdr = _tx(tx_params, logger)
+
+    assert sdr.samples_tx == NUM_SAMPLES
+
+
+def test_benchmark_rx(rx_params, logger):
+    results = simulator.benchmark_rx(["file", "memory"], rx_params, DURATION,
+                                     logger)
+
+    assert set(results) == {"file", "memory"}
+    assert all(rate > 0 for rate in results.values())
+
+
+def test_measure_stream_tx_throughput():
+    # * The device ring alone holds 0.1 sec of samples, which must not count
+    # * towards the measured throughput
+    sdr = simulator.SimulatedBladeRF(realtime=True)
+    channel = simulator.CHANNEL_TX(0)
+    sdr.Channel(channel).sample_rate = SAMPLE_RATE
+    config = dict(stream_tuning.DEFAULT_CONFIGS["tx"], num_buffers=25,
+                  host_buffer_size=4096)
+
+    result = stream_tuning.measure_stream(sdr, channel, "tx", config,
+                                          SAMPLE_RATE, 0.2)
+
+    assert result["throughput"] < 1.1 * SAMPLE_RATE
+
+
+def test_bladerf_constants():
+    sdr = simulator.SimulatedBladeRF()
+    bladerf_api = simulator.bladerf_constants(sdr)
+
+    assert bladerf_api is simulator
+    assert sdr.Channel(bladerf_api.CHANNEL_TX(0)).is_tx
+    assert not sdr.Channel(bladerf_api.CHANNEL_RX(1)).is_tx
+    assert (bladerf_api.ChannelLayout(bladerf_api.CHANNEL_RX(0))
+            == bladerf_api.ChannelLayout.RX_X1)
@@ -0,0 +1,77 @@
+"""Tests for the hardware timestamp gap tracker"""
+
+import numpy as np
+
+import timestamps
+
+
+def test_continuous_blocks():
+    tracker = timestamps.GapTracker()
+    for block in range(10):
+        tracker.record(5000 + 1024 * block, 1024, 0)
+
+    assert tracker.valid
+    assert tracker.num_gaps == 0
+    assert tracker.lost_samples == 0
+    assert tracker.first_timestamp == 5000
+    assert tracker.num_samples == 10240
+    assert tracker.gaps().shape == (0, 3)
+
+
+def test_gap_detection():
+    tracker = timestamps.GapTracker()
+    tracker.record(0, 1024, 0)
+    tracker.record(1024, 1024, 0)
+    # * 512 samples dropped before the third block
+    tracker.record(2560, 1024, timestamps.META_STATUS_OVERRUN)
+    tracker.record(3584, 1024, 0)
+    # * Timestamp going back
+    tracker.record(4000, 1024, 0)
+
+    assert not tracker.valid
+    assert tracker.num_gaps == 2
+    assert tracker.overruns == 1
+    assert tracker.lost_samples == 512 - 608
+    np.testing.assert_array_equal(
+        tracker.gaps(), [[2048, 2048, 512], [4096, 4608, -608]]
+    )
+    np.testing.assert_array_equal(
+        tracker.blocks(),
+        [[0, 0], [1024, 1024], [2048, 2560], [3072, 3584], [4096, 4000]]
+    )
+
+
+def test_overrun_flag_alone_invalidates():
+    tracker = timestamps.GapTracker()
+    tracker.record(0, 1024, timestamps.META_STATUS_OVERRUN)
+
+    assert tracker.num_gaps == 0
+    assert not tracker.valid
+
+
+def test_save_and_load(tmp_path):
+    filename = str(tmp_path / "capture.iqbin")
+    tracker = timestamps.GapTracker()
+    tracker.record(0, 100, 0)
+    tracker.record(150, 100, 0)
+
+    assert tracker.save(filename) == timestamps.gap_index_filename(filename)
+    blocks, gaps = timestamps.load_gap_index(filename)
+
+    np.testing.assert_array_equal(blocks, tracker.blocks())
+    np.testing.assert_array_equal(gaps, tracker.gaps())
+    assert timestamps.valid_segments(gaps, 200) == [(0, 100), (100, 100)]
+
+
+def test_empty_read_counts_as_overrun():
+    tracker = timestamps.GapTracker()
+    tracker.record(0, 1024, 0)
+    tracker.record_empty()
+    tracker.record(2048, 1024, 0)
+
+    assert not tracker.valid
+    assert tracker.empty_reads == 1
+    assert tracker.overruns == 1
+    assert tracker.num_blocks == 2
+    assert tracker.lost_samples == 1024
+    assert tracker.summary()["empty_reads"] == 1
@@ -0,0 +1,135 @@
+"""Tests for the threshold-triggered recorder"""
+
+import numpy as np
+import pytest
+
+import iqfile
+import trigger
+
+PRE_TRIGGER = 100
+POST_TRIGGER = 200
+BLOCK_SIZES = [1, 97, 1024, 10000]
+
+
+def _stream(num_samples: int, bursts) -> np.ndarray:
+    # Quiet stream with full-scale samples at the given (start, length)
+    values = np.zeros((num_samples, 2), dtype=np.int16)
+    values[:, 0] = np.arange(num_samples) % 7
+    for start, length in bursts:
+        values[start:start + length] = (1000, -1000)
+    return values.reshape(-1)
+
+
+def _record(tmp_path, stream: np.ndarray, block_size: int):
+    filename = str(tmp_path / "events.iqbin")
+    with iqfile.CaptureWriter(filename) as out_file:
+        recorder = trigger.TriggeredRecorder(
+            out_file, -20.0, PRE_TRIGGER, POST_TRIGGER
+        )
+        for start in range(0, stream.size, 2 * block_size):
+            block = stream[start:start + 2 * block_size]
+            recorder.process(block.tobytes(), block.size // 2)
+        recorder.finish()
+
+    with iqfile.CaptureReader(filename) as reader:
+        recorded = np.array(reader.samples).reshape(-1)
+        assert reader.metadata["events"] == recorder.events
+
+    return recorder, recorded
+
+
+def _check_contents(recorder, recorded, stream):
+    # Every event holds its own span of the stream, back to back
+    expected = [stream[2 * event["start"]:
+                       2 * (event["start"] + event["length"])]
+                for event in recorder.events]
+    np.testing.assert_array_equal(recorded, np.concatenate(expected))
+
+
+@pytest.mark.parametrize("block_size", BLOCK_SIZES)
+def test_pre_and_post_trigger_lengths(tmp_path, block_size):
+    stream = _stream(10000, [(5000, 10)])
+    recorder, recorded = _record(tmp_path, stream, block_size)
+
+    assert recorder.events == [{
+        "start": 5000 - PRE_TRIGGER,
+        "trigger": 5000,
+        "offset": 0,
+        "length": PRE_TRIGGER + 10 + POST_TRIGGER,
+    }]
+    assert recorder.samples_seen == 10000
+    _check_contents(recorder, recorded, stream)
+
+
+@pytest.mark.parametrize("block_size", BLOCK_SIZES)
+def test_pre_trigger_clipped_at_stream_start(tmp_path, block_size):
+    stream = _stream(10000, [(30, 1)])
+    recorder, recorded = _record(tmp_path, stream, block_size)
+
+    assert len(recorder.events) == 1
+    assert recorder.events[0]["start"] == 0
+    assert recorder.events[0]["length"] == 30 + 1 + POST_TRIGGER
+    _check_contents(recorder, recorded, stream)
+
+
+@pytest.mark.parametrize("block_size", BLOCK_SIZES)
+def test_post_trigger_clipped_at_stream_end(tmp_path, block_size):
+    stream = _stream(10000, [(9950, 1)])
+    recorder, recorded = _record(tmp_path, stream, block_size)
+
+    assert recorder.events[0]["length"] == PRE_TRIGGER + 50
+    assert recorder.triggered
+    _check_contents(recorder, recorded, stream)
+
+
+@pytest.mark.parametrize("block_size", BLOCK_SIZES)
+def test_close_bursts_merge(tmp_path, block_size):
+    # * The second burst falls inside the post-trigger of the first
+    stream = _stream(10000, [(1000, 1), (1150, 1)])
+    recorder, recorded = _record(tmp_path, stream, block_size)
+
+    assert len(recorder.events) == 1
+    assert recorder.events[0]["trigger"] == 1000
+    assert recorder.events[0]["length"] == (
+        PRE_TRIGGER + 150 + 1 + POST_TRIGGER
+    )
+    _check_contents(recorder, recorded, stream)
+
+
+@pytest.mark.parametrize("block_size", BLOCK_SIZES)
+def test_separate_events(tmp_path, block_size):
+    # * The pre-trigger of the second event overlaps the first, so it
+    # * starts where the first one ended
+    first_end = 1000 + 1 + POST_TRIGGER
+    stream = _stream(10000, [(1000, 1), (first_end + 50, 1), (6000, 5)])
+    recorder, recorded = _record(tmp_path, stream, block_size)
+
+    assert [event["trigger"] for event in recorder.events] == [
+        1000, first_end + 50, 6000
+    ]
+    assert [event["start"] for event in recorder.events] == [
+        1000 - PRE_TRIGGER, first_end, 6000 - PRE_TRIGGER
+    ]
+    assert [event["length"] for event in recorder.events] == [
+        PRE_TRIGGER + 1 + POST_TRIGGER,
+        50 + 1 + POST_TRIGGER,
+        PRE_TRIGGER + 5 + POST_TRIGGER,
+    ]
+
+    offsets = np.cumsum([0] + [e["length"] for e in recorder.events[:-1]])
+    assert [event["offset"] for event in recorder.events] == list(offsets)
+    _check_contents(recorder, recorded, stream)
+
+
+def test_quiet_stream(tmp_path):
+    stream = _stream(5000, [])
+    recorder, recorded = _record(tmp_path, stream, 1024)
+
+    assert recorder.events == []
+    assert recorded.size == 0
+
+
+def test_negative_lengths(tmp_path):
+    with iqfile.CaptureWriter(str(tmp_path / "events.iqbin")) as out_file:
+        with pytest.raises(ValueError):
+            trigger.TriggeredRecorder(out_file, -20.0, -1, 0)
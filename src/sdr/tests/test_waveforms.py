@@ -0,0 +1,123 @@
+"""Tests for SC16 packing and the Tx signal generators"""
+
+import numpy as np
+import pytest
+
+import iqfile
+import waveforms
+
+SAMPLE_RATE = 1e6
+
+
+def _generate(generator, num_samples: int, block_samples: int,
+              start: int = 0) -> np.ndarray:
+    out = np.zeros(num_samples, dtype=np.complex64)
+    for offset in range(0, num_samples, block_samples):
+        generator(start + offset, out[offset:offset + block_samples])
+    return out
+
+
+def test_pack_sc16_scaling():
+    samples = np.array([0.5 - 0.25j, 1.0 + 0j, -1.5 + 2j, 1e-4 - 1e-3j],
+                       dtype=np.complex64)
+    out = np.full(10, 99, dtype=np.int16)
+    work = np.zeros(10, dtype=np.float32)
+
+    packed = waveforms.pack_sc16(samples, 2047, out, work)
+
+    # * Rounded to the nearest count and clipped to full scale
+    np.testing.assert_array_equal(
+        packed, [1024, -512, 2047, 0, -2047, 2047, 0, -2]
+    )
+    assert packed.base is out
+    assert np.all(out[8:] == 99)
+
+
+def test_render_normalises_to_amplitude():
+    generator = waveforms.multitone(SAMPLE_RATE, [1e4, 5e4, -2e5])
+    values = waveforms.render(generator, 50000, amplitude=0.5,
+                              block_samples=4096).reshape(-1, 2)
+
+    peak = np.max(np.hypot(values[:, 0], values[:, 1]))
+    assert abs(peak - 0.5 * waveforms.FULL_SCALE) <= 1
+
+
+def test_render_to_file(tmp_path):
+    generator = waveforms.two_tone(SAMPLE_RATE, 1e4, 3e4)
+    filename = str(tmp_path / "two_tone.iqbin")
+    waveforms.render_to_file(generator, 10000, filename,
+                             {"sample_rate": SAMPLE_RATE}, amplitude=0.8,
+                             block_samples=3000)
+
+    with iqfile.CaptureReader(filename) as reader:
+        np.testing.assert_array_equal(
+            reader.read_raw(0, len(reader)).reshape(-1),
+            waveforms.render(generator, 10000, amplitude=0.8)
+        )
+
+
+@pytest.mark.parametrize("generator", [
+    waveforms.multitone(SAMPLE_RATE, [1e4, -3e4, 2e5]),
+    waveforms.chirp(SAMPLE_RATE, -1e5, 1e5, 3e-3),
+    waveforms.chirp(SAMPLE_RATE, 1e4, 2e5, 3e-3, method="log"),
+    waveforms.pn_sequence(7, samples_per_chip=3),
+], ids=["multitone", "chirp", "log_chirp", "pn"])
+def test_generators_independent_of_block_size(generator):
+    _check_block_size(generator)
+
+
+def test_frequency_steps_independent_of_block_size():
+    _check_block_size(
+        waveforms.frequency_steps(SAMPLE_RATE, [1e4, -5e4, 1e5], 1.1e-3)
+    )
+
+
+def _check_block_size(generator):
+    # Same samples whatever the block size or start index
+    reference = _generate(generator, 10000, 10000)
+
+    for block_samples in (1, 333, 4096):
+        np.testing.assert_allclose(
+            _generate(generator, 10000, block_samples), reference,
+            atol=1e-5
+        )
+    np.testing.assert_allclose(
+        _generate(generator, 5000, 777, start=5000), reference[5000:],
+        atol=1e-5
+    )
+
+
+@pytest.mark.parametrize("generator", [
+    waveforms.chirp(SAMPLE_RATE, -1e5, 1e5, 1e-3),
+    waveforms.chirp(SAMPLE_RATE, 1e4, 1.5e5, 1e-3, method="log"),
+], ids=["chirp", "log_chirp"])
+def test_chirp_phase_continuous(generator):
+    _check_phase_continuous(generator)
+
+
+def test_frequency_steps_phase_continuous():
+    _check_phase_continuous(
+        waveforms.frequency_steps(SAMPLE_RATE, [1e4, -5e4, 1e5], 1.1e-3)
+    )
+
+
+def _check_phase_continuous(generator):
+    # No sample-to-sample phase step larger than the highest frequency
+    signal = _generate(generator, 10000, 4096)
+    steps = np.angle(signal[1:] * np.conj(signal[:-1]))
+
+    assert np.max(np.abs(steps)) <= 2 * np.pi * 1.5e5 / SAMPLE_RATE + 1e-3
+
+
+def test_mls_balance():
+    bits = waveforms.mls(9)
+
+    assert bits.size == 511
+    assert np.count_nonzero(bits) == 256
+
+
+def test_invalid_chirp():
+    with pytest.raises(ValueError):
+        waveforms.chirp(SAMPLE_RATE, -1e4, 1e4, 1e-3, method="log")
+    with pytest.raises(ValueError):
+        waveforms.chirp(SAMPLE_RATE, 1e4, 2e4, 1e-3, method="cubic")
@@ -0,0 +1,235 @@
+"""Hardware timestamp tracking for metadata-aware Rx captures
+
+With the `SC16_Q11_META` format every `sync_rx` call fills in a metadata
+structure with the device timestamp of the first sample returned, in
+samples since the device was started, and flags any overrun that happened
+before it. A dropped USB transfer then shows up as a jump between the
+timestamp of a block and the end of the previous one.
+
+`GapTracker` follows these timestamps while capturing, and saves a compact
+index next to the capture: the timestamp of every block, and the position
+and length of every discontinuity. A capture can then be judged valid, or
+its lost-sample regions masked, from the index alone.
+"""
+
+import logging
+import os
+
+from array import array
+from typing import List, Tuple
+
+import numpy as np
+
+
+# * Values of the libbladeRF BLADERF_META_* constants
+META_FLAG_RX_NOW = 1 << 31
+META_STATUS_OVERRUN = 1 << 0
+
+
+def new_metadata(sdr: "_bladerf.BladeRF"):
+    """Allocates a metadata structure to pass to `sync_rx`
+
+    Args:
+        sdr: A `BladeRF`, or simulated, device object. Simulated devices
+             provide their own `new_metadata` method.
+
+    Returns:
+        An object with `timestamp`, `flags`, `status` and `actual_count`
+        fields, set to zero.
+    """
+
+    if hasattr(sdr, "new_metadata"):
+        return sdr.new_metadata()
+
+    # * Imported here, so that the gap index can be used without libbladeRF
+    from bladerf import _bladerf
+
+    return _bladerf.ffi.new("struct bladerf_metadata *")
+
+
+def gap_index_filename(filename: str) -> str:
+    """Returns the name of the gap index file for a capture file
+
+    Args:
+        filename: A `str` with the path to the capture file.
+
+    Returns:
+        A `str` with the capture file extension replaced by `.gaps.npz`.
+    """
+
+    return os.path.splitext(filename)[0] + ".gaps.npz"
+
+
+class GapTracker:
+    """Follows block timestamps and records discontinuities
+
+    Attributes:
+        num_blocks: An `int` with the number of blocks recorded.
+        num_samples: An `int` with the number of samples recorded, i.e. the
+                     file offset of the next block.
+        first_timestamp: An `int` with the timestamp of the first sample,
+                         or `None` before the first block.
+        overruns: An `int` with the number of blocks flagged with an
+                  overrun by the device, and of empty reads.
+        empty_reads: An `int` with the number of `sync_rx` calls which
+                     returned no samples at all.
+        lost_samples: An `int` with the total number of samples missing
+                      between blocks.
+    """
+
+    def __init__(self):
+        # * Growable arrays of int64, cheap to append to in the Rx loop
+        self._blocks = array("q")
+        self._gaps = array("q")
+
+        self.num_blocks = 0
+        self.num_samples = 0
+        self.first_timestamp = None
+        self.overruns = 0
+        self.empty_reads = 0
+        self.lost_samples = 0
+        self._expected = None
+
+    @property
+    def num_gaps(self) -> int:
+        """Number of discontinuities found so far"""
+        return len(self._gaps) // 3
+
+    @property
+    def valid(self) -> bool:
+        """Whether the capture so far has a continuous time base"""
+        return self.num_gaps == 0 and self.overruns == 0
+
+    def record(self, timestamp: int, num_samples: int, status: int) -> None:
+        """Records one received block
+
+        Args:
+            timestamp: An `int` with the device timestamp of the first
+                       sample of the block.
+            num_samples: An `int` with the number of samples in the block.
+            status: An `int` with the status flags returned by the device.
+        """
+
+        if self._expected is None:
+            self.first_timestamp = timestamp
+        elif timestamp != self._expected:
+            lost = timestamp - self._expected
+            self._gaps.extend((self.num_samples, self._expected, lost))
+            self.lost_samples += lost
+
+        if status & META_STATUS_OVERRUN:
+            self.overruns += 1
+
+        self._blocks.extend((self.num_samples, timestamp))
+        self.num_blocks += 1
+        self.num_samples += num_samples
+        self._expected = timestamp + num_samples
+
+    def record_empty(self) -> None:
+        """Records a `sync_rx` call which returned no samples
+
+        The device only comes back empty-handed if it has lost samples, so
+        this counts as an overrun. The samples lost show up as a gap once
+        the next block arrives.
+        """
+
+        self.empty_reads += 1
+        self.overruns += 1
+
+    def blocks(self) -> np.ndarray:
+        """Returns the block index
+
+        Returns:
+            An `np.ndarray` of `int64` with shape `(num_blocks, 2)`, holding
+            the file offset and the timestamp of every block.
+        """
+
+        return np.frombuffer(self._blocks, dtype=np.int64).reshape(-1, 2).copy()
+
+    def gaps(self) -> np.ndarray:
+        """Returns the gap index
+
+        Returns:
+            An `np.ndarray` of `int64` with shape `(num_gaps, 3)`, holding
+            the file offset of the first sample after each gap, the
+            timestamp that sample should have had, and the number of
+            samples lost. A negative count means the timestamp went back.
+        """
+
+        return np.frombuffer(self._gaps, dtype=np.int64).reshape(-1, 3).copy()
+
+    def summary(self) -> dict:
+        """Returns a JSON-serialisable summary for the capture sidecar"""
+
+        return {
+            "valid": self.valid,
+            "first_timestamp": self.first_timestamp,
+            "num_blocks": self.num_blocks,
+            "num_gaps": self.num_gaps,
+            "lost_samples": self.lost_samples,
+            "overruns": self.overruns,
+            "empty_reads": self.empty_reads,
+        }
+
+    def save(self, filename: str) -> str:
+        """Writes the block and gap index next to a capture file
+
+        Args:
+            filename: A `str` with the path to the capture file.
+
+        Returns:
+            A `str` with the path of the index file written.
+        """
+
+        index_file = gap_index_filename(filename)
+        with open(index_file, "wb") as out_file:
+            np.savez(out_file, blocks=self.blocks(), gaps=self.gaps())
+
+        return index_file
+
+    def log_summary(self, logger: logging.Logger) -> None:
+        """Writes a summary of the time base checks to the log"""
+
+        logger.info(
+            f"Timestamps: {self.num_blocks} blocks, {self.num_gaps} gaps, "
+            f"{self.lost_samples} samples lost, {self.overruns} overruns, "
+            f"{self.empty_reads} empty reads"
+        )
+        if not self.valid:
+            logger.warning("Capture time base is not continuous")
+
+
+def load_gap_index(filename: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Reads the index written by `GapTracker.save`
+
+    Args:
+        filename: A `str` with the path to the capture file.
+
+    Returns:
+        A `tuple` with the block and gap arrays, see `GapTracker.blocks` and
+        `GapTracker.gaps`.
+    """
+
+    with np.load(gap_index_filename(filename)) as index:
+        return index["blocks"], index["gaps"]
+
+
+def valid_segments(gaps: np.ndarray,
+                   num_samples: int) -> List[Tuple[int, int]]:
+    """Splits a capture into runs of samples with a continuous time base
+
+    Args:
+        gaps: An `np.ndarray` as returned by `GapTracker.gaps`.
+        num_samples: An `int` with the number of samples in the capture.
+
+    Returns:
+        A `list` of `(offset, length)` tuples, in samples, covering the
+        whole capture file.
+    """
+
+    edges = [0] + [int(offset) for offset in gaps[:, 0]] + [num_samples]
+
+    return [
+        (start, end - start) for start, end in zip(edges[:-1], edges[1:])
+        if end > start
+    ]
@@ -0,0 +1,189 @@
+"""Threshold-triggered capture with a pre-trigger ring buffer
+
+For burst measurements only the parts of the stream around a burst are of
+interest. `TriggeredRecorder` keeps the most recent samples in a fixed-size
+ring in memory, and checks the instantaneous power of every received sample
+against a threshold, so that bursts much shorter than a block are caught.
+An event starts at the first sample above the threshold: the pre-trigger
+samples before it are committed from the ring to the capture file, followed
+by the received samples, until the power has stayed below the threshold for
+the post-trigger length. Every event goes into the same capture file, and
+an index of them is stored in its sidecar.
+"""
+
+import logging
+
+import numpy as np
+
+import iqfile
+
+
+class TriggeredRecorder:
+    """Writes SC16 Q11 blocks around threshold crossings to a capture file
+
+    Attributes:
+        threshold_dbfs: A `float` with the trigger level, as the
+                        instantaneous power of a sample in dBFS.
+        pre_trigger: An `int` with the number of samples kept from before
+                     each trigger.
+        post_trigger: An `int` with the number of samples recorded after the
+                      last sample above the threshold.
+        events: A `list` of `dict`, one per event, with the `start` sample
+                of the event in the stream, the `trigger` sample where the
+                threshold was crossed, the `offset` of the event in the
+                capture file and its `length`, all in samples.
+        samples_seen: An `int` with the number of samples processed.
+    """
+
+    def __init__(self, out_file: iqfile.CaptureWriter, threshold_dbfs: float,
+                 pre_trigger: int, post_trigger: int):
+        """Allocates the pre-trigger ring
+
+        Args:
+            out_file: The `iqfile.CaptureWriter` to write events to.
+            threshold_dbfs: A `float` with the trigger level, in dBFS.
+            pre_trigger: An `int` with the number of pre-trigger samples.
+            post_trigger: An `int` with the number of post-trigger samples.
+
+        Raises:
+            ValueError: If `pre_trigger` or `post_trigger` is negative.
+        """
+
+        if pre_trigger < 0 or post_trigger < 0:
+            raise ValueError("Trigger lengths must not be negative")
+
+        self.out_file = out_file
+        self.threshold_dbfs = threshold_dbfs
+        self.pre_trigger = pre_trigger
+        self.post_trigger = post_trigger
+
+        # * Threshold on the sum of I^2 + Q^2, per sample, in raw counts
+        self._threshold = 10 ** (threshold_dbfs / 10) * 2048.0 ** 2
+
+        self._ring = np.zeros(2 * pre_trigger, dtype=np.int16)
+        self._ring_pos = 0
+        self._ring_fill = 0
+
+        self._power = np.zeros(0, dtype=np.int64)
+        self._remaining = 0
+        self.events = []
+        self.samples_seen = 0
+
+    @property
+    def triggered(self) -> bool:
+        """Whether an event is currently being recorded"""
+        return self._remaining > 0
+
+    def process(self, buffer, num_samples: int) -> None:
+        """Checks a received block and records the parts in events
+
+        Args:
+            buffer: A bytes-like object with interleaved SC16 Q11 values, as
+                    filled by `sync_rx`.
+            num_samples: An `int` with the number of valid samples.
+        """
+
+        block = np.frombuffer(buffer, dtype=np.int16, count=2 * num_samples)
+
+        if self._power.size < num_samples:
+            self._power = np.zeros(num_samples, dtype=np.int64)
+        power = self._power[:num_samples]
+        values = block.reshape(-1, 2)
+        np.einsum("ij,ij->i", values, values, out=power, dtype=np.int64)
+
+        crossings = np.flatnonzero(power > self._threshold)
+        position = 0
+
+        while position < num_samples:
+            pending = crossings[np.searchsorted(crossings, position):]
+
+            if self.triggered:
+                # * Event end, relative to the block, as known so far
+                end = position + self._remaining
+            else:
+                if pending.size == 0:
+                    self._push_ring(block[2 * position:])
+                    break
+
+                first = int(pending[0])
+                self._push_ring(block[2 * position:2 * first])
+                self._start_event(self.samples_seen + first)
+                position = first
+                end = first + 1 + self.post_trigger
+                pending = pending[1:]
+
+            # * The event goes on through every crossing before its end,
+            #   each one extending it by the post-trigger length
+            gaps = np.diff(pending, prepend=end - 1 - self.post_trigger)
+            breaks = np.flatnonzero((pending >= end)
+                                    & (gaps > self.post_trigger))
+            covered = pending[:breaks[0]] if breaks.size else pending
+            if covered.size:
+                end = max(end, int(covered[-1]) + 1 + self.post_trigger)
+
+            count = min(end, num_samples) - position
+            self.out_file.write(block[2 * position:2 * (position + count)])
+            self.events[-1]["length"] += count
+            self._remaining = end - position - count
+            position += count
+
+        self.samples_seen += num_samples
+
+    def _start_event(self, trigger: int) -> None:
+        ring_samples = self._ring_fill // 2
+        self.events.append({
+            "start": trigger - ring_samples,
+            "trigger": trigger,
+            "offset": self.out_file.num_samples,
+            "length": ring_samples,
+        })
+
+        # * Oldest ring samples first
+        if self._ring_fill == self._ring.size:
+            self.out_file.write(self._ring[self._ring_pos:])
+            self.out_file.write(self._ring[:self._ring_pos])
+        else:
+            self.out_file.write(self._ring[:self._ring_fill])
+
+        self._ring_pos = 0
+        self._ring_fill = 0
+
+    def _push_ring(self, block: np.ndarray) -> None:
+        size = self._ring.size
+        if size == 0 or block.size == 0:
+            return
+
+        if block.size >= size:
+            self._ring[:] = block[-size:]
+            self._ring_pos = 0
+            self._ring_fill = size
+            return
+
+        first = min(block.size, size - self._ring_pos)
+        self._ring[self._ring_pos:self._ring_pos + first] = block[:first]
+        self._ring[:block.size - first] = block[first:]
+
+        self._ring_pos = (self._ring_pos + block.size) % size
+        self._ring_fill = min(self._ring_fill + block.size, size)
+
+    def finish(self) -> None:
+        """Stores the event index in the sidecar of the capture file
+
+        The index is written out when the capture file is closed.
+        """
+
+        self.out_file.metadata["trigger"] = {
+            "threshold_dbfs": self.threshold_dbfs,
+            "pre_trigger": self.pre_trigger,
+            "post_trigger": self.post_trigger,
+        }
+        self.out_file.metadata["events"] = self.events
+
+    def log_summary(self, logger: logging.Logger) -> None:
+        """Writes a summary of the recorded events to the log"""
+
+        recorded = sum(event["length"] for event in self.events)
+        logger.info(
+            f"Trigger: {len(self.events)} events, {recorded} of "
+            f"{self.samples_seen} samples recorded"
+        )
@@ -0,0 +1,380 @@
+"""Background producer for streaming non-repeating signals to a bladeRF
+
+Looping one static buffer with `sync_tx` only works for periodic signals.
+For sweeps, hop sequences and long test signals the samples have to be
+generated while transmitting. The class here keeps that work off the Tx
+thread: a producer thread stays a fixed number of buffers ahead of the
+device, packing the next samples of the signal into whichever buffer the
+Tx thread last gave back, so the Tx thread does nothing but pass finished
+buffers to `sync_tx`. It is the Tx counterpart of
+`async_writer.AsyncWriter`.
+
+`ReplayProducer` uses the same ring to play back a recorded capture: the
+producer thread copies consecutive chunks out of the memory-mapped file,
+applying any gain in place in the pool buffers, so captures of any size
+play with a constant memory footprint and page faults never stall the Tx
+thread.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+import chunkfile
+import iqfile
+import waveforms
+
+
+class TxProducer:
+    """Generates a signal ahead of the Tx thread into a ring of buffers
+
+    Buffers cycle between two queues. The free pool holds buffers which are
+    ready to be filled by the producer thread, and the ready queue holds
+    buffers of packed SC16 Q11 samples waiting to be transmitted. Both are
+    bounded by the size of the pool, so memory use is fixed regardless of
+    the signal length.
+
+    The producer asks the generator for consecutive sample indices and the
+    Tx thread submits every buffer in order, so the signal stays phase
+    continuous across buffer boundaries, even after a starvation.
+
+    Attributes:
+        block_samples: An `int` with the number of samples per buffer.
+        num_buffers: An `int` with the number of buffers in the pool.
+        starvations: An `int` with the number of times the Tx thread had
+                     to wait for a ready buffer, i.e. the producer could not
+                     keep up. Whether the device actually ran out of samples
+                     is tracked by `telemetry.UnderrunMonitor`.
+        low_water: An `int` with the smallest number of ready buffers seen
+                   by the Tx thread after priming, while the signal was
+                   still being generated.
+        buffers_produced: An `int` with the number of buffers generated.
+        samples_produced: An `int` with the number of samples generated.
+        produce_time: A `float` with the time spent generating, in seconds.
+    """
+
+    def __init__(self, generator: waveforms.Generator, block_samples: int,
+                 amplitude: float = 1.0, num_buffers: int = 16,
+                 num_samples: Optional[int] = None,
+                 logger: Optional[logging.Logger] = None):
+        """Allocates the buffer pool and starts the producer thread
+
+        Args:
+            generator: A generator function from `waveforms`, e.g. from
+                       `waveforms.frequency_steps`, with sample magnitudes of
+                       at most 1. Generators with a `fill_sc16` method, such
+                       as `waveforms.NCO`, write SC16 values directly.
+            block_samples: An `int` with the number of samples per buffer,
+                           ideally a multiple of the stream buffer size.
+            amplitude: A `float` with the amplitude that a sample magnitude
+                       of 1 maps to, relative to full scale.
+            num_buffers: An `int` with the number of buffers in the pool.
+                         Together with `block_samples` this sets how long a
+                         producer stall can be absorbed.
+            num_samples: An optional `int` with the total number of samples
+                         to generate, unlimited by default.
+            logger: An optional `logging.Logger` object for diagnostics.
+
+        Raises:
+            ValueError: If `block_samples` or `num_buffers` is not positive,
+                        or `amplitude` is not in the range (0, 1].
+        """
+
+        if block_samples <= 0 or num_buffers <= 0:
+            raise ValueError("Buffer size and count must be positive")
+        if not 0 < amplitude <= 1:
+            raise ValueError("Amplitude must be in the range (0, 1]")
+
+        self.generator = generator
+        self.amplitude = amplitude
+        self.block_samples = block_samples
+        self.num_buffers = num_buffers
+        self.num_samples = num_samples
+        self.scale = amplitude * waveforms.FULL_SCALE
+        self.logger = logger if logger is not None else logging.getLogger()
+
+        self._free = queue.Queue(maxsize=num_buffers)
+        self._ready = queue.Queue(maxsize=num_buffers + 1)
+        for _ in range(num_buffers):
+            self._free.put_nowait(np.zeros(2 * block_samples, dtype=np.int16))
+
+        self._work = np.zeros(2 * block_samples, dtype=np.float32)
+        if generator is not None:
+            self._block = np.zeros(block_samples, dtype=np.complex64)
+
+        self.starvations = 0
+        self.low_water = num_buffers
+        self.buffers_produced = 0
+        self.samples_produced = 0
+        self.produce_time = 0.0
+
+        self._error: Optional[BaseException] = None
+        self._ended = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._produce, name="TxProducer", daemon=True
+        )
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def depth(self) -> int:
+        """Number of ready buffers currently waiting to be transmitted"""
+        # * Once the signal has ended the queue also holds its end marker
+        return max(0, self._ready.qsize() - self._ended)
+
+    def prime(self, timeout: Optional[float] = None) -> None:
+        """Waits until the pool is full of ready buffers or the signal ends
+
+        Called before enabling the Tx channel, so that the first buffers are
+        not counted as starvations.
+
+        Args:
+            timeout: An optional `float` with the longest wait, in seconds.
+
+        Raises:
+            RuntimeError: If the producer thread has failed.
+        """
+
+        deadline = None if timeout is None else time.perf_counter() + timeout
+
+        while (self._ready.qsize() < self.num_buffers
+               and self._thread.is_alive()):
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            time.sleep(0.001)
+
+        self._check_error()
+
+    def get_buffer(self) -> Optional[Tuple[np.ndarray, int]]:
+        """Takes the next ready buffer, waiting if none is available
+
+        Returns:
+            A `tuple` of the `np.ndarray` of `int16` holding the interleaved
+            samples and an `int` with the number of valid samples in it, to
+            be handed back with `release` once transmitted, or `None` when
+            the signal has ended.
+
+        Raises:
+            RuntimeError: If the producer thread has failed.
+        """
+
+        self._check_error()
+
+        # * The ring drains at the end of the signal, which is no starvation
+        depth = self.depth
+        if depth < self.low_water and not self._ended:
+            self.low_water = depth
+
+        try:
+            item = self._ready.get_nowait()
+        except queue.Empty:
+            self.starvations += 1
+            while True:
+                try:
+                    item = self._ready.get(timeout=0.5)
+                    break
+                except queue.Empty:
+                    self._check_error()
+
+        if item is None:
+            # * Leave the end marker for any later call
+            self._ready.put_nowait(None)
+
+        return item
+
+    def release(self, buffer: np.ndarray) -> None:
+        """Returns a transmitted buffer to the pool
+
+        Args:
+            buffer: An `np.ndarray` previously obtained from `get_buffer`.
+        """
+
+        self._free.put_nowait(buffer)
+
+    def close(self) -> None:
+        """Stops the producer thread
+
+        Raises:
+            RuntimeError: If the producer thread has failed.
+        """
+
+        self._stop.set()
+        self._thread.join()
+
+        self._check_error()
+
+    def log_stats(self) -> None:
+        """Writes a summary of the ring usage to the log"""
+
+        self.logger.info(
+            f"Producer: {self.buffers_produced} buffers, "
+            f"{self.samples_produced:.3e} samples generated in "
+            f"{self.produce_time:.3f} sec"
+        )
+        self.logger.info(
+            f"Producer ring low-water mark: {self.low_water} of "
+            f"{self.num_buffers} buffers"
+        )
+        if self.starvations:
+            self.logger.warning(
+                f"Tx thread waited for a ready buffer {self.starvations} "
+                f"times - signal generation is not keeping up"
+            )
+
+    def _check_error(self) -> None:
+        if self._error is not None:
+            raise RuntimeError("Tx producer thread failed") from self._error
+
+    def _fill(self, position: int, buffer: np.ndarray, count: int) -> None:
+        # Fills `buffer` with `count` samples from index `position` onwards
+        if hasattr(self.generator, "fill_sc16"):
+            self.generator.fill_sc16(position, buffer, count, self.amplitude)
+            return
+
+        self.generator(position, self._block[:count])
+        waveforms.pack_sc16(self._block[:count], self.scale, buffer,
+                            self._work)
+
+    def _produce(self) -> None:
+        position = 0
+
+        try:
+            while not self._stop.is_set():
+                if self.num_samples is not None:
+                    count = min(self.block_samples,
+                                self.num_samples - position)
+                    if count <= 0:
+                        break
+                else:
+                    count = self.block_samples
+
+                try:
+                    buffer = self._free.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+
+                start = time.perf_counter()
+                self._fill(position, buffer, count)
+                self.produce_time += time.perf_counter() - start
+
+                self._ready.put_nowait((buffer, count))
+                position += count
+                self.buffers_produced += 1
+                self.samples_produced += count
+        except BaseException as error:
+            self.logger.critical(f"Tx signal generation failed: {error}")
+            self._error = error
+        finally:
+            self._ended = True
+            self._ready.put_nowait(None)
+
+
+class ReplayProducer(TxProducer):
+    """Plays back a recorded capture through the ring of Tx buffers
+
+    Attributes:
+        start: An `int` with the index of the first sample played.
+        stop: An `int` with the index after the last sample played.
+        loop: A `bool`, set if playback wraps around from `stop` to `start`.
+        gain: A `float` with the linear gain applied to the samples.
+        clipped: An `int` with the number of values clipped to full scale
+                 because of the gain.
+    """
+
+    def __init__(self, reader: Union[iqfile.CaptureReader,
+                                     chunkfile.ChunkedReader],
+                 block_samples: int, start: int = 0,
+                 stop: Optional[int] = None, loop: bool = False,
+                 gain: float = 1.0, num_buffers: int = 16,
+                 num_samples: Optional[int] = None,
+                 logger: Optional[logging.Logger] = None):
+        """Checks the playback range and starts the producer thread
+
+        Args:
+            reader: An open `iqfile.CaptureReader`, which is memory mapped,
+                    or `chunkfile.ChunkedReader`.
+            block_samples: An `int` with the number of samples per buffer.
+            start: An `int` with the index of the first sample to play.
+            stop: An optional `int` with the index after the last sample to
+                  play, by default the end of the capture.
+            loop: A `bool`, if set playback wraps around until `num_samples`
+                  have been played, or forever.
+            gain: A `float` with the linear gain applied to the samples.
+                  Values are clipped to full scale.
+            num_buffers: An `int` with the number of buffers in the pool.
+            num_samples: An optional `int` with the total number of samples
+                         to play, by default the playback range once, or
+                         forever when looping.
+            logger: An optional `logging.Logger` object for diagnostics.
+
+        Raises:
+            ValueError: If the playback range is empty or outside the
+                        capture, or `gain` is not positive.
+        """
+
+        stop = len(reader) if stop is None else stop
+        if not 0 <= start < stop <= len(reader):
+            raise ValueError(
+                f"Invalid playback range [{start}, {stop}) for a capture of "
+                f"{len(reader)} samples"
+            )
+        if gain <= 0:
+            raise ValueError("Replay gain must be positive")
+
+        self.reader = reader
+        self.start = start
+        self.stop = stop
+        self.loop = loop
+        self.gain = gain
+        self.clipped = 0
+
+        if not loop:
+            num_samples = (stop - start if num_samples is None
+                           else min(num_samples, stop - start))
+
+        super().__init__(None, block_samples, 1.0, num_buffers, num_samples,
+                         logger)
+
+    def log_stats(self) -> None:
+        """Writes a summary of the ring usage and clipping to the log"""
+
+        super().log_stats()
+        if self.clipped:
+            self.logger.warning(
+                f"Replay gain clipped {self.clipped} values to full scale"
+            )
+
+    def _fill(self, position: int, buffer: np.ndarray, count: int) -> None:
+        length = self.stop - self.start
+        values = buffer[:2 * count].reshape(count, 2)
+        filled = 0
+
+        # * At most two pieces per buffer when it spans the loop point
+        while filled < count:
+            offset = self.start + (position + filled) % length
+            piece = min(count - filled, self.stop - offset)
+            np.copyto(values[filled:filled + piece],
+                      self.reader.read_raw(offset, piece))
+            filled += piece
+
+        if self.gain != 1.0:
+            work = self._work[:2 * count]
+            np.multiply(buffer[:2 * count], np.float32(self.gain), out=work)
+            np.rint(work, out=work)
+            self.clipped += int(np.count_nonzero(
+                np.abs(work) > waveforms.FULL_SCALE
+            ))
+            np.clip(work, -waveforms.FULL_SCALE, waveforms.FULL_SCALE,
+                    out=work)
+            np.copyto(buffer[:2 * count], work, casting="unsafe")
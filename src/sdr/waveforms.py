@@ -0,0 +1,915 @@
+"""Tx waveform generation, straight into SC16 Q11
+
+`sync_tx` is fed the same buffer over and over, so a CW tone is only clean
+if the buffer holds a whole number of tone periods; otherwise the phase
+jumps every time the buffer wraps around. The buffer should also be a whole
+number of stream buffers, so that every `sync_tx` call submits complete
+transfers. This module works out the shortest length meeting both
+conditions, generates the tone straight into SC16 Q11, and keeps the result
+on disk so later runs with the same settings only have to read a file.
+
+It also provides a library of test signals - multi-tone, two-tone, linear
+and logarithmic chirps, and PN / MLS sequences. Each signal is a generator
+function which fills a `complex64` block with the samples starting at any
+index. `render` and `render_to_file` run a generator block by block,
+peak-normalise to the Q11 range and pack every block into interleaved
+`int16` through its `float32` view, using a fixed set of block-sized work
+buffers. Signals of any length can therefore be generated into a
+preallocated array, or straight to a capture file, without full-size
+temporaries.
+
+Run this module as a script to render a test signal to a capture file.
+"""
+
+import argparse
+import logging
+import math
+import os
+
+from fractions import Fraction
+from typing import Callable, Optional, Sequence, Tuple
+
+import numpy as np
+
+import iqfile
+
+
+CACHE_DIR = "waveform_cache"
+
+# * Largest SC16 Q11 value, used as full scale
+FULL_SCALE = 2047
+
+# * Finest frequency resolution considered when looking for the period
+FREQ_RESOLUTION = 1000
+
+# * Primitive trinomials x^m + x^k + 1, as {m: k}, for MLS generation
+MLS_TAPS = {
+    2: 1, 3: 1, 4: 1, 5: 2, 6: 1, 7: 1, 9: 4, 10: 3, 11: 2, 15: 1, 17: 3,
+    18: 7, 20: 3, 21: 2, 22: 1, 23: 5, 25: 3,
+}
+
+CHIRP_METHODS = ("linear", "log")
+
+# * A generator fills its `complex64` argument with the samples starting at
+# * the given index
+Generator = Callable[[int, np.ndarray], None]
+
+
+def cw_period(sample_rate: float, freq_tone: float) -> Tuple[int, int]:
+    """Returns the exact period of a sampled tone
+
+    Args:
+        sample_rate: A `float` with the sample rate, in samples/sec.
+        freq_tone: A `float` with the tone offset from the LO, in Hz,
+                   resolved to 1 mHz.
+
+    Returns:
+        A `tuple` of `int`, the number of tone cycles and the number of
+        samples after which the sampled tone repeats exactly.
+    """
+
+    ratio = (Fraction(freq_tone).limit_denominator(FREQ_RESOLUTION)
+             / Fraction(sample_rate).limit_denominator(FREQ_RESOLUTION))
+
+    return ratio.numerator, ratio.denominator
+
+
+def cw_length(sample_rate: float, freq_tone: float, granularity: int,
+              max_length: int = 1 << 24) -> Tuple[int, int]:
+    """Finds the shortest phase-continuous buffer length for a tone
+
+    Args:
+        sample_rate: A `float` with the sample rate, in samples/sec.
+        freq_tone: A `float` with the tone offset from the LO, in Hz.
+        granularity: An `int` with the number of samples the length must be
+                     a multiple of, e.g. the stream buffer size.
+        max_length: An `int` with the longest acceptable length. If the
+                    exact period needs more, the tone is moved to the
+                    nearest frequency that fits in `max_length` samples.
+
+    Returns:
+        A `tuple` of `int`, the buffer length and the number of tone cycles
+        in it.
+    """
+
+    cycles, period = cw_period(sample_rate, freq_tone)
+    length = period * granularity // math.gcd(period, granularity)
+
+    if length <= max_length:
+        return length, cycles * (length // period)
+
+    length = max(granularity, max_length // granularity * granularity)
+    return length, int(round(freq_tone * length / sample_rate))
+
+
+def generate_cw(length: int, cycles: int, amplitude: float = 1.0,
+                phase: float = 0.0) -> np.ndarray:
+    """Generates a CW tone as interleaved SC16 Q11 values
+
+    The phase of every sample is computed from integer arithmetic modulo
+    the buffer length, so the last sample leads exactly into the first.
+
+    Args:
+        length: An `int` with the number of samples.
+        cycles: An `int` with the number of tone cycles in the buffer, which
+                may be negative for tones below the LO.
+        amplitude: A `float` with the amplitude, relative to full scale.
+        phase: A `float` with the phase of the first sample, in radians.
+
+    Returns:
+        An `np.ndarray` of `int16` with `2 * length` interleaved I and Q
+        values.
+
+    Raises:
+        ValueError: If `amplitude` is not in the range (0, 1].
+    """
+
+    if not 0 < amplitude <= 1:
+        raise ValueError("Amplitude must be in the range (0, 1]")
+
+    index = np.arange(length, dtype=np.int64)
+    angle = (index * cycles % length).astype(np.float64)
+    angle *= 2 * np.pi / length
+    angle += phase
+
+    samples = np.empty((length, 2), dtype=np.int16)
+    scale = amplitude * FULL_SCALE
+    samples[:, 0] = np.rint(np.cos(angle) * scale)
+    samples[:, 1] = np.rint(np.sin(angle) * scale)
+
+    return samples.reshape(-1)
+
+
+def cw_cache_filename(sample_rate: float, freq_tone: float,
+                      amplitude: float, length: int,
+                      cache_dir: str = CACHE_DIR) -> str:
+    """Returns the cache file name for a CW waveform
+
+    Args:
+        sample_rate: A `float` with the sample rate, in samples/sec.
+        freq_tone: A `float` with the tone offset from the LO, in Hz.
+        amplitude: A `float` with the amplitude, relative to full scale.
+        length: An `int` with the buffer length, in samples.
+        cache_dir: A `str` with the cache directory.
+
+    Returns:
+        A `str` with the path of the cached SC16 Q11 file.
+    """
+
+    return os.path.join(
+        cache_dir,
+        f"cw_{sample_rate!r}_{freq_tone!r}_{amplitude!r}_{length}.sc16"
+    )
+
+
+def cw_waveform(sample_rate: float, freq_tone: float,
+                amplitude: float = 1.0, granularity: int = 1024,
+                cache_dir: Optional[str] = CACHE_DIR,
+                max_length: int = 1 << 24,
+                logger: Optional[logging.Logger] = None) -> bytes:
+    """Returns a phase-continuous CW buffer, from the cache if possible
+
+    Args:
+        sample_rate: A `float` with the sample rate, in samples/sec.
+        freq_tone: A `float` with the tone offset from the LO, in Hz.
+        amplitude: A `float` with the amplitude, relative to full scale.
+        granularity: An `int` with the number of samples the buffer length
+                     must be a multiple of.
+        cache_dir: A `str` with the cache directory, created if needed, or
+                   `None` to always generate the waveform.
+        max_length: An `int` with the longest acceptable buffer length, see
+                    `cw_length`.
+        logger: An optional `logging.Logger` object for diagnostics.
+
+    Returns:
+        A `bytes` object with the interleaved SC16 Q11 samples, ready to be
+        passed to `sync_tx`.
+
+    Raises:
+        ValueError: If `amplitude` is not in the range (0, 1].
+    """
+
+    logger = logger if logger is not None else logging.getLogger()
+
+    length, cycles = cw_length(sample_rate, freq_tone, granularity,
+                               max_length)
+    actual_freq = cycles * sample_rate / length
+    if not math.isclose(actual_freq, freq_tone, abs_tol=1e-3):
+        logger.warning(
+            f"Tone moved from {freq_tone:.3f} Hz to {actual_freq:.3f} Hz to "
+            f"fit in {length} samples"
+        )
+
+    filename = None
+    if cache_dir is not None:
+        filename = cw_cache_filename(sample_rate, freq_tone, amplitude,
+                                     length, cache_dir)
+        try:
+            with open(filename, "rb") as cache_file:
+                waveform = cache_file.read()
+        except FileNotFoundError:
+            pass
+        else:
+            logger.info(f"Loaded {length} sample CW waveform from {filename}")
+            return waveform
+
+    waveform = generate_cw(length, cycles, amplitude).tobytes()
+    logger.info(
+        f"Generated {length} sample CW waveform, {cycles} cycles of "
+        f"{actual_freq:.3f} Hz"
+    )
+
+    if filename is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # * Written under a temporary name so a partial file is never used
+        with open(filename + ".tmp", "wb") as cache_file:
+            cache_file.write(waveform)
+        os.replace(filename + ".tmp", filename)
+
+    return waveform
+
+
+def _work_buffer(work: dict, name: str, size: int,
+                 dtype: np.dtype) -> np.ndarray:
+    # Returns `size` elements of a buffer kept in `work`, grown only when a
+    # larger block than before is asked for
+    buffer = work.get(name)
+    if buffer is None or buffer.size < size:
+        buffer = work[name] = np.empty(size, dtype=dtype)
+
+    return buffer[:size]
+
+
+def _sample_index(work: dict, start: int, size: int) -> np.ndarray:
+    # Returns the `int64` sample indices `start` to `start + size - 1`
+    if work.get("ramp") is None or work["ramp"].size < size:
+        work["ramp"] = np.arange(size, dtype=np.int64)
+
+    index = _work_buffer(work, "index", size, np.int64)
+    np.add(work["ramp"][:size], start, out=index)
+
+    return index
+
+
+def _cis(cycles: np.ndarray, work: dict, out: np.ndarray) -> None:
+    # Writes exp(2j * pi * cycles) to `out`, with `cycles` wrapped to one
+    # cycle first so that the float32 phase keeps its precision
+    np.remainder(cycles, 1.0, out=cycles)
+
+    phase = _work_buffer(work, "phase", cycles.size, np.float32)
+    np.multiply(cycles, 2 * np.pi, out=phase, casting="same_kind")
+    np.cos(phase, out=out.real)
+    np.sin(phase, out=out.imag)
+
+
+def multitone(sample_rate: float, freqs: Sequence[float],
+              amplitudes: Optional[Sequence[float]] = None,
+              phases: Optional[Sequence[float]] = None) -> Generator:
+    """Returns a generator of a sum of tones
+
+    Args:
+        sample_rate: A `float` with the sample rate, in samples/sec.
+        freqs: A sequence of `float` with the tone offsets, in Hz.
+        amplitudes: An optional sequence of `float` with the relative
+                    amplitude of each tone, all equal by default.
+        phases: An optional sequence of `float` with the starting phase of
+                each tone, in radians. By default Schroeder phases are used,
+                which keep the crest factor of many tones low.
+
+    Returns:
+        A generator function for `render`.
+    """
+
+    freqs = np.asarray(freqs, dtype=np.float64)
+    num_tones = freqs.size
+
+    if amplitudes is None:
+        amplitudes = np.ones(num_tones)
+    if phases is None:
+        phases = -np.pi * np.arange(num_tones) ** 2 / num_tones
+
+    # * Cycles per sample, and starting phase, in cycles
+    steps = freqs / sample_rate
+    offsets = np.asarray(phases, dtype=np.float64) / (2 * np.pi)
+    amplitudes = np.asarray(amplitudes, dtype=np.float32)
+
+    work = {}
+
+    def generate(start: int, out: np.ndarray) -> None:
+        index = _sample_index(work, start, out.size)
+        cycles = _work_buffer(work, "cycles", out.size, np.float64)
+        tone = _work_buffer(work, "tone", out.size, np.complex64)
+        out[:] = 0
+
+        for step, offset, amplitude in zip(steps, offsets, amplitudes):
+            np.multiply(index, step, out=cycles)
+            cycles += offset
+            _cis(cycles, work, tone)
+            tone *= amplitude
+            out += tone
+
+    return generate
+
+
+def two_tone(sample_rate: float, freq_1: float, freq_2: float) -> Generator:
+    """Returns a generator of an equal-amplitude two-tone intermod signal
+
+    Args:
+        sample_rate: A `float` with the sample rate, in samples/sec.
+        freq_1: A `float` with the first tone offset, in Hz.
+        freq_2: A `float` with the second tone offset, in Hz.
+
+    Returns:
+        A generator function for `render`.
+    """
+
+    return multitone(sample_rate, (freq_1, freq_2), phases=(0.0, 0.0))
+
+
+def chirp(sample_rate: float, freq_start: float, freq_stop: float,
+          sweep_time: float, method: str = "linear") -> Generator:
+    """Returns a generator of a repeating frequency sweep
+
+    The frequency jumps back to `freq_start` at the end of every sweep, but
+    the phase is carried over, so the signal itself has no discontinuity.
+
+    Args:
+        sample_rate: A `float` with the sample rate, in samples/sec.
+        freq_start: A `float` with the offset at the start of the sweep, Hz.
+        freq_stop: A `float` with the offset at the end of the sweep, Hz.
+        sweep_time: A `float` with the duration of one sweep, in seconds.
+        method: A `str`, `linear` for a constant sweep rate, or `log` for a
+                constant number of octaves per second, which needs both
+                frequencies to be non-zero and of the same sign.
+
+    Returns:
+        A generator function for `render`.
+
+    Raises:
+        ValueError: If the method is unknown or the frequencies are invalid
+                    for a logarithmic sweep.
+    """
+
+    if method not in CHIRP_METHODS:
+        raise ValueError(f"Unknown chirp method: {method}")
+    if method == "log" and freq_start * freq_stop <= 0:
+        raise ValueError("Logarithmic chirp needs same-sign frequencies")
+
+    sweep_samples = max(1, int(round(sweep_time * sample_rate)))
+    sweep_time = sweep_samples / sample_rate
+
+    if method == "linear":
+        rate = (freq_stop - freq_start) / sweep_time
+        sweep_cycles = sweep_time * 0.5 * (freq_start + freq_stop)
+    else:
+        log_ratio = np.log(freq_stop / freq_start)
+        sweep_cycles = freq_start * sweep_time / log_ratio * np.expm1(log_ratio)
+
+    # * Phase advance of a whole sweep, in cycles, carried into the next
+    sweep_cycles -= np.floor(sweep_cycles)
+
+    work = {}
+
+    def generate(start: int, out: np.ndarray) -> None:
+        index = _sample_index(work, start, out.size)
+        sweeps = _work_buffer(work, "sweeps", out.size, np.int64)
+        np.divmod(index, sweep_samples, out=(sweeps, index))
+
+        time = _work_buffer(work, "time", out.size, np.float64)
+        np.divide(index, sample_rate, out=time)
+        cycles = _work_buffer(work, "cycles", out.size, np.float64)
+
+        if method == "linear":
+            np.multiply(time, 0.5 * rate, out=cycles)
+            cycles += freq_start
+            cycles *= time
+        else:
+            np.multiply(time, log_ratio / sweep_time, out=cycles)
+            np.expm1(cycles, out=cycles)
+            cycles *= freq_start * sweep_time / log_ratio
+
+        np.multiply(sweeps, sweep_cycles, out=time)
+        np.remainder(time, 1.0, out=time)
+        cycles += time
+        _cis(cycles, work, out)
+
+    return generate
+
+
+def frequency_steps(sample_rate: float, freqs: Sequence[float],
+                    dwell_time: float) -> Generator:
+    """Returns a generator of a tone stepping through a list of frequencies
+
+    Covers both stepped sweeps and hop sequences, depending on the order of
+    `freqs`. The list is repeated forever. The phase is carried over from
+    one step to the next, so the signal has no phase jumps at the steps.
+
+    Args:
+        sample_rate: A `float` with the sample rate, in samples/sec.
+        freqs: A sequence of `float` with the tone offset of each step, Hz.
+        dwell_time: A `float` with the time spent on each step, in seconds,
+                    rounded to a whole number of samples.
+
+    Returns:
+        A generator function for `render` or `tx_stream.TxProducer`.
+    """
+
+    freqs = np.asarray(freqs, dtype=np.float64)
+    dwell = max(1, int(round(dwell_time * sample_rate)))
+    sequence = dwell * freqs.size
+
+    # * Cycles per sample of each step, and phase at its start, in cycles
+    steps = freqs / sample_rate
+    step_cycles = steps * dwell
+    starts = np.concatenate(([0.0], np.cumsum(step_cycles)[:-1]))
+    starts -= np.floor(starts)
+    sequence_cycles = float(np.sum(step_cycles) % 1)
+
+    work = {}
+
+    def generate(start: int, out: np.ndarray) -> None:
+        index = _sample_index(work, start, out.size)
+        repeat = _work_buffer(work, "repeat", out.size, np.int64)
+        step = _work_buffer(work, "step", out.size, np.int64)
+        np.divmod(index, sequence, out=(repeat, index))
+        # * The offset into each step replaces the position in the sequence
+        np.divmod(index, dwell, out=(step, index))
+
+        cycles = _work_buffer(work, "cycles", out.size, np.float64)
+        term = _work_buffer(work, "term", out.size, np.float64)
+        np.multiply(repeat, sequence_cycles, out=cycles)
+        # * Steps are always in range, "clip" only avoids buffering
+        np.take(starts, step, out=term, mode="clip")
+        cycles += term
+        np.take(steps, step, out=term, mode="clip")
+        term *= index
+        cycles += term
+        _cis(cycles, work, out)
+
+    return generate
+
+
+def mls(order: int) -> np.ndarray:
+    """Generates a maximum length sequence
+
+    The linear recurrence of a primitive trinomial is evaluated in slices as
+    long as its shorter lag, instead of one bit at a time.
+
+    Args:
+        order: An `int` with the order of the sequence, a key of
+               `MLS_TAPS`.
+
+    Returns:
+        An `np.ndarray` of `uint8` with the `2 ** order - 1` bits of the
+        sequence.
+
+    Raises:
+        ValueError: If there is no trinomial for `order`.
+    """
+
+    if order not in MLS_TAPS:
+        raise ValueError(f"No MLS taps for order {order}")
+
+    length = (1 << order) - 1
+    tap = MLS_TAPS[order]
+    # * The reciprocal trinomial is primitive too, use the longer lag
+    lag = max(tap, order - tap)
+
+    bits = np.zeros(length + order, dtype=np.uint8)
+    bits[:order] = 1
+
+    position = order
+    while position < bits.size:
+        end = min(position + lag, bits.size)
+        np.bitwise_xor(
+            bits[position - order:end - order], bits[position - lag:end - lag],
+            out=bits[position:end]
+        )
+        position = end
+
+    return bits[:length]
+
+
+def pn_sequence(order: int, samples_per_chip: int = 1) -> Generator:
+    """Returns a generator of a BPSK-modulated maximum length sequence
+
+    Args:
+        order: An `int` with the order of the sequence, a key of
+               `MLS_TAPS`. The sequence repeats every `2 ** order - 1`
+               chips.
+        samples_per_chip: An `int` with the number of samples per chip.
+
+    Returns:
+        A generator function for `render`.
+
+    Raises:
+        ValueError: If there is no trinomial for `order`.
+    """
+
+    chips = 1 - 2 * mls(order).astype(np.float32)
+    work = {}
+
+    def generate(start: int, out: np.ndarray) -> None:
+        index = _sample_index(work, start, out.size)
+        index //= samples_per_chip
+        values = _work_buffer(work, "values", out.size, np.float32)
+        # * Indices wrap around the sequence, and only unbuffered modes of
+        # * take write to `out` directly
+        np.take(chips, index, out=values, mode="wrap")
+        out.real = values
+        out.imag = 0
+
+    return generate
+
+
+class NCO:
+    """Numerically controlled oscillator with a sine/cosine lookup table
+
+    The phase is a 32-bit integer accumulator, advanced by a fixed step per
+    sample with wrap-around, and its top `table_bits` bits index a table of
+    one cycle of the complex exponential. Integer phase never loses
+    precision, and the phase of any sample index is exact, so chunks can be
+    generated in any order or size and always join up continuously. The
+    remaining phase bits optionally drive a linear interpolation between
+    table entries, which lowers the phase truncation spurs from about
+    `6 * table_bits` dBc to well below the SC16 Q11 quantisation.
+
+    An `NCO` object is a generator function for `render` and
+    `tx_stream.TxProducer`, and can also look up interleaved SC16 values
+    directly with `fill_sc16`.
+
+    Attributes:
+        sample_rate: A `float` with the sample rate, in samples/sec.
+        step: An `int` with the phase increment per sample, in units of
+              `2 ** -32` cycles.
+        phase: An `int` with the phase of sample 0, in the same units.
+        frequency: A `float` with the synthesised frequency, in Hz, which is
+                   the requested one rounded to `sample_rate / 2 ** 32`.
+        table_bits: An `int` with the base-2 logarithm of the table size.
+        interpolate: A `bool`, set if table entries are interpolated.
+        position: An `int` with the index of the next sample of `next_sc16`.
+    """
+
+    PHASE_BITS = 32
+
+    def __init__(self, sample_rate: float, freq: float, phase: float = 0.0,
+                 table_bits: int = 14, interpolate: bool = False):
+        """Builds the lookup table
+
+        Args:
+            sample_rate: A `float` with the sample rate, in samples/sec.
+            freq: A `float` with the tone offset from the LO, in Hz, which
+                  may be negative.
+            phase: A `float` with the phase of sample 0, in radians.
+            table_bits: An `int` with the base-2 logarithm of the table
+                        size, from 4 to 20.
+            interpolate: A `bool`, if set the table is linearly interpolated
+                         using the phase bits below the table index.
+
+        Raises:
+            ValueError: If `table_bits` is out of range.
+        """
+
+        if not 4 <= table_bits <= 20:
+            raise ValueError("Table bits must be in the range [4, 20]")
+
+        modulus = 1 << self.PHASE_BITS
+        self.sample_rate = sample_rate
+        self.step = int(round(freq / sample_rate * modulus)) % modulus
+        self.phase = int(round(phase / (2 * np.pi) * modulus)) % modulus
+        signed_step = (self.step - modulus if self.step >= modulus // 2
+                       else self.step)
+        self.frequency = signed_step * sample_rate / modulus
+        self.table_bits = table_bits
+        self.interpolate = interpolate
+        self.position = 0
+
+        size = 1 << table_bits
+        self._shift = self.PHASE_BITS - table_bits
+        # * One extra entry, so interpolation never has to wrap the index
+        self._table = np.exp(
+            2j * np.pi * np.arange(size + 1) / size
+        ).astype(np.complex64)
+        self._delta = np.diff(self._table)
+        self._sc16_tables = {}
+
+        self._size = 0
+        self._reserve(1 << 16)
+
+    def phase_at(self, index: int) -> int:
+        """Returns the exact phase of sample `index`, in `2 ** -32` cycles"""
+
+        return (self.phase + index * self.step) % (1 << self.PHASE_BITS)
+
+    def __call__(self, start: int, out: np.ndarray) -> None:
+        """Fills a `complex64` block with the samples from index `start`"""
+
+        count = out.size
+        index = self._table_index(start, count)
+        np.take(self._table, index, out=out)
+
+        if self.interpolate:
+            # * Phase bits below the index, as a fraction of a table step
+            phases = self._phases[:count]
+            fraction = self._fraction[:count]
+            np.bitwise_and(phases, np.uint32((1 << self._shift) - 1),
+                           out=phases)
+            np.multiply(phases, np.float32(2.0 ** -self._shift),
+                        out=fraction)
+
+            correction = self._correction[:count]
+            np.take(self._delta, index, out=correction)
+            correction *= fraction
+            out += correction
+
+    def fill_sc16(self, start: int, out: np.ndarray, count: int,
+                  amplitude: float = 1.0) -> np.ndarray:
+        """Fills a buffer with interleaved SC16 Q11 samples from `start`
+
+        Without interpolation the values come straight from a table of
+        packed `int16` pairs, so there is no floating point work at all.
+
+        Args:
+            start: An `int` with the index of the first sample.
+            out: An `np.ndarray` of `int16` with room for `2 * count` values.
+            count: An `int` with the number of samples to generate.
+            amplitude: A `float` with the amplitude, relative to full scale.
+
+        Returns:
+            The filled view of `out`.
+        """
+
+        values = out[:2 * count]
+
+        if not self.interpolate:
+            index = self._table_index(start, count)
+            np.take(self._sc16_table(amplitude), index, axis=0,
+                    out=values.reshape(count, 2))
+            return values
+
+        self._reserve(count)
+        block = self._block[:count]
+        self(start, block)
+
+        return pack_sc16(block, amplitude * FULL_SCALE, values, self._work)
+
+    def next_sc16(self, out: np.ndarray, count: int,
+                  amplitude: float = 1.0) -> np.ndarray:
+        """Fills a buffer with the next `count` samples and advances
+
+        Args:
+            out: An `np.ndarray` of `int16` with room for `2 * count` values.
+            count: An `int` with the number of samples to generate.
+            amplitude: A `float` with the amplitude, relative to full scale.
+
+        Returns:
+            The filled view of `out`.
+        """
+
+        values = self.fill_sc16(self.position, out, count, amplitude)
+        self.position += count
+
+        return values
+
+    def _reserve(self, count: int) -> None:
+        # Grows the work buffers to hold at least `count` samples
+        if count <= self._size:
+            return
+
+        self._size = count
+        # * uint32 arithmetic wraps around, like the accumulator
+        self._ramp = np.arange(count, dtype=np.uint32) * np.uint32(self.step)
+        self._phases = np.zeros(count, dtype=np.uint32)
+        self._index = np.zeros(count, dtype=np.uint32)
+        self._fraction = np.zeros(count, dtype=np.float32)
+        self._correction = np.zeros(count, dtype=np.complex64)
+        self._block = np.zeros(count, dtype=np.complex64)
+        self._work = np.zeros(2 * count, dtype=np.float32)
+
+    def _table_index(self, start: int, count: int) -> np.ndarray:
+        # Computes the phase of every sample, and returns the table indices
+        self._reserve(count)
+
+        phases = self._phases[:count]
+        np.add(self._ramp[:count], np.uint32(self.phase_at(start)),
+               out=phases)
+
+        return np.right_shift(phases, self._shift, out=self._index[:count])
+
+    def _sc16_table(self, amplitude: float) -> np.ndarray:
+        if amplitude not in self._sc16_tables:
+            if not 0 < amplitude <= 1:
+                raise ValueError("Amplitude must be in the range (0, 1]")
+            table = np.zeros((self._table.size, 2), dtype=np.int16)
+            pack_sc16(self._table, amplitude * FULL_SCALE,
+                      table.reshape(-1),
+                      np.zeros(2 * self._table.size, dtype=np.float32))
+            self._sc16_tables[amplitude] = table
+
+        return self._sc16_tables[amplitude]
+
+
+def _blocks(num_samples: int, block_samples: int):
+    for start in range(0, num_samples, block_samples):
+        yield start, min(block_samples, num_samples - start)
+
+
+def peak_magnitude(generator: Generator, num_samples: int,
+                   block_samples: int = 1 << 16) -> float:
+    """Finds the largest sample magnitude of a signal, block by block
+
+    Args:
+        generator: A generator function, e.g. from `multitone`.
+        num_samples: An `int` with the number of samples in the signal.
+        block_samples: An `int` with the number of samples per block.
+
+    Returns:
+        A `float` with the peak magnitude.
+    """
+
+    block = np.zeros(block_samples, dtype=np.complex64)
+    power = np.zeros(block_samples, dtype=np.float32)
+    peak = 0.0
+
+    for start, count in _blocks(num_samples, block_samples):
+        generator(start, block[:count])
+        iq = block[:count].view(np.float32).reshape(count, 2)
+        np.einsum("ij,ij->i", iq, iq, out=power[:count])
+        peak = max(peak, float(power[:count].max()))
+
+    return math.sqrt(peak)
+
+
+def pack_sc16(samples: np.ndarray, scale: float, out: np.ndarray,
+              work: np.ndarray) -> np.ndarray:
+    """Scales `complex64` samples and packs them into interleaved `int16`
+
+    The `float32` view of `samples` already holds I and Q interleaved, so
+    the whole conversion is a multiply, a rounding and a cast, each done in
+    place in `work` or `out`.
+
+    Args:
+        samples: An `np.ndarray` of `complex64` samples.
+        scale: A `float` to multiply the samples by, in SC16 counts.
+        out: An `np.ndarray` of `int16` with room for `2 * samples.size`
+             values.
+        work: An `np.ndarray` of `float32` with room for `2 * samples.size`
+              values.
+
+    Returns:
+        The filled view of `out`.
+    """
+
+    count = 2 * samples.size
+    np.multiply(samples.view(np.float32), np.float32(scale),
+                out=work[:count])
+    np.rint(work[:count], out=work[:count])
+    np.clip(work[:count], -FULL_SCALE, FULL_SCALE, out=work[:count])
+    np.copyto(out[:count], work[:count], casting="unsafe")
+
+    return out[:count]
+
+
+def _render_blocks(generator: Generator, num_samples: int, amplitude: float,
+                   normalise: bool, block_samples: int,
+                   out: Optional[np.ndarray] = None):
+    # Yields the start of every block and its packed SC16 values, which are
+    # packed straight into `out` if given, or else into a reused scratch
+    # buffer that is only valid until the next block
+    peak = (peak_magnitude(generator, num_samples, block_samples)
+            if normalise else 1.0)
+    scale = amplitude * FULL_SCALE / max(peak, 1e-12)
+
+    block = np.zeros(block_samples, dtype=np.complex64)
+    work = np.zeros(2 * block_samples, dtype=np.float32)
+    packed = (np.zeros(2 * block_samples, dtype=np.int16)
+              if out is None else None)
+
+    for start, count in _blocks(num_samples, block_samples):
+        generator(start, block[:count])
+        dest = packed if out is None else out[2 * start:2 * (start + count)]
+        yield start, pack_sc16(block[:count], scale, dest, work)
+
+
+def render(generator: Generator, num_samples: int, amplitude: float = 1.0,
+           out: Optional[np.ndarray] = None, normalise: bool = True,
+           block_samples: int = 1 << 16) -> np.ndarray:
+    """Generates a signal into an interleaved SC16 Q11 buffer
+
+    Args:
+        generator: A generator function, e.g. from `multitone`.
+        num_samples: An `int` with the number of samples to generate.
+        amplitude: A `float` with the peak amplitude, relative to full
+                   scale.
+        out: An optional `np.ndarray` of `int16`, e.g. an `np.memmap`, with
+             room for `2 * num_samples` values. Allocated if not given.
+        normalise: A `bool`, if set the signal is scaled so that its peak is
+                   at `amplitude`; this takes an extra pass over the signal.
+                   Otherwise a sample magnitude of 1 maps to `amplitude`.
+        block_samples: An `int` with the number of samples per block.
+
+    Returns:
+        The `np.ndarray` of `int16` with the interleaved I and Q values.
+    """
+
+    if out is None:
+        out = np.zeros(2 * num_samples, dtype=np.int16)
+
+    for _ in _render_blocks(generator, num_samples, amplitude, normalise,
+                            block_samples, out):
+        pass
+
+    return out
+
+
+def render_to_file(generator: Generator, num_samples: int, filename: str,
+                   metadata: Optional[dict] = None, amplitude: float = 1.0,
+                   normalise: bool = True,
+                   block_samples: int = 1 << 16) -> None:
+    """Generates a signal straight into a capture file
+
+    Only block-sized buffers are used, whatever the length of the signal.
+
+    Args:
+        generator: A generator function, e.g. from `multitone`.
+        num_samples: An `int` with the number of samples to generate.
+        filename: A `str` with the path to the capture file.
+        metadata: An optional `dict` with the signal parameters, stored in
+                  the sidecar.
+        amplitude: A `float` with the peak amplitude, see `render`.
+        normalise: A `bool`, see `render`.
+        block_samples: An `int` with the number of samples per block.
+    """
+
+    with iqfile.CaptureWriter(filename, metadata) as out_file:
+        for _, packed in _render_blocks(generator, num_samples, amplitude,
+                                        normalise, block_samples):
+            out_file.write(packed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Render a Tx test signal to an SC16 Q11 capture file"
+    )
+    parser.add_argument(
+        "signal", choices=["multitone", "two_tone", "chirp", "pn"],
+        help="Type of signal to generate"
+    )
+    parser.add_argument("output", help="Output capture file")
+    parser.add_argument(
+        "--sample-rate", type=float, default=20e6,
+        help="Sample rate, in samples/sec [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--num-samples", type=int, default=1 << 20,
+        help="Number of samples to generate [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--freqs", type=float, nargs="+", default=[1e6, 1.1e6],
+        help="Tone offsets for multitone and two_tone, or start and stop "
+             "offsets for chirp, in Hz [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--sweep-time", type=float, default=1e-3,
+        help="Chirp sweep time, in seconds [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--chirp-method", choices=CHIRP_METHODS, default="linear",
+        help="Chirp sweep law [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--mls-order", type=int, choices=sorted(MLS_TAPS), default=15,
+        help="PN sequence order [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--samples-per-chip", type=int, default=1,
+        help="PN samples per chip [default=%(default)r]"
+    )
+    parser.add_argument(
+        "--amplitude", type=float, default=1.0,
+        help="Peak amplitude, relative to full scale [default=%(default)r]"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    waveform_logger = logging.getLogger("Waveforms")
+
+    if args.signal == "multitone":
+        signal = multitone(args.sample_rate, args.freqs)
+    elif args.signal == "two_tone":
+        signal = two_tone(args.sample_rate, *args.freqs[:2])
+    elif args.signal == "chirp":
+        signal = chirp(args.sample_rate, args.freqs[0], args.freqs[1],
+                       args.sweep_time, args.chirp_method)
+    else:
+        signal = pn_sequence(args.mls_order, args.samples_per_chip)
+
+    render_to_file(
+        signal, args.num_samples, args.output,
+        {"sample_rate": args.sample_rate, "signal": args.signal,
+         "freqs": args.freqs},
+        args.amplitude
+    )
+    waveform_logger.info(
+        f"Wrote {args.num_samples} samples of {args.signal} to {args.output}"
+    )